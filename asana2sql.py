@@ -1,29 +1,53 @@
 #!/usr/bin/env python
 
 import argparse
+import os
 import pyodbc
 import requests
+import threading
 
+from asana2sql import cassette
+from asana2sql import dialect
+from asana2sql import parallel
+from asana2sql import perf
+from asana2sql import rate_limit
 from asana2sql.fields import default_fields
+from asana2sql.metadata_cache import DEFAULT_METADATA_TTL_SECONDS
 from asana2sql.project import Project
-from asana2sql.workspace import Workspace
+from asana2sql.workspace import DEFAULT_CUSTOM_FIELD_TTL_SECONDS, Workspace
 from asana2sql.db_wrapper import DatabaseWrapper
+from asana2sql.sqlite_wrapper import SqliteDatabaseWrapper
 from asana import Client, session
+import asana.error
 
 def arg_parser():
     parser = argparse.ArgumentParser()
 
     # Global options
-    parser.add_argument(
+    projects_args = parser.add_mutually_exclusive_group(required=True)
+
+    projects_args.add_argument(
             '--project_id',
             type=int,
-            required=True,
-            help="Asana project ID.")
+            action="append",
+            help="Asana project ID.  Repeat to sync several projects.")
+
+    projects_args.add_argument(
+            '--team_id',
+            type=int,
+            help="Asana team ID.  Syncs all unarchived projects in the team.")
+
+    projects_args.add_argument(
+            '--workspace_id',
+            type=int,
+            help="Asana workspace ID.  "
+                 "Syncs all unarchived projects in the workspace.")
 
     parser.add_argument(
             '--table_name',
             help=("Name of the SQL table to use for tasks."
-                  "If not specified it will be derived from the project name."))
+                  "If not specified it will be derived from the project name. "
+                  "Only valid with a single project."))
 
     parser.add_argument(
             '--dump_perf',
@@ -31,6 +55,94 @@ def arg_parser():
             default=False,
             help="Print performance information on completion.")
 
+    parser.add_argument(
+            '--perf_json',
+            help="Write performance information to this file as JSON.")
+
+    parser.add_argument(
+            '--profile',
+            metavar="DIR",
+            help="Profile each phase of the run with cProfile and write the "
+                 "stats to DIR/<phase>.pstats.")
+
+    parser.add_argument(
+            '--skip_unchanged',
+            action="store_true",
+            default=False,
+            help="Skip tasks whose stored modified_at matches Asana's.")
+
+    parser.add_argument(
+            '--prefetch_tasks',
+            type=int,
+            default=0,
+            help="Fetch tasks from Asana in a background thread, up to this "
+                 "many ahead of the database writes.")
+
+    parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="Export or synchronize projects in this many processes, "
+                 "each with its own API client and database connection.")
+
+    parser.add_argument(
+            '--commit_every',
+            type=int,
+            default=0,
+            help="Commit and record a checkpoint every this many tasks.")
+
+    parser.add_argument(
+            '--resume',
+            action="store_true",
+            default=False,
+            help="Resume an interrupted export or synchronize from its last "
+                 "checkpoint.")
+
+    parser.add_argument(
+            '--collect_garbage',
+            action="store_true",
+            default=False,
+            help="After synchronize, delete the users, projects, custom fields "
+                 "and enum options that no task refers to any more.  Pass "
+                 "every project sharing the database, since the task tables "
+                 "of other projects are not checked.")
+
+    parser.add_argument(
+            '--custom_field_ttl',
+            type=float,
+            default=DEFAULT_CUSTOM_FIELD_TTL_SECONDS,
+            help="Seconds to keep custom field definitions before fetching "
+                 "them again.")
+
+    parser.add_argument(
+            '--metadata_cache',
+            metavar="PATH",
+            help="SQLite file keeping project data and custom field "
+                 "definitions between runs, so they need not be fetched from "
+                 "Asana each time.")
+
+    parser.add_argument(
+            '--metadata_cache_ttl',
+            type=float,
+            default=DEFAULT_METADATA_TTL_SECONDS,
+            help="Seconds to use metadata from --metadata_cache before "
+                 "fetching it again.")
+
+    parser.add_argument(
+            '--cache_max_rows',
+            type=int,
+            help="Hold at most this many rows of each of the users, projects "
+                 "and custom field enum values tables in memory, looking up "
+                 "the rest as needed.  By default the tables are loaded in "
+                 "full.")
+
+    parser.add_argument(
+            '--write_back_cache',
+            action="store_true",
+            default=False,
+            help="Hold back writes of changed users, projects and custom field "
+                 "enum values and write them in batches before each commit.")
+
     parser.add_argument("--projects_table_name")
     parser.add_argument("--project_memberships_table_name")
     parser.add_argument("--users_table_name")
@@ -38,14 +150,16 @@ def arg_parser():
     parser.add_argument("--custom_fields_table_name")
     parser.add_argument("--custom_field_enum_values_table_name")
     parser.add_argument("--custom_field_values_table_name")
+    parser.add_argument("--sync_state_table_name")
+    parser.add_argument("--checkpoints_table_name")
 
     # Asana Client options
     asana_args = parser.add_argument_group('Asana Client Options')
 
     asana_args.add_argument(
             "--access_token",
-            required=True,
-            help="Asana Personal Access Token for authentication.")
+            help="Asana Personal Access Token for authentication.  "
+                 "Required unless replaying API responses.")
 
     asana_args.add_argument(
             "--base_url",
@@ -65,19 +179,99 @@ def arg_parser():
             default=False,
             help="Dump API requests to STDOUT")
 
+    asana_args.add_argument(
+            "--requests_per_minute",
+            type=float,
+            default=rate_limit.DEFAULT_REQUESTS_PER_MINUTE,
+            help="Pace API requests to this rate, shared between workers.  "
+                 "Asana allows 150 per minute on free workspaces.")
+
+    asana_args.add_argument(
+            "--max_concurrent_requests",
+            type=int,
+            default=rate_limit.DEFAULT_MAX_CONCURRENT_REQUESTS,
+            help="Most API requests in flight per process.  The limit is "
+                 "lowered after rate limit errors and slow responses.")
+
+    asana_args.add_argument(
+            "--max_retries",
+            type=int,
+            default=rate_limit.DEFAULT_MAX_RETRIES,
+            help="Retry API requests that are rate limited or fail with a "
+                 "server error up to this many times.")
+
+    cassette_args = asana_args.add_mutually_exclusive_group()
+
+    cassette_args.add_argument(
+            "--record_api",
+            metavar="PATH",
+            help="Record every API response to a gzipped cassette at PATH.")
+
+    cassette_args.add_argument(
+            "--replay_api",
+            metavar="PATH",
+            help="Serve API responses from a cassette recorded with "
+                 "--record_api instead of the network.")
+
     # DB options
     db_args = parser.add_argument_group('Database Options')
 
-    db_args.add_argument(
+    connection_args = db_args.add_mutually_exclusive_group()
+
+    connection_args.add_argument(
             "--odbc_string",
             help="ODBC connection string.")
 
+    connection_args.add_argument(
+            "--sqlite_path",
+            help="Path of a SQLite database file, opened directly with sqlite3.")
+
+    db_args.add_argument(
+            "--dialect",
+            choices=list(dialect.DIALECTS.keys()),
+            default="sqlite",
+            help="SQL dialect of the database, used for upserts.  "
+                 "sqlite requires SQLite 3.24 or later; use sqlite_replace "
+                 "for older versions.")
+
+    db_args.add_argument(
+            "--bulk_load",
+            action="store_true",
+            default=False,
+            help="With --sqlite_path, relax durability settings and load in one "
+                 "transaction, restoring the settings afterwards.")
+
     db_args.add_argument(
             "--dump_sql",
             action="store_true",
             default=False,
             help="Dump SQL commands to STDOUT.")
 
+    db_args.add_argument(
+            "--buffered_writes",
+            action="store_true",
+            default=False,
+            help="Batch writes and send them with executemany.")
+
+    db_args.add_argument(
+            "--flush_rows",
+            type=int,
+            default=1000,
+            help="With --buffered_writes, flush after this many rows.")
+
+    db_args.add_argument(
+            "--flush_bytes",
+            type=int,
+            default=1 << 20,
+            help="With --buffered_writes, flush after roughly this many bytes "
+                 "of parameters.")
+
+    db_args.add_argument(
+            "--slow_query_ms",
+            type=float,
+            help="Print statements that take at least this many milliseconds, "
+                 "with their parameters.")
+
     db_args.add_argument(
             "--dry",
             action="store_true",
@@ -98,6 +292,13 @@ def arg_parser():
             help="Export the tasks in the project, "
                  "not deleting deleted tasks from the database.")
 
+    export_parser.add_argument(
+            '--incremental',
+            action="store_true",
+            default=False,
+            help="Only export tasks modified since the last successful "
+                 "export or synchronize of the project.")
+
     export_parser = subparsers.add_parser(
             'synchronize',
             help="Syncrhonize the tasks in the project with the database.")
@@ -105,9 +306,18 @@ def arg_parser():
     return parser
 
 def build_asana_client(args):
-    options = {
-        'session': session.AsanaOAuth2Session(
-            token={'access_token': args.access_token})}
+    if args.replay_api:
+        options = {'cassette': cassette.Cassette(args.replay_api)}
+    else:
+        options = {
+            'session': session.AsanaOAuth2Session(
+                token={'access_token': args.access_token})}
+    if args.record_api:
+        options['recorder'] = cassette.CassetteRecorder(args.record_api)
+    options['rate_limiter'] = rate_limit.RateLimiter(
+            args.requests_per_minute / 60.0 / args.workers,
+            args.max_concurrent_requests,
+            max_retries=args.max_retries)
 
     if args.base_url:
         options['base_url'] = args.base_url
@@ -120,52 +330,194 @@ def build_asana_client(args):
     return RequestCountingClient(**options);
 
 class RequestCountingClient(Client):
-    def __init__(self, dump_api=False, session=None, auth=None, **options):
+    """Counts API requests, paces and retries them with a RateLimiter, and
+    optionally records their responses to a cassette or serves them from one
+    instead of the network."""
+
+    def __init__(self, dump_api=False, recorder=None, cassette=None,
+                 rate_limiter=None, session=None, auth=None, **options):
         Client.__init__(self, session=session, auth=auth, **options)
         self._dump_api = dump_api
+        self._rate_limiter = rate_limiter
+        self._recorder = recorder
+        self._cassette = cassette
         self._num_requests = 0
+        self._lock = threading.Lock()
 
     @property
     def num_requests(self):
         return self._num_requests
 
+    @property
+    def num_retries(self):
+        return self._rate_limiter.num_retries if self._rate_limiter else 0
+
+    @property
+    def throttled_seconds(self):
+        return self._rate_limiter.throttled_seconds if self._rate_limiter else 0.0
+
     def request(self, method, path, **options):
         if self._dump_api:
             print("{}: {}".format(method, path))
-        self._num_requests += 1
-        return Client.request(self, method, path, **options)
-
-def main():
-    args = arg_parser().parse_args()
-
-    client = build_asana_client(args)
+        with self._lock:
+            self._num_requests += 1
+
+        if self._cassette:
+            return self._cassette.replay(cassette.request_key(
+                method, path, self._merge_options(options)))
+        if self._rate_limiter:
+            # The rate limiter does the retrying.
+            options = dict(options, max_retries=0)
+            return self._rate_limiter.call(
+                    lambda: self._send(method, path, options))
+        return self._send(method, path, options)
+
+    def _send(self, method, path, options):
+        if not self._recorder:
+            return Client.request(self, method, path, **options)
+
+        key = cassette.request_key(method, path, self._merge_options(options))
+        try:
+            response = Client.request(self, method, path, **options)
+        except asana.error.AsanaError as e:
+            # Retried errors are not recorded, so replays see only the
+            # final outcome.
+            if (e.status is not None and
+                    not isinstance(e, asana.error.RetryableAsanaError)):
+                self._recorder.record_error(key, e.status)
+            raise
+        self._recorder.record(key, response)
+        return response
+
+    def close(self):
+        if self._recorder:
+            self._recorder.close()
+
+def find_projects(client, args):
+    """Returns the projects to sync, with their modified_at when listed from
+    a team or workspace."""
+    if args.project_id:
+        return [{"id": project_id} for project_id in args.project_id]
+    with perf.phase("project_fetch"):
+        if args.team_id:
+            projects = client.projects.find_by_team(
+                    args.team_id, {"archived": False}, fields="id,modified_at")
+        else:
+            projects = client.projects.find_by_workspace(
+                    args.workspace_id, {"archived": False},
+                    fields="id,modified_at")
+        return list(projects)
+
+def build_db_wrapper(args):
+    options = {
+        'dump_sql': args.dump_sql,
+        'dry': args.dry,
+        'buffered': args.buffered_writes,
+        'flush_rows': args.flush_rows,
+        'flush_bytes': args.flush_bytes,
+        'slow_query_seconds': (args.slow_query_ms / 1000
+                               if args.slow_query_ms is not None else None),
+        }
+
+    if args.sqlite_path:
+        return SqliteDatabaseWrapper(args.sqlite_path, **options)
 
     db_client = None
     if args.odbc_string:
         print("Connecting to database.")
         db_client = pyodbc.connect(args.odbc_string)
 
-    db_wrapper = DatabaseWrapper(db_client, dump_sql=args.dump_sql, dry=args.dry)
-
-    workspace = Workspace(client, db_wrapper, args)
-    project = Project(
-            client, db_wrapper, workspace, args, default_fields(workspace))
+    return DatabaseWrapper(db_client, **options)
 
+def run_command(args, project_ids, workspace, projects):
+    """Runs the command and returns perf counters collected by any worker
+    processes."""
+    worker_counters = []
     if args.command == 'create':
-        project.create_table()
+        for project in projects:
+            project.create_table()
         workspace.create_tables()
+    elif args.workers > 1:
+        worker_counters.append(parallel.run_in_parallel(
+                args, project_ids, args.workers, workspace,
+                build_asana_client, build_db_wrapper))
     elif args.command == 'export':
-        project.export()
+        for project in projects:
+            project.export(incremental=args.incremental, resume=args.resume)
     elif args.command == 'synchronize':
-        project.synchronize()
+        for project in projects:
+            project.synchronize(resume=args.resume)
+    if args.command == 'synchronize' and args.collect_garbage:
+        collect_garbage(workspace, projects)
+    return worker_counters
+
+def collect_garbage(workspace, projects):
+    num_deleted = workspace.collect_garbage(
+            [reference for project in projects
+             for reference in project.user_references()])
+    print("Collected {} orphaned rows: {}.".format(
+        sum(num_deleted.values()),
+        ", ".join("{} from {}".format(count, table_name)
+                  for table_name, count in num_deleted.items())))
+
+def main():
+    parser = arg_parser()
+    args = parser.parse_args()
+
+    if not args.access_token and not args.replay_api:
+        parser.error("--access_token is required unless replaying with "
+                     "--replay_api.")
+    if args.collect_garbage and args.command != 'synchronize':
+        parser.error("--collect_garbage requires the synchronize command.")
+    if args.record_api and args.workers > 1:
+        parser.error("--record_api requires --workers 1.")
 
-    if not args.dry:
-        db_client.commit()
+    client = build_asana_client(args)
+
+    profiler = None
+    if perf.profiling_requested(args):
+        if args.profile and not os.path.isdir(args.profile):
+            os.makedirs(args.profile)
+        profiler = perf.Profiler(lambda: client.num_requests, args.profile)
+        perf.set_profiler(profiler)
+
+    found_projects = find_projects(client, args)
+    project_ids = [project["id"] for project in found_projects]
+    if args.table_name and len(project_ids) != 1:
+        parser.error("--table_name requires exactly one project.")
+    if args.bulk_load and not args.sqlite_path:
+        parser.error("--bulk_load requires --sqlite_path.")
 
+    db_wrapper = build_db_wrapper(args)
+
+    # All projects share one Workspace so its caches stay warm between them.
+    workspace = Workspace(client, db_wrapper, args)
+    workspace.set_project_modified_at(
+            {project["id"]: project["modified_at"]
+             for project in found_projects if project.get("modified_at")})
+    projects = [
+            Project(client, db_wrapper, workspace, args,
+                    default_fields(workspace), project_id=project_id)
+            for project_id in project_ids]
+
+    if args.bulk_load:
+        with db_wrapper.bulk_load():
+            worker_counters = run_command(args, project_ids, workspace, projects)
+    else:
+        worker_counters = run_command(args, project_ids, workspace, projects)
+
+    db_wrapper.commit()
+
+    counters = perf.merge_counters(
+            perf.counters(client, db_wrapper, projects), *worker_counters)
     if args.dump_perf:
-        print("API Requests: {}".format(client.num_requests))
-        print("DB Commands: reads = {}, writes = {}, executed = {}".format(
-            db_wrapper.num_reads, db_wrapper.num_writes, db_wrapper.num_commands_executed))
+        perf.print_counters(counters)
+    if args.perf_json:
+        perf.write_json(counters, args.perf_json)
+    if args.profile:
+        profiler.write_profiles()
+
+    client.close()
 
 if __name__ == '__main__':
     main()
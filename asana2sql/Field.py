@@ -25,6 +25,14 @@ class Field(object):
         """Get field data from the task object."""
         raise MethodNotImplementedError()
 
+    def extractor(self):
+        """Return a function from a task object to the field data.
+
+        Called once when a Project compiles its row plan.  Subclasses may return
+        a function specialized for their configuration.
+        """
+        return self.get_data_from_task
+
     def field_definition_sql(self):
         """Return the SQL required to define this field."""
         return FIELD_DEFINITION_TEMPLATE.format(
@@ -54,6 +62,25 @@ class SimpleField(Field):
         else:
             return data
 
+    def extractor(self):
+        name = self.name
+        default = self._default
+
+        if self.sql_type == SqlType.BOOLEAN:
+            def extract_boolean(task):
+                data = task.get(name)
+                if data is None:
+                    data = default
+                return "1" if data else "0"
+            return extract_boolean
+        elif default is None:
+            return lambda task: task.get(name)
+        else:
+            def extract(task):
+                data = task.get(name)
+                return default if data is None else data
+            return extract
+
     def field_definition_sql(self):
         if (self._primary_key):
             return PRIMARY_KEY_DEFINITION_TEMPLATE.format(
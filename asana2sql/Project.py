@@ -1,5 +1,9 @@
+from asana2sql import dialect
+from asana2sql import perf
+from asana2sql import pipeline
 from asana2sql import util
 import asana.error
+import datetime
 import itertools
 
 from asana2sql import fields
@@ -8,48 +12,112 @@ from asana2sql import workspace
 CREATE_TABLE_TEMPLATE = (
         """CREATE TABLE IF NOT EXISTS "{table_name}" ({columns});""")
 
-INSERT_OR_REPLACE_TEMPLATE = (
-        """INSERT OR REPLACE INTO "{table_name}" ({columns}) VALUES ({values});""")
-
 SELECT_TEMPLATE = (
         """SELECT {columns} FROM "{table_name}";""")
 
 DELETE_TEMPLATE = (
         """DELETE FROM "{table_name}" WHERE {id_column} = ?;""")
 
+LIVE_TASK_IDS_COLUMNS = "id INTEGER NOT NULL PRIMARY KEY"
+
+CLEAR_LIVE_TASK_IDS_TEMPLATE = (
+        """DELETE FROM "{table_name}";""")
+
+DROP_LIVE_TASK_IDS_TEMPLATE = (
+        """DROP TABLE "{table_name}";""")
+
+# Selects the ids of tasks in the task table that were not seen in Asana.
+REMOVED_TASK_IDS_TEMPLATE = (
+        """SELECT {id_column} FROM "{table_name}" WHERE {id_column} NOT IN (
+        SELECT id FROM "{live_table_name}")""")
+
+DELETE_REMOVED_TASKS_TEMPLATE = (
+        """DELETE FROM "{table_name}" WHERE {id_column} NOT IN (
+        SELECT id FROM "{live_table_name}");""")
+
+# Temporary table holding the ids of the tasks seen during a synchronize.
+LIVE_TASK_IDS_TABLE_NAME = "asana2sql_live_task_ids"
+LIVE_TASK_IDS_BATCH_SIZE = 1000
+
+MODIFIED_AT_COLUMN = "modified_at"
+
+# Page size used when paging through tasks explicitly for checkpointing.
+TASK_PAGE_SIZE = 100
+
+# Incremental exports ask for tasks modified a little before the last recorded
+# sync to tolerate clock skew between this host and Asana.
+INCREMENTAL_OVERLAP = datetime.timedelta(minutes=5)
+
 class NoSuchProjectException(Exception):
     def __init__(self, project_id):
         super(NoSuchProjectException, self).__init__(
                 "No project with id {}".format(project_id))
 
+def compile_extractor(extractors):
+    """Returns a function that applies each extractor to a task and returns the
+    results as a tuple."""
+    extractors = tuple(extractors)
+    return lambda task: tuple(extractor(task) for extractor in extractors)
+
+
+class RowPlan(object):
+    """The upsert statement and parameter extractor for a task table.
+
+    Compiled once per Project so that writing a row only extracts its values.
+    The first field is the key.
+    """
+
+    def __init__(self, sql_dialect, table_name, fields):
+        columns = [field.sql_name for field in fields]
+        self.sql = sql_dialect.upsert(table_name, columns, columns[:1])
+        self.params = compile_extractor(
+                [field.extractor() for field in fields])
+
+
 class Project(object):
     """Represents a project on Asana.  The class executes commands to bring the
     database into sync with the project data.
     """
 
-    def __init__(self, asana_client, db_client, workspace, config, fields):
+    def __init__(self, asana_client, db_client, workspace, config, fields,
+                 project_id=None):
         self._asana_client = asana_client
         self._db_client = db_client
         self._workspace = workspace
         self._config = config
+        self._dialect = dialect.from_config(config)
         self._direct_fields = []
         self._indirect_fields = []
 
-        self._project_id = self._config.project_id
+        self._project_id = project_id or self._config.project_id
         self._table_name = self._config.table_name
 
         self._project_data_cache = None
-        self._task_cache = None
+        self._table_name_cache = None
+        self._row_plan_cache = None
+
+        # Stored modified_at of each task, loaded when skipping unchanged tasks.
+        self._stored_modified_at = {}
+        self._num_skipped = 0
+        # Ids already in the live task ids table during a synchronize.
+        self._live_task_ids = set()
 
         for field in fields:
             self._add_field(field)
 
+    @property
+    def num_skipped(self):
+        """Number of tasks skipped because they were unchanged."""
+        return self._num_skipped
+
     def _project_data(self):
-        """Fetch the project data from Asana and cache it."""
+        """Fetch the project data through the workspace's metadata cache and
+        cache it."""
         if self._project_data_cache is None:
             try:
-                self._project_data_cache = (
-                    self._asana_client.projects.find_by_id(self._project_id))
+                with perf.phase("project_fetch"):
+                    self._project_data_cache = (
+                        self._workspace.get_project(self._project_id))
             except asana.error.NotFoundError:
                 raise NoSuchProjectException(self._project_id)
         return self._project_data_cache
@@ -58,15 +126,123 @@ class Project(object):
         return set(field_names for field in self._direct_fields + self._indirect_fields
                                for field_names in field.required_fields())
 
-    def _tasks(self):
-        if self._task_cache is None:
-            self._task_cache = list(
-                    self._asana_client.tasks.find_by_project(
-                        self._project_id, fields=",".join(self._required_fields())))
-        return self._task_cache
+    def _tasks(self, modified_since=None):
+        """Stream the project's tasks from Asana.
+
+        The client pages through the collection lazily, so only the current
+        page of tasks is held in memory.  Each call starts a new fetch.  If
+        modified_since is given only tasks modified after it are returned.
+
+        If the prefetch_tasks option is set, pages are fetched in a background
+        thread, up to that many tasks ahead of the database writes.
+        """
+        fields = ",".join(self._required_fields())
+        if modified_since:
+            tasks = self._asana_client.tasks.find_all(
+                    {"project": self._project_id,
+                     "modified_since": modified_since},
+                    fields=fields)
+        else:
+            tasks = self._asana_client.tasks.find_by_project(
+                    self._project_id, fields=fields)
+
+        if self._config.prefetch_tasks:
+            return pipeline.prefetch(tasks, self._config.prefetch_tasks)
+        return tasks
+
+    def _task_pages(self, fields, offset=None):
+        """Yields (offset, tasks) for each page of the project's tasks, where
+        offset is the pagination token that fetches the page, or None for the
+        first page."""
+        while True:
+            options = {"fields": fields,
+                       "iterator_type": None,
+                       "full_payload": True,
+                       "limit": TASK_PAGE_SIZE}
+            if offset:
+                options["offset"] = offset
+            result = self._asana_client.tasks.find_by_project(
+                    self._project_id, **options)
+            yield offset, result["data"]
+
+            next_page = result.get("next_page")
+            if not next_page:
+                return
+            offset = next_page["offset"]
+
+    def _checkpointed_tasks(self, command, started_at, checkpoint=None):
+        """Streams the project's tasks, committing and recording a checkpoint
+        every commit_every tasks.
+
+        If a checkpoint is given, paging starts from its page and the tasks up
+        to and including its last task are skipped.
+        """
+        fields = ",".join(self._required_fields())
+        offset = checkpoint.page_offset if checkpoint else None
+        last_task_id = checkpoint.last_task_id if checkpoint else None
+
+        pages = self._task_pages(fields, offset)
+        if self._config.prefetch_tasks:
+            pages = pipeline.prefetch(
+                    pages, self._config.prefetch_tasks // TASK_PAGE_SIZE)
+
+        num_tasks = 0
+        for page_offset, tasks in pages:
+            if last_task_id is not None:
+                task_ids = [task.get("id") for task in tasks]
+                if last_task_id in task_ids:
+                    tasks = tasks[task_ids.index(last_task_id) + 1:]
+                last_task_id = None
+
+            for task in tasks:
+                yield task
+
+                num_tasks += 1
+                if num_tasks % self._config.commit_every == 0:
+                    self._workspace.save_checkpoint(
+                            self._project_id, command, started_at,
+                            page_offset, task.get("id"))
+                    self._db_client.commit()
+
+    def _task_ids_before(self, checkpoint):
+        """Yields the ids of the tasks up to and including the checkpoint's last
+        task, fetching only ids."""
+        for _, tasks in self._task_pages("id"):
+            for task in tasks:
+                yield task.get("id")
+                if task.get("id") == checkpoint.last_task_id:
+                    return
+
+    def _resume_checkpoint(self, command, resume):
+        """The checkpoint to resume the command from, if any."""
+        if not resume:
+            return None
+        checkpoint = self._workspace.checkpoint(self._project_id)
+        if checkpoint and checkpoint.command == command:
+            return checkpoint
+        return None
+
+    def _modified_since(self):
+        """The modified_since bound for an incremental export, or None if the
+        project has never been synced."""
+        last_sync_time = self._workspace.last_sync_time(self._project_id)
+        if not last_sync_time:
+            return None
+        last_sync = datetime.datetime.strptime(
+                last_sync_time, util.ASANA_TIMESTAMP_FORMAT)
+        return util.asana_timestamp(last_sync - INCREMENTAL_OVERLAP)
 
     def table_name(self):
-        return util.sql_safe_name(self._table_name if self._table_name else self.project_name())
+        if self._table_name_cache is None:
+            self._table_name_cache = util.sql_safe_name(
+                    self._table_name if self._table_name else self.project_name())
+        return self._table_name_cache
+
+    def _row_plan(self):
+        if self._row_plan_cache is None:
+            self._row_plan_cache = RowPlan(
+                    self._dialect, self.table_name(), self._direct_fields)
+        return self._row_plan_cache
 
     def project_name(self):
         return self._project_data()["name"]
@@ -84,23 +260,62 @@ class Project(object):
                         field.field_definition_sql() for field in self._direct_fields]))
         self._db_client.write(sql)
 
-    def export(self):
-        for task in self._tasks():
+    def export(self, incremental=False, resume=False):
+        """Write the project's tasks to the database.
+
+        If incremental is set, only tasks modified since the last successful
+        export or synchronize are fetched.  Deleted tasks are not detected.
+
+        If the commit_every option is set, a full export commits and records a
+        checkpoint every that many tasks, and resume continues an interrupted
+        export from its last checkpoint.
+        """
+        checkpoint = self._resume_checkpoint("export", resume)
+        sync_started_at = (checkpoint.started_at if checkpoint else
+                util.asana_timestamp(datetime.datetime.utcnow()))
+        modified_since = self._modified_since() if incremental else None
+        self._workspace.prefetch_custom_fields(self._project_id)
+
+        # Incremental runs touch few tasks, so per-task lookups are cheaper
+        # than loading the whole project's join-table rows.
+        if not modified_since:
+            self._workspace.prefetch_project(self._project_id)
+        if self._skip_unchanged():
+            self._load_stored_modified_at()
+
+        if self._config.commit_every and not modified_since:
+            tasks = self._checkpointed_tasks(
+                    "export", sync_started_at, checkpoint)
+        else:
+            tasks = self._tasks(modified_since)
+
+        for task in perf.timed_iter("task_fetch", tasks):
+            self._export_task(task)
+
+        self._stored_modified_at = {}
+        self._workspace.clear_prefetch()
+        self._workspace.set_last_sync_time(self._project_id, sync_started_at)
+        if self._config.commit_every:
+            self._workspace.clear_checkpoint(self._project_id)
+
+    def _export_task(self, task):
+        if self._is_unchanged(task):
+            self._num_skipped += 1
+        else:
             self.insert_or_replace(task)
 
     def insert_or_replace(self, task):
-        columns = ",".join(field.sql_name for field in self._direct_fields)
-        values = ",".join("?" for field in self._direct_fields)
-        params = [field.get_data_from_task(task) for field in self._direct_fields]
-        self._db_client.write(
-                INSERT_OR_REPLACE_TEMPLATE.format(
-                    table_name=self.table_name(),
-                    columns=columns,
-                    values=values),
-                *params)
+        row_plan = self._row_plan()
+        with perf.phase("field_extraction"):
+            params = row_plan.params(task)
+        self._db_client.write(row_plan.sql, *params)
 
-        for field in self._indirect_fields:
-            field.get_data_from_task(task)
+        # Join tables are shared by every project in the workspace, so a task
+        # in several projects only needs them synced once per run.
+        if self._workspace.first_sync_of_task(task.get("id"), self._project_id):
+            with perf.phase("join_table_diffing"):
+                for field in self._indirect_fields:
+                    field.get_data_from_task(task)
 
     def delete(self, task_id):
         id_field = self._id_field()
@@ -110,20 +325,113 @@ class Project(object):
                     id_column=id_field.sql_name),
                 task_id)
 
-    def synchronize(self):
-        db_task_ids = self.db_task_ids()
-        asana_task_ids = self.asana_task_ids()
+    def synchronize(self, resume=False):
+        """Export the project's tasks and delete rows for tasks no longer in it.
 
-        ids_to_remove = db_task_ids.difference(asana_task_ids)
+        The ids of the tasks seen are loaded into a temporary table as they
+        stream past, and removed tasks are then deleted with set-based
+        statements, along with their join-table rows.
 
-        for task in self._tasks():
-            self.insert_or_replace(task)
+        Checkpointing works as for export.  On resume, the ids of the tasks
+        before the checkpoint are re-fetched, without other fields, to rebuild
+        the set of live tasks.
+        """
+        checkpoint = self._resume_checkpoint("synchronize", resume)
+        sync_started_at = (checkpoint.started_at if checkpoint else
+                util.asana_timestamp(datetime.datetime.utcnow()))
+        if self._skip_unchanged():
+            self._load_stored_modified_at()
+
+        self._workspace.prefetch_project(self._project_id)
+        self._workspace.prefetch_custom_fields(self._project_id)
+        self._create_live_task_ids_table()
+
+        live_task_ids = []
+        if checkpoint:
+            for task_id in self._task_ids_before(checkpoint):
+                live_task_ids.append((task_id,))
+                if len(live_task_ids) >= LIVE_TASK_IDS_BATCH_SIZE:
+                    self._insert_live_task_ids(live_task_ids)
+                    live_task_ids = []
+
+        if self._config.commit_every:
+            tasks = self._checkpointed_tasks(
+                    "synchronize", sync_started_at, checkpoint)
+        else:
+            tasks = self._tasks()
+
+        for task in perf.timed_iter("task_fetch", tasks):
+            live_task_ids.append((task.get("id"),))
+            if len(live_task_ids) >= LIVE_TASK_IDS_BATCH_SIZE:
+                self._insert_live_task_ids(live_task_ids)
+                live_task_ids = []
+            self._export_task(task)
+        self._insert_live_task_ids(live_task_ids)
+
+        self._stored_modified_at = {}
+        self._workspace.clear_prefetch()
 
-        for id_to_remove in ids_to_remove:
-            self.delete(id_to_remove)
+        self._delete_removed_tasks()
+
+        self._workspace.set_last_sync_time(self._project_id, sync_started_at)
+        if self._config.commit_every:
+            self._workspace.clear_checkpoint(self._project_id)
+
+    def _create_live_task_ids_table(self):
+        self._live_task_ids = set()
+        self._db_client.write(self._dialect.create_temp_table(
+            LIVE_TASK_IDS_TABLE_NAME, LIVE_TASK_IDS_COLUMNS))
+        self._db_client.write(CLEAR_LIVE_TASK_IDS_TEMPLATE.format(
+            table_name=self._live_task_ids_table_name()))
+
+    def _live_task_ids_table_name(self):
+        return self._dialect.temp_table_name(LIVE_TASK_IDS_TABLE_NAME)
+
+    def _insert_live_task_ids(self, rows):
+        # A task can be listed twice, as when pages shift while paginating or
+        # a resume re-fetches tasks past a checkpoint whose task was deleted.
+        new_rows = []
+        for row in rows:
+            if row[0] not in self._live_task_ids:
+                self._live_task_ids.add(row[0])
+                new_rows.append(row)
+        for batch in self._dialect.batches(new_rows, 1):
+            self._db_client.write(
+                    self._dialect.insert(
+                        self._live_task_ids_table_name(), ["id"], len(batch)),
+                    *[task_id for (task_id,) in batch])
+
+    def _delete_removed_tasks(self):
+        """Deletes rows for tasks missing from the live task ids table.
+
+        Join-table rows are removed first, while the task table still
+        identifies which tasks were removed.
+        """
+        id_column = self._id_field().sql_name
+        self._workspace.remove_tasks_from_project(
+                self._project_id,
+                REMOVED_TASK_IDS_TEMPLATE.format(
+                    table_name=self.table_name(),
+                    id_column=id_column,
+                    live_table_name=self._live_task_ids_table_name()))
+        self._db_client.write(
+                DELETE_REMOVED_TASKS_TEMPLATE.format(
+                    table_name=self.table_name(),
+                    id_column=id_column,
+                    live_table_name=self._live_task_ids_table_name()))
+        self._db_client.write(DROP_LIVE_TASK_IDS_TEMPLATE.format(
+            table_name=self._live_task_ids_table_name()))
+
+    def user_references(self):
+        """The (table name, column) pairs of the task table's user ids."""
+        return [(self.table_name(), field.sql_name)
+                for field in self._direct_fields
+                if isinstance(field, fields.AssigneeField)]
 
     def asana_task_ids(self):
-        return set(task.get("id") for task in self._tasks())
+        return set(task.get("id") for task in
+                   self._asana_client.tasks.find_by_project(
+                       self._project_id, fields="id"))
 
     def _id_field(self):
         return self._direct_fields[0]  # TODO: make the id field special.
@@ -135,3 +443,44 @@ class Project(object):
                     table_name=self.table_name(),
                     columns=id_field.sql_name)))
 
+
+    # Change detection
+    def _modified_at_field(self):
+        for field in self._direct_fields:
+            if field.sql_name == MODIFIED_AT_COLUMN:
+                return field
+        return None
+
+    def _skip_unchanged(self):
+        """Whether to skip tasks whose stored modified_at matches Asana's.
+
+        This requires a modified_at column in the task table.
+        """
+        return bool(self._config.skip_unchanged and self._modified_at_field())
+
+    def _load_stored_modified_at(self):
+        id_field = self._id_field()
+        self._stored_modified_at = {
+                row[0]: row[1] for row in self._db_client.read(
+                    SELECT_TEMPLATE.format(
+                        table_name=self.table_name(),
+                        columns=",".join(
+                            [id_field.sql_name, MODIFIED_AT_COLUMN])))}
+
+    def _is_unchanged(self, task):
+        """Whether the stored row for the task is as new as the task.
+
+        If so, neither the task's row nor its join-table rows need rewriting.
+        """
+        if not self._stored_modified_at:
+            return False
+        stored = self._stored_modified_at.get(task.get("id"))
+        current = self._modified_at_field().get_data_from_task(task)
+        if stored is None or current is None:
+            return False
+        if isinstance(stored, datetime.datetime):
+            # Typed columns come back as datetimes rather than the ISO string
+            # that was written.
+            return stored == datetime.datetime.strptime(
+                    current, util.ASANA_TIMESTAMP_FORMAT)
+        return stored == current
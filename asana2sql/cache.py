@@ -1,54 +1,392 @@
+import collections
+import timeit
+
+
+_MISSING = object()
+_ABSENT = object()
+
+# A lazy lookup costs about as much as reading this many rows of a full load.
+ROWS_PER_LOOKUP = 1000
+
+
+class ColumnIndex(object):
+    """The column names of a table and their positions, shared by its rows."""
+
+    __slots__ = ("names", "positions")
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+
+
+class CachedRow(object):
+    """A row held by a Cache: a tuple of values, read by column name through
+    a ColumnIndex shared by the rows of the table.
+
+    A row equals a dict holding the same values for the row's columns,
+    whatever other keys the dict has, so objects fetched from Asana can be
+    compared with stored rows directly.
+    """
+
+    __slots__ = ("_columns", "_values")
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, columns, value):
+        return cls(columns, tuple(value.get(name) for name in columns.names))
+
+    def __getitem__(self, name):
+        return self._values[self._columns.positions[name]]
+
+    def get(self, name, default=None):
+        position = self._columns.positions.get(name)
+        return default if position is None else self._values[position]
+
+    def keys(self):
+        return list(self._columns.names)
+
+    def items(self):
+        return list(zip(self._columns.names, self._values))
+
+    def to_dict(self):
+        return dict(zip(self._columns.names, self._values))
+
+    def __iter__(self):
+        return iter(self._columns.names)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, CachedRow):
+            if other._columns is self._columns:
+                return self._values == other._values
+            other = other.to_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+        get = other.get
+        for name, value in zip(self._columns.names, self._values):
+            if get(name, _MISSING) != value:
+                return False
+        return True
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "CachedRow({!r})".format(self.to_dict())
+
+
 class Cache(object):
     """A cache with a backing store.
 
+    seed_fn returns the stored rows in batches, such as those of
+    DatabaseWrapper.read_batches.  They are kept as CachedRows sharing one
+    ColumnIndex, as are added values.  column_names gives the columns of
+    added values before any row is seen; otherwise they are taken from the
+    stored rows or the first value added.
+
+    Besides the key, values can be looked up by the columns named in
+    index_names, each of which may be shared by several values.
+
+    By default the whole table is loaded on first use and kept.  Given
+    max_rows, lookup_fn and count_fn, the cache holds at most max_rows rows,
+    evicting the least recently used.  lookup_fn(column, values) returns, in
+    batches, the stored rows whose column has one of the values, and count_fn
+    the number of rows stored.  A table with more rows than max_rows is loaded
+    lazily, a batch of keys at a time.  One that fits is loaded in full, right
+    away if it is small, or else once the lookups it has taken would have
+    cost as much as reading the table, as happens when most lookups miss.
+
+    With write_back, added values that changed are not written right away
+    but kept dirty until flush(), which writes them all with one call of
+    insert_many_fn.  Reads of the backing store by the cache flush first.
     """
 
-    def __init__(self, seed_fn, insert_fn, key_name="id"):
+    def __init__(self, seed_fn, insert_fn, key_name="id", index_names=(),
+                 delete_fn=None, column_names=None, lookup_fn=None,
+                 count_fn=None, max_rows=None, insert_many_fn=None,
+                 write_back=False):
         self._seed_fn = seed_fn
         self._insert_fn = insert_fn
+        self._insert_many_fn = insert_many_fn
+        self._write_back = write_back and insert_many_fn is not None
+        self._delete_fn = delete_fn
         self._key_name = key_name
+        self._index_names = tuple(index_names)
+        self._columns = ColumnIndex(column_names) if column_names else None
+        self._lookup_fn = lookup_fn
+        self._count_fn = count_fn
+        self._max_rows = max_rows if lookup_fn and count_fn else None
 
+        # Key -> CachedRow, or _ABSENT for keys known not to be stored.  In
+        # least recently used order when bounded.
         self._cache = None
+        # Whether the cache holds every stored row, so that a missing key is
+        # known not to be stored.
+        self._complete = False
+        self._table_size = None
+        self._num_lookups = 0
+        # Index name -> index value -> {key: value}
+        self._indexes = {name: {} for name in self._index_names}
+        # Index name -> index values whose rows are all cached.
+        self._loaded_index_values = {name: set() for name in self._index_names}
         self._touched = set()
+        # Key -> CachedRow of the values not yet written, in the order added.
+        # Evicted rows stay here until flushed.
+        self._dirty = collections.OrderedDict()
+
+    @property
+    def num_lookups(self):
+        """Number of lazy lookups made in the backing store."""
+        return self._num_lookups
 
-    @staticmethod
-    def _row_to_dict(row):
-        """Converts a PyODBC row into a dictionary."""
+    @property
+    def touched_keys(self):
+        """Keys of the values got, looked up by index or added since the cache
+        was created."""
+        return frozenset(self._touched)
+
+    def reset(self):
+        """Drops the cached values, which are loaded again on next use, as
+        after the backing store was changed behind the cache's back.  Dirty
+        values are written first."""
+        self.flush()
+        self._cache = None
+        self._complete = False
+        self._table_size = None
+        self._indexes = {name: {} for name in self._index_names}
+        self._loaded_index_values = {name: set() for name in self._index_names}
+
+    @property
+    def num_dirty(self):
+        """Number of values waiting to be written by flush()."""
+        return len(self._dirty)
+
+    def flush(self):
+        """Writes the dirty values, in one call of insert_many_fn."""
+        if not self._dirty:
+            return
+        dirty = list(self._dirty.values())
+        self._dirty = collections.OrderedDict()
+        self._insert_many_fn(dirty)
+
+    def _batch_columns(self, row):
+        """The ColumnIndex of a PyODBC row, reusing the cache's if the
+        columns are the same."""
         # (name, type_code, display_size, internal_size, precision, scale,
         # null_ok)
-        return {name: getattr(row, name)
-                for (name, _, _, _, _, _, _) in row.cursor_description}
+        names = tuple(column[0] for column in row.cursor_description)
+        if self._columns is None or self._columns.names != names:
+            self._columns = ColumnIndex(names)
+        return self._columns
+
+    def _store_batches(self, batches, replace=True):
+        for batch in batches:
+            if not batch:
+                continue
+            columns = self._batch_columns(batch[0])
+            key_position = columns.positions[self._key_name]
+            for row in batch:
+                values = tuple(row)
+                key = values[key_position]
+                if replace or self._cache.get(key, _ABSENT) is _ABSENT:
+                    self._store(key, CachedRow(columns, values))
+
+    def _ensure_loaded(self):
+        if self._cache is not None:
+            return
+        self._cache = collections.OrderedDict()
+        if self._max_rows is None:
+            self._prime_cache()
+            return
+        self.flush()
+        self._table_size = self._count_fn()
+        if self._table_size <= min(self._max_rows, ROWS_PER_LOOKUP):
+            self._prime_cache()
 
     def _prime_cache(self):
-        self._cache = {}
-        for row in self._seed_fn():
-            dict_row = self._row_to_dict(row)
-            self._cache[dict_row[self._key_name]] = dict_row
+        self.flush()
+        self._cache = collections.OrderedDict()
+        self._indexes = {name: {} for name in self._index_names}
+        self._loaded_index_values = {name: set() for name in self._index_names}
+        self._complete = True
+        self._store_batches(self._seed_fn())
 
-    def _insert_and_cache(self, key, value):
-        self._insert_fn(value)
+    def _lookup(self, column, values):
+        """Caches the stored rows whose column has one of the values."""
+        self._num_lookups += 1
+        self.flush()
+        # Rows already cached are at least as new as the stored ones.
+        self._store_batches(self._lookup_fn(column, values), replace=False)
+        if (self._table_size <= self._max_rows and
+                self._num_lookups * ROWS_PER_LOOKUP >= self._table_size):
+            self._prime_cache()
+
+    def load(self, keys):
+        """Looks up the keys not yet cached in one batch."""
+        self._ensure_loaded()
+        if self._complete:
+            return
+        missing = [key for key in set(keys) if key not in self._cache]
+        if not missing:
+            return
+        self._lookup(self._key_name, missing)
+        if self._complete:
+            return
+        for key in missing:
+            if key not in self._cache:
+                self._store(key, _ABSENT)
+
+    def _cached(self, key):
+        value = self._cache.get(key, _MISSING)
+        if value is _MISSING:
+            if self._complete:
+                return None
+            self.load([key])
+            value = self._cache.get(key)
+        elif self._max_rows is not None:
+            # Mark as most recently used.
+            del self._cache[key]
+            self._cache[key] = value
+        return None if value is _ABSENT else value
+
+    def _store(self, key, value):
+        old_value = self._cache.pop(key, _ABSENT)
+        if old_value is not _ABSENT:
+            self._unindex(key, old_value)
         self._cache[key] = value
+        if value is not _ABSENT:
+            self._index(key, value)
+        if self._max_rows is not None:
+            while len(self._cache) > self._max_rows:
+                self._evict()
+
+    def _evict(self):
+        (key, value) = self._cache.popitem(last=False)
+        if self._complete:
+            # The table has outgrown max_rows since it was counted.
+            self._table_size = max(self._table_size, len(self._cache) + 1)
+        self._complete = False
+        if value is not _ABSENT:
+            self._unindex(key, value)
+            for name in self._index_names:
+                self._loaded_index_values[name].discard(value[name])
+
+    def _to_row(self, value):
+        if isinstance(value, CachedRow):
+            return value
+        if self._columns is None:
+            self._columns = ColumnIndex(sorted(value))
+        return CachedRow.from_dict(self._columns, value)
+
+    def _index(self, key, value):
+        for name in self._index_names:
+            self._indexes[name].setdefault(value[name], {})[key] = value
+
+    def _unindex(self, key, value):
+        for name in self._index_names:
+            index = self._indexes[name]
+            values = index.get(value[name])
+            if values is not None:
+                values.pop(key, None)
+                if not values:
+                    del index[value[name]]
+
+    def _insert_and_cache(self, key, value):
+        row = self._to_row(value)
+        if self._write_back:
+            self._dirty.pop(key, None)
+            self._dirty[key] = row
+        else:
+            self._insert_fn(value)
+        self._store(key, row)
 
     def _touch(self, key):
         self._touched.add(key)
 
     def get(self, key):
-        if self._cache is None:
-            self._prime_cache()
+        self._ensure_loaded()
 
         self._touch(key)
 
-        return self._cache.get(key)
+        return self._cached(key)
+
+    def get_by(self, index_name, index_value):
+        """Returns the values whose index_name column is index_value."""
+        self._ensure_loaded()
+
+        loaded = self._loaded_index_values[index_name]
+        if not self._complete and index_value not in loaded:
+            # Marked first so that evicting one of the rows unmarks it.
+            loaded.add(index_value)
+            self._lookup(index_name, [index_value])
+
+        values = list(self._indexes[index_name].get(index_value, {}).values())
+        for value in values:
+            self._touch(value[self._key_name])
+        return values
 
     def add(self, new_value):
-        if self._cache is None:
-            self._prime_cache()
+        self._ensure_loaded()
 
         key = new_value[self._key_name]
-        old_value = self._cache.get(key)
+        old_value = self._cached(key)
 
         self._touch(key)
 
         if old_value != new_value:
             self._insert_and_cache(key, new_value)
 
+    def add_many(self, new_values):
+        """Adds the values, looking up those not cached in one batch."""
+        new_values = list(new_values)
+        self.load([value[self._key_name] for value in new_values])
+        for value in new_values:
+            self.add(value)
+
+    def remove(self, key):
+        """Deletes the value with the key from the cache and, with delete_fn,
+        from the backing store."""
+        self._ensure_loaded()
+
+        old_value = self._cache.get(key, _MISSING)
+        if old_value is _ABSENT or (old_value is _MISSING and self._complete):
+            return
+        self._store(key, _ABSENT)
+        if self._complete:
+            del self._cache[key]
+        self._touched.discard(key)
+        self._dirty.pop(key, None)
+        if self._delete_fn:
+            self._delete_fn(key)
+
+
+class ExpiringCache(object):
+    """An in-memory cache whose entries expire ttl seconds after they are
+    stored.  With a ttl of None entries never expire.
+    """
+
+    def __init__(self, ttl=None, clock=timeit.default_timer):
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        (value, stored_at) = entry
+        if self._ttl is not None and self._clock() - stored_at >= self._ttl:
+            del self._entries[key]
+            return None
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (value, self._clock())
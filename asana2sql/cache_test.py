@@ -1,9 +1,20 @@
 import unittest
 import mock
 
-from asana2sql.cache import Cache
+from asana2sql import cache as cache_module
+from asana2sql.cache import Cache, CachedRow, ColumnIndex, ExpiringCache
+from asana2sql.sqlite_wrapper import SqliteRow
 from asana2sql.test_fixtures import row
 
+
+def table_rows(names, values):
+    """Result rows with a cursor_description, much cheaper to build than
+    test_fixtures.row for tests that need many."""
+    description = tuple((name,) + (None,) * 6 for name in names)
+    column_index = {name: i for i, name in enumerate(names)}
+    return [SqliteRow(description, column_index, row_values)
+            for row_values in values]
+
 class CacheTestCase(unittest.TestCase):
     def setUp(self):
         self.seed_fn = mock.Mock()
@@ -12,7 +23,7 @@ class CacheTestCase(unittest.TestCase):
         self.cache = Cache(self.seed_fn, self.insert_fn)
 
     def test_add(self):
-        self.seed_fn.return_value = [row(id=1), row(id=2)]
+        self.seed_fn.return_value = [[row(id=1), row(id=2)]]
 
         self.assertIsNone(self.cache.get(3))
 
@@ -24,7 +35,7 @@ class CacheTestCase(unittest.TestCase):
         self.insert_fn.assert_called_once_with({"id": 3})
 
     def test_get(self):
-        self.seed_fn.return_value = [row(id=1), row(id=2)]
+        self.seed_fn.return_value = [[row(id=1), row(id=2)]]
 
         self.assertIsNone(self.cache.get(3))
 
@@ -37,7 +48,7 @@ class CacheTestCase(unittest.TestCase):
         self.insert_fn.assert_not_called()
 
     def test_custom_key(self):
-        self.seed_fn.return_value = [row(foo=1), row(foo=2)]
+        self.seed_fn.return_value = [[row(foo=1), row(foo=2)]]
         self.cache = Cache(self.seed_fn, self.insert_fn, key_name="foo")
 
         self.assertEqual(self.cache.get(1), {"foo": 1})
@@ -50,5 +61,287 @@ class CacheTestCase(unittest.TestCase):
         self.seed_fn.assert_called_once()
         self.insert_fn.assert_called_once_with({"foo": 3})
 
+    def test_batches(self):
+        self.seed_fn.return_value = [[row(id=1, name="one")], [],
+                                     [row(id=2, name="two")]]
+
+        self.assertEqual(self.cache.get(1), {"id": 1, "name": "one"})
+        self.assertEqual(self.cache.get(2), {"id": 2, "name": "two"})
+
+    def test_add_compares_stored_columns(self):
+        self.seed_fn.return_value = [[row(id=1, name="one")]]
+
+        self.cache.add({"id": 1, "name": "one", "resource_type": "user"})
+        self.cache.add({"id": 1, "name": "uno", "resource_type": "user"})
+
+        self.insert_fn.assert_called_once_with(
+                {"id": 1, "name": "uno", "resource_type": "user"})
+        self.assertEqual(self.cache.get(1).to_dict(), {"id": 1, "name": "uno"})
+
+    def test_index(self):
+        self.seed_fn.return_value = [[
+                row(id=1, parent=10), row(id=2, parent=10), row(id=3, parent=11)]]
+        self.cache = Cache(self.seed_fn, self.insert_fn, index_names=["parent"])
+
+        self.assertEqual(sorted(v["id"] for v in self.cache.get_by("parent", 10)),
+                         [1, 2])
+        self.assertEqual(self.cache.get_by("parent", 12), [])
+
+        self.cache.add({"id": 2, "parent": 11})
+        self.cache.add({"id": 4, "parent": 12})
+
+        self.assertEqual(self.cache.get_by("parent", 10), [{"id": 1, "parent": 10}])
+        self.assertEqual(sorted(v["id"] for v in self.cache.get_by("parent", 11)),
+                         [2, 3])
+        self.assertEqual(self.cache.get_by("parent", 12), [{"id": 4, "parent": 12}])
+        self.seed_fn.assert_called_once()
+
+    def test_remove(self):
+        self.seed_fn.return_value = [[row(id=1, parent=10), row(id=2, parent=10)]]
+        delete_fn = mock.Mock()
+        self.cache = Cache(self.seed_fn, self.insert_fn, index_names=["parent"],
+                           delete_fn=delete_fn)
+
+        self.cache.remove(1)
+        self.cache.remove(3)
+
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get_by("parent", 10), [{"id": 2, "parent": 10}])
+        delete_fn.assert_called_once_with(1)
+
+    def test_touched_keys_and_reset(self):
+        self.seed_fn.return_value = [[row(id=1, parent=10), row(id=2, parent=10)]]
+        self.cache = Cache(self.seed_fn, self.insert_fn, index_names=["parent"])
+
+        self.cache.get(3)
+        self.cache.add({"id": 4, "parent": 11})
+        self.cache.get_by("parent", 10)
+        self.cache.reset()
+
+        self.assertEqual(self.cache.touched_keys, {1, 2, 3, 4})
+        self.assertIsNone(self.cache.get(4))
+        self.assertEqual(self.seed_fn.call_count, 2)
+
+
+class BoundedCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(cache_module, "ROWS_PER_LOOKUP", 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.rows = {r.id: r for r in table_rows(
+            ["id", "parent"], [(i, i // 10) for i in range(50)])}
+        self.seed_fn = mock.Mock(return_value=[list(self.rows.values())])
+        self.insert_fn = mock.Mock()
+        self.delete_fn = mock.Mock()
+        self.lookup_fn = mock.Mock(side_effect=self.lookup)
+        self.count_fn = mock.Mock(side_effect=lambda: len(self.rows))
+
+    def lookup(self, column, values):
+        return [[r for r in self.rows.values() if getattr(r, column) in values]]
+
+    def cache(self, max_rows):
+        return Cache(self.seed_fn, self.insert_fn, index_names=["parent"],
+                     delete_fn=self.delete_fn, lookup_fn=self.lookup_fn,
+                     count_fn=self.count_fn, max_rows=max_rows)
+
+    def test_lazy_lookups_and_eviction(self):
+        cache = self.cache(max_rows=3)
+
+        self.assertEqual(cache.get(1), {"id": 1, "parent": 0})
+        self.assertIsNone(cache.get(-1))
+        self.assertIsNone(cache.get(-1))
+        cache.load([2, 3, 4])
+        self.assertEqual(cache.get(4), {"id": 4, "parent": 0})
+
+        self.seed_fn.assert_not_called()
+        self.assertEqual(cache.num_lookups, 3)
+
+        # 1 was evicted, so it is looked up again.
+        cache.get(1)
+        self.assertEqual(cache.num_lookups, 4)
+        # 4 was used more recently than 2 and 3.
+        cache.get(4)
+        self.assertEqual(cache.num_lookups, 4)
+
+    def test_add_many_looks_up_once(self):
+        cache = self.cache(max_rows=100)
+
+        cache.add_many([{"id": 1, "parent": 0}, {"id": 2, "parent": 5},
+                        {"id": -1, "parent": 0}])
+
+        self.assertEqual(cache.num_lookups, 1)
+        self.assertEqual(self.insert_fn.call_args_list, [
+            mock.call({"id": 2, "parent": 5}), mock.call({"id": -1, "parent": 0})])
+
+    def test_get_by(self):
+        cache = self.cache(max_rows=100)
+
+        self.assertEqual(sorted(r["id"] for r in cache.get_by("parent", 3)),
+                         list(range(30, 40)))
+        cache.get_by("parent", 3)
+        cache.get(35)
+
+        self.assertEqual(cache.num_lookups, 1)
+
+    def test_remove(self):
+        cache = self.cache(max_rows=100)
+
+        cache.remove(1)
+
+        self.delete_fn.assert_called_once_with(1)
+        self.assertIsNone(cache.get(1))
+
+    def test_small_table_is_loaded_in_full(self):
+        self.rows = {r.id: r for r in table_rows(
+            ["id", "parent"], [(i, 0) for i in range(10)])}
+        self.seed_fn.return_value = [list(self.rows.values())]
+        cache = self.cache(max_rows=100)
+
+        cache.get(1)
+        cache.get(-1)
+
+        self.seed_fn.assert_called_once()
+        self.lookup_fn.assert_not_called()
+
+    def test_loads_in_full_after_many_misses(self):
+        cache = self.cache(max_rows=10000)
+
+        for i in range(5):
+            cache.get(i)
+
+        self.assertEqual(cache.num_lookups, 5)
+        self.seed_fn.assert_called_once()
+        cache.get(10)
+        cache.get(-1)
+        self.assertEqual(cache.num_lookups, 5)
+
+    def test_table_outgrowing_max_rows_stays_lazy(self):
+        self.rows = {}
+        self.seed_fn.side_effect = lambda: [list(self.rows.values())]
+        cache = self.cache(max_rows=10)
+
+        for i in range(50):
+            cache.add({"id": i, "parent": 0})
+            self.rows[i] = table_rows(["id", "parent"], [(i, 0)])[0]
+
+        self.assertEqual(cache.get(0), {"id": 0, "parent": 0})
+        self.seed_fn.assert_called_once()
+
+    def test_large_table_stays_lazy(self):
+        cache = self.cache(max_rows=10)
+
+        for i in range(50):
+            cache.get(i)
+
+        self.seed_fn.assert_not_called()
+        self.assertEqual(cache.num_lookups, 50)
+
+
+class WriteBackCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rows = {r.id: r for r in table_rows(
+            ["id", "name"], [(i, str(i)) for i in range(50)])}
+        self.insert_fn = mock.Mock()
+        self.insert_many_fn = mock.Mock()
+        self.delete_fn = mock.Mock()
+
+    def lookup(self, column, values):
+        return [[r for r in self.rows.values() if getattr(r, column) in values]]
+
+    def cache(self, **options):
+        return Cache(mock.Mock(return_value=[list(self.rows.values())]),
+                     self.insert_fn, delete_fn=self.delete_fn,
+                     insert_many_fn=self.insert_many_fn, write_back=True,
+                     **options)
+
+    def test_flush(self):
+        cache = self.cache()
+
+        cache.add({"id": 1, "name": "a"})
+        cache.add({"id": 2, "name": "2"})
+        cache.add({"id": -1, "name": "b"})
+        cache.add({"id": 1, "name": "c"})
+        cache.add({"id": -2, "name": "d"})
+        cache.remove(-2)
+
+        self.assertEqual(cache.get(1), {"id": 1, "name": "c"})
+        self.assertEqual(cache.num_dirty, 2)
+        self.insert_fn.assert_not_called()
+        self.insert_many_fn.assert_not_called()
+
+        cache.flush()
+        cache.flush()
+
+        self.insert_many_fn.assert_called_once_with(
+                [{"id": -1, "name": "b"}, {"id": 1, "name": "c"}])
+        self.delete_fn.assert_called_once_with(-2)
+        self.assertEqual(cache.num_dirty, 0)
+
+    def test_flushes_before_lookups(self):
+        cache = self.cache(lookup_fn=mock.Mock(side_effect=self.lookup),
+                           count_fn=mock.Mock(return_value=len(self.rows)),
+                           max_rows=2)
+
+        cache.add({"id": 1, "name": "a"})
+        cache.add({"id": 2, "name": "b"})
+        cache.add({"id": 3, "name": "c"})
+
+        self.assertEqual(self.insert_many_fn.call_args_list, [
+            mock.call([{"id": 1, "name": "a"}]),
+            mock.call([{"id": 2, "name": "b"}]),
+            ])
+        self.assertEqual(cache.num_dirty, 1)
+
+
+class CachedRowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.columns = ColumnIndex(["id", "name"])
+        self.row = CachedRow(self.columns, (1, "one"))
+
+    def test_access(self):
+        self.assertEqual(self.row["name"], "one")
+        self.assertEqual(self.row.get("name"), "one")
+        self.assertIsNone(self.row.get("color"))
+        self.assertEqual(self.row.keys(), ["id", "name"])
+        self.assertEqual(self.row.to_dict(), {"id": 1, "name": "one"})
+        with self.assertRaises(KeyError):
+            self.row["color"]
+
+    def test_equality(self):
+        self.assertEqual(self.row, CachedRow(self.columns, (1, "one")))
+        self.assertEqual(self.row,
+                         CachedRow(ColumnIndex(["name", "id"]), ("one", 1)))
+        self.assertEqual(self.row, {"id": 1, "name": "one"})
+        self.assertEqual({"id": 1, "name": "one", "extra": 2}, self.row)
+        self.assertNotEqual(self.row, {"id": 1, "name": "two"})
+        self.assertNotEqual(self.row, {"id": 1})
+        self.assertNotEqual(self.row, CachedRow(self.columns, (1, "two")))
+        self.assertFalse(self.row != {"id": 1, "name": "one"})
+
+    def test_compact(self):
+        with self.assertRaises(AttributeError):
+            self.row.__dict__
+
+
+class ExpiringCacheTestCase(unittest.TestCase):
+    def test_expiry(self):
+        now = [0]
+        cache = ExpiringCache(ttl=10, clock=lambda: now[0])
+
+        cache.put(1, "one")
+        now[0] = 9
+        self.assertEqual(cache.get(1), "one")
+        now[0] = 10
+        self.assertIsNone(cache.get(1))
+        self.assertIsNone(cache.get(2))
+
+    def test_no_ttl(self):
+        cache = ExpiringCache()
+
+        cache.put(1, "one")
+
+        self.assertEqual(cache.get(1), "one")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,103 @@
+"""Records Asana API responses to a cassette file and serves them back.
+
+A cassette is a gzipped file with one JSON object per line, each holding the
+key of a request and either its response or the status of the error it
+raised.  Replaying a cassette lets runs against the database be repeated and
+compared without the network, as long as they make the same requests.
+"""
+
+import collections
+import gzip
+import json
+import threading
+
+from asana import client as asana_client
+import asana.error
+
+
+class CassetteMissError(Exception):
+    def __init__(self, key):
+        super(CassetteMissError, self).__init__(
+                "No recorded response for {}".format(key))
+
+
+def request_key(method, path, options):
+    """Identifies a request by what is sent to the API.
+
+    options are the client's options merged with the request's, as seen by
+    Client.request.
+    """
+    return json.dumps([method,
+                       path,
+                       options.get("params"),
+                       options.get("data"),
+                       bool(options.get("full_payload"))],
+                      sort_keys=True, separators=(",", ":"))
+
+
+class CassetteRecorder(object):
+    """Appends responses to a cassette as they are received."""
+
+    def __init__(self, path):
+        self._file = gzip.open(path, "wb")
+        self._lock = threading.Lock()
+
+    def record(self, key, response):
+        self._write({"key": key, "response": response})
+
+    def record_error(self, key, status):
+        self._write({"key": key, "error": status})
+
+    def _write(self, entry):
+        line = json.dumps(entry, sort_keys=True, separators=(",", ":"))
+        with self._lock:
+            self._file.write((line + "\n").encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Cassette(object):
+    """The responses of a recorded cassette, served in the order they were
+    recorded.
+
+    A request made more often than it was recorded gets its last response
+    again.  A cassette cut short by an interrupted recording is read up to its
+    last complete entry.
+    """
+
+    def __init__(self, path):
+        self._entries = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        for entry in self._read(path):
+            self._entries[entry["key"]].append(entry)
+
+    @staticmethod
+    def _read(path):
+        with gzip.open(path, "rb") as f:
+            try:
+                for line in f:
+                    try:
+                        yield json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        return
+            except EOFError:
+                return
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def replay(self, key):
+        """Returns the next response recorded for key, or raises the error
+        it was recorded with."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMissError(key)
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+
+        if "error" in entry:
+            raise asana_client.STATUS_MAP.get(
+                    entry["error"], asana.error.ServerError)(None)
+        return entry["response"]
@@ -0,0 +1,76 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import asana.error
+
+from asana2sql import cassette
+
+
+class CassetteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "api.json.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def key(self, path, offset=None):
+        params = {"opt_fields": "id,name"}
+        if offset:
+            params["offset"] = offset
+        return cassette.request_key(
+                "get", path, {"params": params, "full_payload": True})
+
+    def test_request_key(self):
+        self.assertEqual(
+                cassette.request_key("get", "/tasks/1",
+                                     {"params": {"b": 1, "a": 2},
+                                      "headers": {"Authorization": "x"}}),
+                cassette.request_key("get", "/tasks/1",
+                                     {"params": {"a": 2, "b": 1}}))
+        self.assertNotEqual(self.key("/projects/1/tasks"),
+                            self.key("/projects/1/tasks", offset="abc"))
+
+    def test_replay(self):
+        recorder = cassette.CassetteRecorder(self.path)
+        recorder.record(self.key("/projects/1/tasks"),
+                        {"data": [{"id": 1}], "next_page": {"offset": "abc"}})
+        recorder.record(self.key("/projects/1/tasks", offset="abc"),
+                        {"data": [{"id": 2}]})
+        recorder.record(self.key("/projects/1"), {"id": 1, "name": "Old"})
+        recorder.record(self.key("/projects/1"), {"id": 1, "name": "New"})
+        recorder.record_error(self.key("/projects/2"), 404)
+        recorder.close()
+
+        replay = cassette.Cassette(self.path)
+
+        self.assertEqual(len(replay), 5)
+        self.assertEqual(
+                replay.replay(self.key("/projects/1/tasks", offset="abc")),
+                {"data": [{"id": 2}]})
+        self.assertEqual(replay.replay(self.key("/projects/1"))["name"], "Old")
+        self.assertEqual(replay.replay(self.key("/projects/1"))["name"], "New")
+        self.assertEqual(replay.replay(self.key("/projects/1"))["name"], "New")
+        with self.assertRaises(asana.error.NotFoundError):
+            replay.replay(self.key("/projects/2"))
+        with self.assertRaises(cassette.CassetteMissError):
+            replay.replay(self.key("/projects/3"))
+
+    def test_truncated_cassette(self):
+        recorder = cassette.CassetteRecorder(self.path)
+        recorder.record(self.key("/projects/1"), {"id": 1})
+        recorder.close()
+        with gzip.open(self.path, "ab") as f:
+            f.write(b'{"key":')
+
+        replay = cassette.Cassette(self.path)
+
+        self.assertEqual(len(replay), 1)
+        self.assertEqual(replay.replay(self.key("/projects/1")), {"id": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,57 @@
+import collections
+import timeit
+
+from asana2sql import perf
+
+# Longest parameter list printed in the slow query log.
+MAX_LOGGED_PARAMS_LENGTH = 200
+
 
 class DatabaseWrapper(object):
     """A simple wrapper for a DB API 2.0 connection.
 
-    It supports two additional options:
+    It supports three additional options:
       dump_sql will print all SQL commands to STDOUT.
       dry will prevent any write commands from actuallye executing.
+      buffered will hold parameterized writes and send them to the database in
+        batches with executemany.  Writes are grouped by statement text and
+        flushed when flush_rows rows or roughly flush_bytes bytes of parameters
+        are pending, before any read, and on commit.  Batches are sent in the
+        order their statements were first written, so callers must not rely on
+        the relative order of different statements within one batch.
+      slow_query_seconds will print every statement that takes at least that
+        long, with its parameters.
+      read_batch_size is the number of rows read_batches fetches at a time.
+
+    Functions registered with add_commit_hook run before every commit, so
+    that writes deferred by callers, such as write-back caches, land in the
+    transaction being committed.
+
+    Execution times are recorded per statement template in statement_timings.
     """
 
-    def __init__(self, db_conn, dump_sql=False, dry=False):
+    def __init__(self, db_conn, dump_sql=False, dry=False, buffered=False,
+                 flush_rows=1000, flush_bytes=1 << 20, slow_query_seconds=None,
+                 read_batch_size=10000):
         self._db_conn = db_conn
         self._dump_sql = dump_sql
         self._dry = dry
+        self._buffered = buffered
+        self._flush_rows = flush_rows
+        self._flush_bytes = flush_bytes
+        self._slow_query_seconds = slow_query_seconds
+        self._read_batch_size = read_batch_size
         self._cursor = None
+        self._commit_hooks = []
+
+        self._pending = collections.OrderedDict()
+        self._pending_rows = 0
+        self._pending_bytes = 0
 
         self._num_reads = 0
         self._num_writes = 0
         self._num_executed = 0
+        self._statement_timings = perf.StatementTimings()
 
     @property
     def num_reads(self):
@@ -32,16 +68,58 @@ class DatabaseWrapper(object):
         """Number of SQL commands executed."""
         return self._num_executed
 
+    @property
+    def statement_timings(self):
+        """perf.StatementTimings of the statements executed."""
+        return self._statement_timings
+
     def read(self, sql, *params):
-        """Execute a read-only SQL statement and return the result rows."""
+        """Execute a read-only SQL statement and return the result rows.
+
+        Any buffered writes are flushed first so reads see them.
+        """
         self._num_reads += 1
 
         if self._dump_sql:
             print(sql + " " + repr(params))
 
-        self._execute_sql(sql, *params)
+        self.flush()
+        with perf.phase("reads"):
+            start = timeit.default_timer()
+            self._execute_sql(sql, *params)
+            rows = self._cursor.fetchall()
+            self._record_time(sql, params, start)
+
+        return rows
+
+    def read_batches(self, sql, *params):
+        """Execute a read-only SQL statement and yield its result rows in
+        lists fetched with fetchmany, so large results need not be held in
+        memory at once.
 
-        return self._cursor.fetchall()
+        The statement runs on a cursor of its own, so other statements can be
+        executed while the batches are consumed.
+        """
+        self._num_reads += 1
+
+        if self._dump_sql:
+            print(sql + " " + repr(params))
+
+        self.flush()
+        cursor = self._db_conn.cursor()
+        try:
+            with perf.phase("reads"):
+                start = timeit.default_timer()
+                self._execute_sql(sql, *params, cursor=cursor)
+                self._record_time(sql, params, start)
+            while True:
+                with perf.phase("reads"):
+                    rows = cursor.fetchmany(self._read_batch_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cursor.close()
 
     def write(self, sql, *params):
         """Execute a write SQL statement."""
@@ -53,11 +131,143 @@ class DatabaseWrapper(object):
             else:
                 print(sql + " " + repr(params))
 
-        if not self._dry:
+        if self._dry:
+            return
+
+        with perf.phase("writes"):
+            if self._buffered and params:
+                self._buffer(sql, self._params_row(params))
+            else:
+                self.flush()
+                start = timeit.default_timer()
+                self._execute_sql(sql, *params)
+                self._record_time(sql, params, start)
+
+    def write_counted(self, sql, *params):
+        """Execute a write SQL statement right away and return the number of
+        rows it changed, or 0 when dry."""
+        self._num_writes += 1
+
+        if self._dump_sql:
+            if self._dry:
+                print("# " + sql + " " + repr(params))
+            else:
+                print(sql + " " + repr(params))
+
+        if self._dry:
+            return 0
+
+        self.flush()
+        with perf.phase("writes"):
+            start = timeit.default_timer()
             self._execute_sql(sql, *params)
+            self._record_time(sql, params, start)
+        return self._cursor.rowcount
+
+    def write_many(self, sql, rows):
+        """Execute a write SQL statement once for each row of parameters."""
+        rows = [tuple(row) for row in rows]
+        if not rows:
+            return
+
+        self._num_writes += len(rows)
+
+        if self._dump_sql:
+            for row in rows:
+                if self._dry:
+                    print("# " + sql + " " + repr(row))
+                else:
+                    print(sql + " " + repr(row))
+
+        if self._dry:
+            return
+
+        with perf.phase("writes"):
+            if self._buffered:
+                for row in rows:
+                    self._buffer(sql, row)
+            else:
+                self.flush()
+                self._execute_many(sql, rows)
+
+    def flush(self):
+        """Send all buffered writes to the database."""
+        pending = self._pending
+        self._pending = collections.OrderedDict()
+        self._pending_rows = 0
+        self._pending_bytes = 0
+
+        if pending:
+            with perf.phase("writes"):
+                for sql, rows in pending.items():
+                    self._execute_many(sql, rows)
 
-    def _execute_sql(self, sql, *params):
+    def add_commit_hook(self, hook):
+        """Registers a function called with no arguments before each commit."""
+        self._commit_hooks.append(hook)
+
+    def commit(self):
+        """Run the commit hooks, flush any buffered writes and commit the
+        connection."""
+        for hook in self._commit_hooks:
+            hook()
+        if self._dry:
+            return
+        self.flush()
+        with perf.phase("commit"):
+            self._db_conn.commit()
+
+    @staticmethod
+    def _params_row(params):
+        """Normalizes write parameters to a single row tuple.
+
+        Like pyodbc, a single sequence argument is treated as the full
+        parameter list.
+        """
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            return tuple(params[0])
+        return tuple(params)
+
+    @staticmethod
+    def _row_size(row):
+        """A rough estimate of the number of bytes sent for a parameter row."""
+        return sum(len(value) if isinstance(value, (str, bytes)) else 8
+                   for value in row)
+
+    def _buffer(self, sql, row):
+        self._pending.setdefault(sql, []).append(row)
+        self._pending_rows += 1
+        self._pending_bytes += self._row_size(row)
+
+        if (self._pending_rows >= self._flush_rows or
+            self._pending_bytes >= self._flush_bytes):
+            self.flush()
+
+    def _get_cursor(self):
         if not self._cursor:
             self._cursor = self._db_conn.cursor()
+        return self._cursor
+
+    def _execute_sql(self, sql, *params, **options):
+        cursor = options.get("cursor") or self._get_cursor()
+        self._num_executed += 1
+        cursor.execute(sql, *params)
+
+    def _execute_many(self, sql, rows):
+        cursor = self._get_cursor()
         self._num_executed += 1
-        self._cursor.execute(sql, *params)
+        start = timeit.default_timer()
+        cursor.executemany(sql, rows)
+        self._record_time(sql, rows, start)
+
+    def _record_time(self, sql, params, start):
+        elapsed = timeit.default_timer() - start
+        self._statement_timings.record(sql, elapsed)
+
+        if (self._slow_query_seconds is not None and
+            elapsed >= self._slow_query_seconds):
+            logged_params = repr(params)
+            if len(logged_params) > MAX_LOGGED_PARAMS_LENGTH:
+                logged_params = logged_params[:MAX_LOGGED_PARAMS_LENGTH - 3] + "..."
+            print("Slow query ({:.1f} ms): {} {}".format(
+                elapsed * 1000, sql, logged_params))
@@ -4,6 +4,7 @@ import mock
 from asana2sql.db_wrapper import DatabaseWrapper
 
 TEST_SQL = "Test SQL statement"
+OTHER_SQL = "Other SQL statement"
 PARAM1 = "Param 1"
 PARAM2 = "Param 2"
 
@@ -31,6 +32,26 @@ class DatabaseWrapperTestCase(unittest.TestCase):
             mock.call.cursor().fetchall(),
             ])
 
+    def test_read_batches(self):
+        self.conn.cursor().fetchmany.side_effect = [[0, 1], [2], []]
+        self.conn.reset_mock() # Ignore the call above.
+
+        db_wrapper = DatabaseWrapper(self.conn, read_batch_size=2)
+
+        self.assertEqual(list(db_wrapper.read_batches(TEST_SQL, PARAM1)),
+                         [[0, 1], [2]])
+
+        self.assertEqual(db_wrapper.num_reads, 1)
+        self.assertEqual(db_wrapper.num_executed, 1)
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().execute(TEST_SQL, PARAM1),
+            mock.call.cursor().fetchmany(2),
+            mock.call.cursor().fetchmany(2),
+            mock.call.cursor().fetchmany(2),
+            mock.call.cursor().close(),
+            ])
+
     def test_dry_read(self):
         self.conn.cursor().fetchall.return_value = [0, 1]
         self.conn.reset_mock() # Ignore the call above.
@@ -67,6 +88,23 @@ class DatabaseWrapperTestCase(unittest.TestCase):
             mock.call.cursor().execute(TEST_SQL, PARAM1, PARAM2),
             ])
 
+    def test_write_counted(self):
+        self.conn.cursor().rowcount = 3
+        self.conn.reset_mock() # Ignore the call above.
+
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True)
+
+        db_wrapper.write(TEST_SQL, PARAM1)
+        self.assertEqual(db_wrapper.write_counted(OTHER_SQL, PARAM2), 3)
+
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().executemany(TEST_SQL, [(PARAM1,)]),
+            mock.call.cursor().execute(OTHER_SQL, PARAM2),
+            ])
+        self.assertEqual(
+                DatabaseWrapper(self.conn, dry=True).write_counted(TEST_SQL), 0)
+
     def test_dry_write(self):
         db_wrapper = DatabaseWrapper(self.conn, dry=True)
 
@@ -80,6 +118,149 @@ class DatabaseWrapperTestCase(unittest.TestCase):
 
         self.assertEqual(self.conn.mock_calls, [])
 
+    def test_buffered_write(self):
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True)
+
+        db_wrapper.write(TEST_SQL, PARAM1, PARAM2)
+        db_wrapper.write(OTHER_SQL, (PARAM1, PARAM2))
+        db_wrapper.write(TEST_SQL, PARAM2, PARAM1)
+
+        self.assertEqual(db_wrapper.num_writes, 3)
+        self.assertEqual(db_wrapper.num_executed, 0)
+        self.assertEqual(self.conn.mock_calls, [])
+
+        db_wrapper.commit()
+
+        self.assertEqual(db_wrapper.num_executed, 2)
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().executemany(
+                TEST_SQL, [(PARAM1, PARAM2), (PARAM2, PARAM1)]),
+            mock.call.cursor().executemany(
+                OTHER_SQL, [(PARAM1, PARAM2)]),
+            mock.call.commit(),
+            ])
+
+    def test_buffered_write_flushes_at_row_threshold(self):
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True, flush_rows=2)
+
+        db_wrapper.write(TEST_SQL, PARAM1)
+        self.assertEqual(db_wrapper.num_executed, 0)
+
+        db_wrapper.write(TEST_SQL, PARAM2)
+        self.assertEqual(db_wrapper.num_executed, 1)
+
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().executemany(TEST_SQL, [(PARAM1,), (PARAM2,)]),
+            ])
+
+    def test_buffered_write_flushes_at_byte_threshold(self):
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True, flush_bytes=10)
+
+        db_wrapper.write(TEST_SQL, "x" * 10)
+
+        self.assertEqual(db_wrapper.num_executed, 1)
+
+    def test_read_flushes_buffered_writes(self):
+        self.conn.cursor().fetchall.return_value = [0, 1]
+        self.conn.reset_mock() # Ignore the call above.
+
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True)
+
+        db_wrapper.write(TEST_SQL, PARAM1)
+        self.assertEqual(db_wrapper.read(OTHER_SQL, PARAM2), [0, 1])
+
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().executemany(TEST_SQL, [(PARAM1,)]),
+            mock.call.cursor().execute(OTHER_SQL, PARAM2),
+            mock.call.cursor().fetchall(),
+            ])
+
+    def test_buffered_unparameterized_write(self):
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True)
+
+        db_wrapper.write(TEST_SQL, PARAM1)
+        db_wrapper.write(OTHER_SQL)
+
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().executemany(TEST_SQL, [(PARAM1,)]),
+            mock.call.cursor().execute(OTHER_SQL),
+            ])
+
+    def test_write_many(self):
+        db_wrapper = DatabaseWrapper(self.conn)
+
+        db_wrapper.write_many(TEST_SQL, [(PARAM1,), [PARAM2]])
+        db_wrapper.write_many(TEST_SQL, [])
+
+        self.assertEqual(db_wrapper.num_writes, 2)
+        self.assertEqual(db_wrapper.num_executed, 1)
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().executemany(TEST_SQL, [(PARAM1,), (PARAM2,)]),
+            ])
+
+    def test_buffered_write_many(self):
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True)
+
+        db_wrapper.write_many(TEST_SQL, [(PARAM1,)])
+        db_wrapper.write(TEST_SQL, PARAM2)
+        db_wrapper.flush()
+
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().executemany(TEST_SQL, [(PARAM1,), (PARAM2,)]),
+            ])
+
+    def test_dry_commit(self):
+        db_wrapper = DatabaseWrapper(self.conn, dry=True, buffered=True)
+
+        db_wrapper.write(TEST_SQL, PARAM1)
+        db_wrapper.commit()
+
+        self.assertEqual(self.conn.mock_calls, [])
+
+    def test_commit_hooks(self):
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True)
+        db_wrapper.add_commit_hook(
+                lambda: db_wrapper.write(TEST_SQL, PARAM1))
+
+        db_wrapper.commit()
+
+        self.assertEqual(self.conn.mock_calls, [
+            mock.call.cursor(),
+            mock.call.cursor().executemany(TEST_SQL, [(PARAM1,)]),
+            mock.call.commit(),
+            ])
+
+    def test_statement_timings(self):
+        db_wrapper = DatabaseWrapper(self.conn, buffered=True)
+
+        db_wrapper.read(TEST_SQL, PARAM1)
+        db_wrapper.write(OTHER_SQL, PARAM1)
+        db_wrapper.write(OTHER_SQL, PARAM2)
+        db_wrapper.commit()
+
+        histograms = db_wrapper.statement_timings.histograms
+        self.assertEqual(sorted(histograms.keys()), [OTHER_SQL, TEST_SQL])
+        self.assertEqual(histograms[TEST_SQL].count, 1)
+        self.assertEqual(histograms[OTHER_SQL].count, 1)
+
+    @mock.patch("timeit.default_timer")
+    def test_slow_query_log(self, timer):
+        timer.side_effect = [0.0, 0.001, 1.0, 1.5]
+        db_wrapper = DatabaseWrapper(self.conn, slow_query_seconds=0.1)
+
+        with mock.patch("asana2sql.db_wrapper.print", create=True) as printed:
+            db_wrapper.write(TEST_SQL, PARAM1)
+            db_wrapper.write(OTHER_SQL, PARAM2)
+
+        printed.assert_called_once_with(
+                "Slow query (500.0 ms): Other SQL statement ('Param 2',)")
+
 
 if __name__ == '__main__':
     unittest.main()
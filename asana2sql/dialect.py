@@ -0,0 +1,160 @@
+import abc
+import collections
+
+# The columns written by an upsert and the columns of its primary key.
+Upsert = collections.namedtuple("Upsert", ["columns", "key_columns"])
+
+
+def quote(name):
+    return '"{}"'.format(name)
+
+
+class Dialect(abc.ABC):
+    """Generates the statements whose syntax differs between database backends.
+
+    Statements use ? placeholders and double-quoted identifiers like the rest of
+    asana2sql.  Inserts can cover several rows with a multi-row VALUES list;
+    rows_per_statement says how many fit in one statement.
+    """
+
+    # Most parameters the backend accepts in one statement.
+    max_params = 999
+
+    # Most rows written by one multi-row statement.
+    max_rows = 500
+
+    def rows_per_statement(self, num_columns):
+        return max(1, min(self.max_rows, self.max_params // max(1, num_columns)))
+
+    def batches(self, rows, num_columns):
+        """Splits rows into lists small enough for one multi-row statement."""
+        rows = list(rows)
+        size = self.rows_per_statement(num_columns)
+        return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+    @staticmethod
+    def values(num_columns, num_rows=1):
+        row = "({})".format(",".join("?" for _ in range(num_columns)))
+        return ",".join(row for _ in range(num_rows))
+
+    def insert(self, table_name, columns, num_rows=1):
+        return "INSERT INTO {} ({}) VALUES {};".format(
+                quote(table_name),
+                ",".join(quote(column) for column in columns),
+                self.values(len(columns), num_rows))
+
+    @abc.abstractmethod
+    def upsert(self, table_name, columns, key_columns, num_rows=1):
+        """An insert of num_rows rows that updates the other columns of rows
+        whose key is already present.
+
+        The rows of one statement must have distinct keys.
+        """
+
+    def temp_table_name(self, table_name):
+        """The name under which statements refer to a temporary table."""
+        return table_name
+
+    def create_temp_table(self, table_name, column_definitions):
+        """Creates a temporary table private to the connection, unless it
+        already exists.  column_definitions is the SQL between the
+        parentheses of a CREATE TABLE."""
+        return "CREATE TEMPORARY TABLE IF NOT EXISTS {} ({});".format(
+                quote(self.temp_table_name(table_name)), column_definitions)
+
+
+class SqliteDialect(Dialect):
+    """SQLite 3.24 and later.  Also used for PostgreSQL, which shares the
+    ON CONFLICT syntax."""
+
+    def upsert(self, table_name, columns, key_columns, num_rows=1):
+        updates = [column for column in columns if column not in key_columns]
+        if updates:
+            action = "DO UPDATE SET {}".format(",".join(
+                "{0}=excluded.{0}".format(quote(column)) for column in updates))
+        else:
+            action = "DO NOTHING"
+        return "{} ON CONFLICT ({}) {};".format(
+                self.insert(table_name, columns, num_rows)[:-1],
+                ",".join(quote(column) for column in key_columns),
+                action)
+
+
+class SqliteReplaceDialect(Dialect):
+    """SQLite before 3.24, which only has INSERT OR REPLACE.
+
+    A replace deletes the old row and inserts a new one, rewriting every index
+    entry, so prefer SqliteDialect where it is available.
+    """
+
+    def upsert(self, table_name, columns, key_columns, num_rows=1):
+        return "INSERT OR REPLACE" + self.insert(
+                table_name, columns, num_rows)[len("INSERT"):]
+
+
+class PostgresqlDialect(SqliteDialect):
+    max_params = 32767
+
+
+class MysqlDialect(Dialect):
+    """MySQL and MariaDB.  The session needs the ANSI_QUOTES SQL mode for the
+    double-quoted identifiers used throughout asana2sql."""
+
+    max_params = 65535
+
+    def upsert(self, table_name, columns, key_columns, num_rows=1):
+        # Assigning a key column to itself turns a duplicate into a no-op.
+        updates = ([column for column in columns if column not in key_columns]
+                   or key_columns[:1])
+        return "{} ON DUPLICATE KEY UPDATE {};".format(
+                self.insert(table_name, columns, num_rows)[:-1],
+                ",".join("{0}=VALUES({0})".format(quote(column))
+                         for column in updates))
+
+
+class MssqlDialect(Dialect):
+    """Microsoft SQL Server, which upserts with MERGE."""
+
+    max_params = 2099
+
+    def upsert(self, table_name, columns, key_columns, num_rows=1):
+        quoted_columns = ",".join(quote(column) for column in columns)
+        updates = [column for column in columns if column not in key_columns]
+        sql = ("MERGE INTO {} AS target USING (VALUES {}) AS source ({}) "
+               "ON {} ").format(
+                       quote(table_name),
+                       self.values(len(columns), num_rows),
+                       quoted_columns,
+                       " AND ".join("target.{0}=source.{0}".format(quote(column))
+                                    for column in key_columns))
+        if updates:
+            sql += "WHEN MATCHED THEN UPDATE SET {} ".format(",".join(
+                "{0}=source.{0}".format(quote(column)) for column in updates))
+        return sql + "WHEN NOT MATCHED THEN INSERT ({}) VALUES ({});".format(
+                quoted_columns,
+                ",".join("source.{}".format(quote(column)) for column in columns))
+
+    def temp_table_name(self, table_name):
+        # Tables whose name starts with # are local temporary tables.
+        return "#" + table_name
+
+    def create_temp_table(self, table_name, column_definitions):
+        # CREATE TABLE has no IF NOT EXISTS before SQL Server 2016.
+        name = self.temp_table_name(table_name)
+        return ("IF OBJECT_ID('tempdb..{}') IS NULL "
+                "CREATE TABLE {} ({});").format(
+                        name, quote(name), column_definitions)
+
+
+DIALECTS = collections.OrderedDict([
+        ("sqlite", SqliteDialect),
+        ("sqlite_replace", SqliteReplaceDialect),
+        ("postgresql", PostgresqlDialect),
+        ("mysql", MysqlDialect),
+        ("mssql", MssqlDialect),
+        ])
+
+
+def from_config(config):
+    """Returns the Dialect named by config.dialect."""
+    return DIALECTS[config.dialect]()
@@ -0,0 +1,114 @@
+import sqlite3
+import unittest
+
+from asana2sql import dialect
+
+COLUMNS = ["id", "name", "color"]
+KEY_COLUMNS = ["id"]
+
+
+class DialectTestCase(unittest.TestCase):
+    def test_insert(self):
+        self.assertEqual(
+                dialect.SqliteDialect().insert("t", ["id"], num_rows=3),
+                'INSERT INTO "t" ("id") VALUES (?),(?),(?);')
+
+    def test_batches(self):
+        sql_dialect = dialect.SqliteDialect()
+        sql_dialect.max_params = 6
+        sql_dialect.max_rows = 4
+
+        self.assertEqual(sql_dialect.batches(range(5), 1),
+                         [[0, 1, 2, 3], [4]])
+        self.assertEqual(sql_dialect.batches(range(5), 2),
+                         [[0, 1, 2], [3, 4]])
+        self.assertEqual(sql_dialect.batches(range(2), 10), [[0], [1]])
+        self.assertEqual(sql_dialect.batches([], 1), [])
+
+    def test_upsert_is_abstract(self):
+        self.assertRaises(TypeError, dialect.Dialect)
+
+    def test_sqlite(self):
+        self.assertEqual(
+                dialect.SqliteDialect().upsert("t", COLUMNS, KEY_COLUMNS),
+                'INSERT INTO "t" ("id","name","color") VALUES (?,?,?) '
+                'ON CONFLICT ("id") DO UPDATE SET '
+                '"name"=excluded."name","color"=excluded."color";')
+
+    def test_sqlite_key_only(self):
+        self.assertEqual(
+                dialect.SqliteDialect().upsert("t", ["a", "b"], ["a", "b"], 2),
+                'INSERT INTO "t" ("a","b") VALUES (?,?),(?,?) '
+                'ON CONFLICT ("a","b") DO NOTHING;')
+
+    def test_sqlite_replace(self):
+        self.assertEqual(
+                dialect.SqliteReplaceDialect().upsert("t", COLUMNS, KEY_COLUMNS),
+                'INSERT OR REPLACE INTO "t" ("id","name","color") VALUES (?,?,?);')
+
+    def test_postgresql(self):
+        self.assertEqual(
+                dialect.PostgresqlDialect().upsert("t", COLUMNS, KEY_COLUMNS),
+                dialect.SqliteDialect().upsert("t", COLUMNS, KEY_COLUMNS))
+
+    def test_mysql(self):
+        self.assertEqual(
+                dialect.MysqlDialect().upsert("t", COLUMNS, KEY_COLUMNS, 2),
+                'INSERT INTO "t" ("id","name","color") VALUES (?,?,?),(?,?,?) '
+                'ON DUPLICATE KEY UPDATE '
+                '"name"=VALUES("name"),"color"=VALUES("color");')
+        self.assertEqual(
+                dialect.MysqlDialect().upsert("t", ["a", "b"], ["a", "b"]),
+                'INSERT INTO "t" ("a","b") VALUES (?,?) '
+                'ON DUPLICATE KEY UPDATE "a"=VALUES("a");')
+
+    def test_mssql(self):
+        self.assertEqual(
+                dialect.MssqlDialect().upsert("t", COLUMNS, KEY_COLUMNS, 2),
+                'MERGE INTO "t" AS target '
+                'USING (VALUES (?,?,?),(?,?,?)) AS source ("id","name","color") '
+                'ON target."id"=source."id" '
+                'WHEN MATCHED THEN UPDATE SET '
+                '"name"=source."name","color"=source."color" '
+                'WHEN NOT MATCHED THEN INSERT ("id","name","color") '
+                'VALUES (source."id",source."name",source."color");')
+        self.assertEqual(
+                dialect.MssqlDialect().upsert("t", ["a", "b"], ["a", "b"]),
+                'MERGE INTO "t" AS target USING (VALUES (?,?)) AS source ("a","b") '
+                'ON target."a"=source."a" AND target."b"=source."b" '
+                'WHEN NOT MATCHED THEN INSERT ("a","b") '
+                'VALUES (source."a",source."b");')
+
+    @unittest.skipIf(sqlite3.sqlite_version_info < (3, 24, 0),
+                     "SQLite upserts need 3.24")
+    def test_create_temp_table(self):
+        self.assertEqual(
+                dialect.SqliteDialect().create_temp_table(
+                    "t", "id INTEGER NOT NULL PRIMARY KEY"),
+                'CREATE TEMPORARY TABLE IF NOT EXISTS "t" '
+                '(id INTEGER NOT NULL PRIMARY KEY);')
+        mssql = dialect.MssqlDialect()
+        self.assertEqual(mssql.temp_table_name("t"), "#t")
+        self.assertEqual(
+                mssql.create_temp_table("t", "id INTEGER NOT NULL PRIMARY KEY"),
+                "IF OBJECT_ID('tempdb..#t') IS NULL "
+                'CREATE TABLE "#t" (id INTEGER NOT NULL PRIMARY KEY);')
+
+    def test_sqlite_upsert_runs(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(
+                'CREATE TABLE "t" (id INTEGER PRIMARY KEY, name TEXT, color TEXT);')
+        sql_dialect = dialect.SqliteDialect()
+
+        conn.execute(sql_dialect.upsert("t", COLUMNS, KEY_COLUMNS, 2),
+                     (1, "one", "red", 2, "two", "blue"))
+        conn.execute(sql_dialect.upsert("t", COLUMNS, KEY_COLUMNS),
+                     (1, "uno", "green"))
+
+        self.assertEqual(
+                conn.execute('SELECT * FROM "t" ORDER BY id;').fetchall(),
+                [(1, "uno", "green"), (2, "two", "blue")])
+
+
+if __name__ == '__main__':
+    unittest.main()
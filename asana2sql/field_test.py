@@ -38,6 +38,19 @@ class SimpleFieldTestCase(unittest.TestCase):
         simple_field = SimpleField("test", SqlType.INTEGER, default=123)
         self.assertEquals(simple_field.get_data_from_task(task), 123)
 
+    def test_extractor_matches_get_data_from_task(self):
+        fields = [SimpleField("test", SqlType.INTEGER),
+                  SimpleField("test", SqlType.INTEGER, default=123),
+                  SimpleField("test", SqlType.BOOLEAN),
+                  SimpleField("test", SqlType.BOOLEAN, default=True)]
+        tasks = [{}, {"test": None}, {"test": 0}, {"test": 456}]
+
+        for field in fields:
+            extract = field.extractor()
+            for task in tasks:
+                self.assertEquals(
+                        extract(task), field.get_data_from_task(task))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -197,8 +197,8 @@ class FollowerFieldTestCase(unittest.TestCase):
             ]
         }))
 
-        ws.remove_follower.called_once_with(123, 1)
-        ws.add_follower.called_once_with(123, 4)
+        ws.remove_follower.assert_called_once_with(123, 1)
+        ws.add_follower.assert_called_once_with(123, {"id": 4, "name": "baz"})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+"""Keeps Asana metadata in a small SQLite file between runs.
+
+Project data and custom field definitions, with their enum options, rarely
+change, yet every run would otherwise fetch them again before syncing a single
+task.  Entries are JSON, keyed by their kind and id, and are served until they
+are older than the TTL or, when the caller knows the entity's current
+modified_at, until it no longer matches the stored one.
+"""
+
+import json
+import sqlite3
+import time
+
+# Metadata is fetched again after a day even if it seems unchanged.
+DEFAULT_METADATA_TTL_SECONDS = 24 * 3600
+
+CREATE_ENTRIES_TABLE = (
+        """CREATE TABLE IF NOT EXISTS "metadata" (
+        kind VARCHAR(64) NOT NULL,
+        id INTEGER NOT NULL,
+        fetched_at FLOAT NOT NULL,
+        modified_at VARCHAR(64),
+        data TEXT NOT NULL,
+        PRIMARY KEY (kind, id));
+        """)
+SELECT_ENTRY = (
+        """SELECT fetched_at, modified_at, data FROM "metadata"
+        WHERE kind = ? AND id = ?;""")
+INSERT_ENTRY = (
+        """INSERT OR REPLACE INTO "metadata" (kind, id, fetched_at, modified_at,
+        data) VALUES (?, ?, ?, ?, ?);""")
+
+# Seconds to wait for another process, such as a worker, holding the file.
+LOCK_TIMEOUT_SECONDS = 30
+
+
+class MetadataCache(object):
+    """A persistent cache of Asana metadata.
+
+    With a ttl of None entries never expire.  Entries are committed as they
+    are stored, so the file may be shared by several processes.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_METADATA_TTL_SECONDS, clock=time.time):
+        self._ttl = ttl
+        self._clock = clock
+        self._conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT_SECONDS)
+        with self._conn:
+            self._conn.execute(CREATE_ENTRIES_TABLE)
+
+        self._num_hits = 0
+        self._num_misses = 0
+
+    @property
+    def num_hits(self):
+        return self._num_hits
+
+    @property
+    def num_misses(self):
+        return self._num_misses
+
+    def get(self, kind, id, modified_at=None):
+        """Returns the data stored for the entity, or None if there is none,
+        it has expired, or modified_at is given and differs from the stored
+        one."""
+        row = self._conn.execute(SELECT_ENTRY, (kind, id)).fetchone()
+        if row is None or not self._is_fresh(row, modified_at):
+            self._num_misses += 1
+            return None
+        self._num_hits += 1
+        return json.loads(row[2])
+
+    def _is_fresh(self, row, modified_at):
+        (fetched_at, stored_modified_at, _) = row
+        if self._ttl is not None and self._clock() - fetched_at >= self._ttl:
+            return False
+        return modified_at is None or modified_at == stored_modified_at
+
+    def put(self, kind, id, data, modified_at=None):
+        """Stores data for the entity, along with its modified_at, which
+        defaults to that of data if it has one."""
+        if modified_at is None and isinstance(data, dict):
+            modified_at = data.get("modified_at")
+        with self._conn:
+            self._conn.execute(INSERT_ENTRY, (
+                kind, id, self._clock(), modified_at,
+                json.dumps(data, sort_keys=True)))
+
+    def close(self):
+        self._conn.close()
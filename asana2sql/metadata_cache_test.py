@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from asana2sql.metadata_cache import MetadataCache
+
+
+class MetadataCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "metadata.sqlite")
+        self.now = 1000.0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def cache(self, ttl=60):
+        return MetadataCache(self.path, ttl, clock=lambda: self.now)
+
+    def test_persists_between_instances(self):
+        cache = self.cache()
+        cache.put("project", 1, {"id": 1, "name": "foo"})
+        cache.put("custom_field_settings", 1, [{"custom_field": {"id": 2}}])
+        cache.close()
+
+        cache = self.cache()
+
+        self.assertEqual(cache.get("project", 1), {"id": 1, "name": "foo"})
+        self.assertEqual(cache.get("custom_field_settings", 1),
+                         [{"custom_field": {"id": 2}}])
+        self.assertIsNone(cache.get("project", 2))
+        self.assertIsNone(cache.get("custom_field", 1))
+        self.assertEqual((cache.num_hits, cache.num_misses), (2, 2))
+
+    def test_ttl(self):
+        cache = self.cache(ttl=60)
+        cache.put("project", 1, {"id": 1})
+
+        self.now += 59
+        self.assertEqual(cache.get("project", 1), {"id": 1})
+        self.now += 1
+        self.assertIsNone(cache.get("project", 1))
+        self.assertEqual(self.cache(ttl=None).get("project", 1), {"id": 1})
+
+    def test_modified_at(self):
+        cache = self.cache()
+        cache.put("project", 1, {"id": 1, "modified_at": "2017-01-01"})
+        cache.put("custom_field_settings", 1, [], modified_at="2017-01-01")
+
+        self.assertEqual(cache.get("project", 1, "2017-01-01"),
+                         {"id": 1, "modified_at": "2017-01-01"})
+        self.assertIsNone(cache.get("project", 1, "2017-01-02"))
+        self.assertEqual(cache.get("custom_field_settings", 1, "2017-01-01"), [])
+        self.assertIsNone(cache.get("custom_field_settings", 1, "2017-01-02"))
+
+
+if __name__ == '__main__':
+    unittest.main()
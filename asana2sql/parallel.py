@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+
+from asana2sql import perf
+from asana2sql.fields import default_fields
+from asana2sql.project import Project
+from asana2sql.workspace import Workspace
+
+
+class SharedRowsWorkspace(Workspace):
+    """A Workspace for worker processes that defers writes to the tables shared
+    by all projects.
+
+    Users, projects and custom fields are collected, de-duplicated by id, and
+    handed back to the coordinator instead of being written, so that workers do
+    not race on the same rows.
+    """
+
+    def __init__(self, asana_client, db_client, config):
+        super(SharedRowsWorkspace, self).__init__(asana_client, db_client, config)
+        self._shared_users = {}
+        self._shared_projects = {}
+        self._shared_custom_fields = {}
+
+    def add_user(self, user):
+        self._shared_users[user["id"]] = user
+
+    def add_users(self, users):
+        for user in users:
+            self.add_user(user)
+
+    def add_project(self, project):
+        self._shared_projects[project["id"]] = project
+
+    def add_projects(self, projects):
+        for project in projects:
+            self.add_project(project)
+
+    def add_custom_field(self, custom_field_value):
+        self._shared_custom_fields[custom_field_value["id"]] = custom_field_value
+
+    def shared_rows(self):
+        return {
+            "users": list(self._shared_users.values()),
+            "projects": list(self._shared_projects.values()),
+            "custom_fields": list(self._shared_custom_fields.values()),
+            }
+
+
+def shard(items, num_shards):
+    """Splits items round-robin into at most num_shards non-empty lists."""
+    shards = [items[i::num_shards] for i in range(num_shards)]
+    return [s for s in shards if s]
+
+
+def _run_worker(job):
+    """Runs a command over a shard of projects in a worker process.
+
+    Returns the shared rows to be written by the coordinator and the worker's
+    perf counters.
+    """
+    (args, project_ids, client_factory, db_wrapper_factory) = job
+
+    client = client_factory(args)
+    profiler = None
+    if perf.profiling_requested(args):
+        profiler = perf.Profiler(
+                lambda: client.num_requests, args.profile,
+                profile_suffix=".worker-{}".format(os.getpid()))
+        perf.set_profiler(profiler)
+
+    db_wrapper = db_wrapper_factory(args)
+    workspace = SharedRowsWorkspace(client, db_wrapper, args)
+    projects = [
+            Project(client, db_wrapper, workspace, args,
+                    default_fields(workspace), project_id=project_id)
+            for project_id in project_ids]
+
+    # Commit after each project so that, on databases with a single writer
+    # such as SQLite, the other workers wait for one project at a time rather
+    # than for the whole shard.
+    for project in projects:
+        if args.command == 'export':
+            project.export(incremental=args.incremental, resume=args.resume)
+        elif args.command == 'synchronize':
+            project.synchronize(resume=args.resume)
+        db_wrapper.commit()
+
+    worker_counters = perf.counters(client, db_wrapper, projects)
+    if profiler:
+        if args.profile:
+            profiler.write_profiles()
+        perf.set_profiler(None)
+
+    return (workspace.shared_rows(), worker_counters)
+
+
+def run_in_parallel(args, project_ids, num_workers, workspace,
+                    client_factory, db_wrapper_factory):
+    """Runs the export or synchronize command with projects sharded across
+    num_workers processes, each with its own Asana client and DB connection.
+
+    client_factory and db_wrapper_factory build those from args and must be
+    picklable, i.e. module-level functions.  Shared rows returned by the
+    workers are written once through the coordinator's workspace, which loads
+    the custom field settings of all the projects first.  Returns the
+    workers' perf counters merged together.
+    """
+    jobs = [(args, project_shard, client_factory, db_wrapper_factory)
+            for project_shard in shard(project_ids, num_workers)]
+
+    pool = multiprocessing.Pool(len(jobs))
+    try:
+        results = pool.map(_run_worker, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Lets the custom fields below be loaded from the projects' settings in
+    # bulk rather than fetched one at a time.
+    for project_id in project_ids:
+        workspace.prefetch_custom_fields(project_id)
+    for shared_rows, _ in results:
+        workspace.add_users(shared_rows["users"])
+        workspace.add_projects(shared_rows["projects"])
+        for custom_field in shared_rows["custom_fields"]:
+            workspace.add_custom_field(custom_field)
+
+    return perf.merge_counters(*[counters for _, counters in results])
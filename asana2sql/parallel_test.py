@@ -0,0 +1,219 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import mock
+
+from asana2sql import db_wrapper
+from asana2sql import parallel
+from asana2sql import perf
+from asana2sql import test_fixtures as fixtures
+from asana2sql import util
+from asana2sql import workspace
+from asana2sql.fields import default_fields
+from asana2sql.project import Project
+from asana2sql.sqlite_wrapper import SqliteDatabaseWrapper
+
+# Tasks of each project in the SQLite tests.
+TASKS_PER_PROJECT = 50
+
+# An enum custom field set on every task in the SQLite tests.
+PRIORITY = {"id": 7, "name": "Priority", "type": "enum",
+            "enum_options": [{"id": 71, "name": "High", "enabled": True,
+                              "color": "red"}]}
+
+
+def sqlite_client_factory(args):
+    """Builds a fake Asana client in a worker process."""
+    client = mock.Mock()
+    client.num_requests = 0
+    client.num_retries = 0
+    client.throttled_seconds = 0.0
+    client.projects.find_by_id.side_effect = (
+            lambda project_id, **kwargs: fixtures.project(
+                id=project_id, name="Project {}".format(project_id)))
+
+    def find_by_project(project_id, **kwargs):
+        custom_field_value = dict(PRIORITY, enum_value=PRIORITY["enum_options"][0])
+        return [fixtures.task(id=project_id * 1000 + i, name="Task {}".format(i),
+                              custom_fields=[custom_field_value])
+                for i in range(TASKS_PER_PROJECT)]
+    client.tasks.find_by_project.side_effect = find_by_project
+    client.get_collection.side_effect = (
+            lambda path, query, **kwargs: [{"custom_field": PRIORITY}])
+    return client
+
+
+def sqlite_db_wrapper_factory(args):
+    return SqliteDatabaseWrapper(args.sqlite_path)
+
+
+class ShardTestCase(unittest.TestCase):
+    def test_shard(self):
+        self.assertEqual(parallel.shard([1, 2, 3, 4, 5], 2), [[1, 3, 5], [2, 4]])
+
+    def test_more_shards_than_items(self):
+        self.assertEqual(parallel.shard([1, 2], 4), [[1], [2]])
+
+
+class ParallelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.args = mock.Mock()
+        self.args.command = "export"
+        self.args.incremental = False
+        self.args.table_name = None
+        self.args.skip_unchanged = False
+        self.args.prefetch_tasks = 0
+        self.args.commit_every = 0
+        self.args.resume = False
+        self.args.dump_perf = False
+        self.args.perf_json = None
+        self.args.profile = None
+        self.args.dialect = "sqlite"
+        self.args.projects_table_name = None
+        self.args.project_memberships_table_name = None
+        self.args.users_table_name = None
+        self.args.followers_table_name = None
+        self.args.custom_fields_table_name = None
+        self.args.custom_field_enum_values_table_name = None
+        self.args.custom_field_values_table_name = None
+        self.args.sync_state_table_name = None
+        self.args.custom_field_ttl = None
+        self.args.cache_max_rows = None
+        self.args.write_back_cache = False
+        self.args.metadata_cache = None
+
+        self.client = mock.Mock()
+        self.client.num_requests = 3
+        self.client.num_retries = 1
+        self.client.throttled_seconds = 0.5
+        self.client.projects.find_by_id.return_value = fixtures.project(
+                id=1, name="Project")
+        task = fixtures.task(id=10)
+        task["assignee"] = fixtures.user(id=20, name="Assignee")
+        task["projects"] = [fixtures.project(id=1, name="Project")]
+        self.client.tasks.find_by_project.return_value = [task]
+
+        self.db_client = mock.Mock(spec=db_wrapper.DatabaseWrapper)
+        self.db_client.read.return_value = []
+        self.db_client.num_reads = 1
+        self.db_client.num_writes = 2
+        self.db_client.num_executed = 3
+        self.db_client.statement_timings = perf.StatementTimings()
+
+    def client_factory(self, args):
+        return self.client
+
+    def db_wrapper_factory(self, args):
+        return self.db_client
+
+    def test_shared_rows_workspace(self):
+        ws = parallel.SharedRowsWorkspace(self.client, self.db_client, self.args)
+
+        ws.add_user(fixtures.user(id=1, name="foo"))
+        ws.add_user(fixtures.user(id=1, name="foo"))
+        ws.add_project(fixtures.project(id=2, name="bar"))
+        ws.add_custom_field({"id": 3, "name": "baz", "type": "text"})
+
+        self.assertEqual(ws.shared_rows(), {
+            "users": [fixtures.user(id=1, name="foo")],
+            "projects": [fixtures.project(id=2, name="bar")],
+            "custom_fields": [{"id": 3, "name": "baz", "type": "text"}],
+            })
+        self.db_client.write.assert_not_called()
+
+    def test_run_worker(self):
+        shared_rows, counters = parallel._run_worker(
+                (self.args, [1], self.client_factory, self.db_wrapper_factory))
+
+        self.assertEqual(shared_rows["users"], [fixtures.user(id=20, name="Assignee")])
+        self.assertEqual(shared_rows["projects"], [fixtures.project(id=1, name="Project")])
+        self.assertEqual(counters["api_requests"], 3)
+        self.assertEqual(counters["db_writes"], 2)
+        self.db_client.commit.assert_called_once_with()
+
+    def test_run_worker_commits_each_project(self):
+        parallel._run_worker(
+                (self.args, [1, 2], self.client_factory, self.db_wrapper_factory))
+
+        self.assertEqual(self.db_client.commit.call_count, 2)
+
+    @mock.patch("multiprocessing.Pool")
+    def test_run_in_parallel(self, pool):
+        pool.return_value.map.side_effect = lambda fn, jobs: [fn(job) for job in jobs]
+        coordinator_workspace = mock.Mock(spec=workspace.Workspace)
+
+        counters = parallel.run_in_parallel(
+                self.args, [1, 2], 2, coordinator_workspace,
+                self.client_factory, self.db_wrapper_factory)
+
+        pool.assert_called_once_with(2)
+        self.assertEqual(counters["api_requests"], 6)
+        self.assertEqual(counters["api_retries"], 2)
+        self.assertEqual(counters["api_throttled_seconds"], 1.0)
+        self.assertEqual(counters["db_executed"], 6)
+        self.assertEqual(
+                coordinator_workspace.prefetch_custom_fields.call_args_list,
+                [mock.call(1), mock.call(2)])
+        self.assertEqual(coordinator_workspace.add_users.call_args_list, [
+            mock.call([fixtures.user(id=20, name="Assignee")]),
+            mock.call([fixtures.user(id=20, name="Assignee")])])
+
+
+class SqliteParallelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.args = argparse.Namespace(
+                command="export", incremental=False, resume=False,
+                table_name=None, skip_unchanged=False, prefetch_tasks=0,
+                commit_every=0, dump_perf=False, perf_json=None, profile=None,
+                dialect="sqlite", projects_table_name=None,
+                project_memberships_table_name=None, users_table_name=None,
+                followers_table_name=None, custom_fields_table_name=None,
+                custom_field_enum_values_table_name=None,
+                custom_field_values_table_name=None,
+                sync_state_table_name=None, checkpoints_table_name=None,
+                custom_field_ttl=None, cache_max_rows=None,
+                write_back_cache=False, metadata_cache=None,
+                sqlite_path=os.path.join(self.tempdir, "test.sqlite"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_two_workers_share_sqlite_file(self):
+        project_ids = [1, 2, 3, 4]
+        client = sqlite_client_factory(self.args)
+        db = sqlite_db_wrapper_factory(self.args)
+        coordinator_workspace = workspace.Workspace(client, db, self.args)
+        for project_id in project_ids:
+            Project(client, db, coordinator_workspace, self.args,
+                    default_fields(coordinator_workspace),
+                    project_id=project_id).create_table()
+        coordinator_workspace.create_tables()
+        db.commit()
+
+        parallel.run_in_parallel(
+                self.args, project_ids, 2, coordinator_workspace,
+                sqlite_client_factory, sqlite_db_wrapper_factory)
+        db.commit()
+
+        conn = sqlite3.connect(self.args.sqlite_path)
+        try:
+            for project_id in project_ids:
+                (count,) = conn.execute('SELECT COUNT(*) FROM "{}";'.format(
+                    util.sql_safe_name("Project {}".format(project_id)))
+                    ).fetchone()
+                self.assertEqual(count, TASKS_PER_PROJECT)
+            self.assertEqual(
+                    conn.execute('SELECT id FROM "custom_field_enum_values";'
+                                 ).fetchall(),
+                    [(71,)])
+        finally:
+            conn.close()
+        client.get.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
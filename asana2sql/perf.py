@@ -0,0 +1,403 @@
+import cProfile
+import collections
+import json
+import math
+import os
+import re
+import sys
+import threading
+import timeit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from time import process_time
+except ImportError:
+    from time import clock as process_time
+
+COUNTER_NAMES = [
+        "api_requests",
+        "api_retries",
+        "api_throttled_seconds",
+        "tasks_skipped",
+        "db_reads",
+        "db_writes",
+        "db_executed",
+        ]
+
+# Latency histogram buckets grow geometrically from MIN_BUCKET_SECONDS, so a
+# reported percentile is at most BUCKET_GROWTH times the true value.
+MIN_BUCKET_SECONDS = 1e-6
+BUCKET_GROWTH = 1.1
+
+# Longest statement template printed by print_counters.
+MAX_PRINTED_TEMPLATE_LENGTH = 100
+
+# Phases reported in this order, followed by any others.
+PHASE_NAMES = [
+        "project_fetch",
+        "task_fetch",
+        "throttled",
+        "field_extraction",
+        "join_table_diffing",
+        "reads",
+        "writes",
+        "commit",
+        ]
+
+_WHITESPACE = re.compile(r"\s+")
+_REPEATED_VALUES_ROWS = re.compile(r"(\(\?(?:,\?)*\))(?:,\1)+")
+
+
+def normalize_sql(sql):
+    """Reduces a statement to a template shared by statements that differ only
+    in layout or in the number of rows of a multi-row VALUES list."""
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    return _REPEATED_VALUES_ROWS.sub(r"\1,...", sql)
+
+
+class LatencyHistogram(object):
+    """Counts durations in log-scale buckets.
+
+    Percentiles are approximate but the histogram takes constant space, and
+    histograms collected by several workers can be merged.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = collections.Counter()
+
+    @staticmethod
+    def _bucket(seconds):
+        if seconds <= MIN_BUCKET_SECONDS:
+            return 0
+        return int(math.ceil(
+            math.log(seconds / MIN_BUCKET_SECONDS) / math.log(BUCKET_GROWTH)))
+
+    def add(self, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[self._bucket(seconds)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_seconds += other.total_seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.buckets.update(other.buckets)
+
+    def percentile(self, fraction):
+        """Returns an upper bound on the given fraction of the durations."""
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(MIN_BUCKET_SECONDS * BUCKET_GROWTH ** bucket,
+                           self.max_seconds)
+        return self.max_seconds
+
+
+class StatementTimings(object):
+    """Execution times of SQL statements grouped by normalized template."""
+
+    def __init__(self):
+        self.histograms = {}
+        self._templates = {}
+
+    def record(self, sql, seconds):
+        template = self._templates.get(sql)
+        if template is None:
+            template = self._templates[sql] = normalize_sql(sql)
+        histogram = self.histograms.get(template)
+        if histogram is None:
+            histogram = self.histograms[template] = LatencyHistogram()
+        histogram.add(seconds)
+
+    def merge(self, other):
+        for template, histogram in other.histograms.items():
+            self.histograms.setdefault(
+                    template, LatencyHistogram()).merge(histogram)
+
+    def summary(self):
+        """Returns one dict per template, slowest in total first."""
+        return [{"statement": template,
+                 "count": histogram.count,
+                 "total_seconds": histogram.total_seconds,
+                 "p50_seconds": histogram.percentile(0.5),
+                 "p95_seconds": histogram.percentile(0.95),
+                 "max_seconds": histogram.max_seconds}
+                for template, histogram in sorted(
+                    self.histograms.items(),
+                    key=lambda item: item[1].total_seconds,
+                    reverse=True)]
+
+
+def peak_rss_bytes():
+    """The process's peak resident set size, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._profiler._enter(self._name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profiler._exit()
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Profiler(object):
+    """Splits a run into named phases and measures each one.
+
+    For every phase it accumulates the number of times it was entered, wall
+    time, CPU time and the number of API requests made (as counted by
+    api_requests_fn), and how much the process's peak RSS grew while in it.
+    Phases nest: time spent in an inner phase is not counted in the outer one.
+    Since the peak never falls, the growth of each phase adds up to the growth
+    of the whole run.
+
+    If profile_dir is given, each phase is also profiled with cProfile and
+    write_profiles saves the stats as <phase><profile_suffix>.pstats there.
+
+    Only phases entered on the thread that created the Profiler are measured.
+    """
+
+    def __init__(self, api_requests_fn=lambda: 0, profile_dir=None,
+                 profile_suffix=""):
+        self._api_requests_fn = api_requests_fn
+        self._profile_dir = profile_dir
+        self._profile_suffix = profile_suffix
+        self._thread = threading.current_thread()
+
+        self._stack = []
+        self._started = None
+        self._phases = {}
+        self._cprofiles = {}
+        self._phase_objects = {}
+
+    def phase(self, name):
+        if threading.current_thread() is not self._thread:
+            return _NULL_PHASE
+        phase = self._phase_objects.get(name)
+        if phase is None:
+            phase = self._phase_objects[name] = _Phase(self, name)
+        return phase
+
+    def _start(self, name):
+        if self._profile_dir:
+            cprofile = self._cprofiles.get(name)
+            if cprofile is None:
+                cprofile = self._cprofiles[name] = cProfile.Profile()
+            cprofile.enable()
+        self._started = (timeit.default_timer(), process_time(),
+                         self._api_requests_fn(), peak_rss_bytes())
+
+    def _stop(self, name):
+        (wall, cpu, api_requests, peak_rss) = self._started
+        stats = self._phases.get(name)
+        if stats is None:
+            stats = self._phases[name] = {
+                    "calls": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "api_requests": 0,
+                    "peak_rss_growth_bytes": None,
+                    }
+        stats["wall_seconds"] += timeit.default_timer() - wall
+        stats["cpu_seconds"] += process_time() - cpu
+        stats["api_requests"] += self._api_requests_fn() - api_requests
+        if peak_rss is not None:
+            stats["peak_rss_growth_bytes"] = (
+                    (stats["peak_rss_growth_bytes"] or 0) +
+                    peak_rss_bytes() - peak_rss)
+        if self._profile_dir:
+            self._cprofiles[name].disable()
+
+    def _enter(self, name):
+        if self._stack:
+            self._stop(self._stack[-1])
+        self._stack.append(name)
+        self._start(name)
+
+    def _exit(self):
+        name = self._stack.pop()
+        self._stop(name)
+        self._phases[name]["calls"] += 1
+        if self._stack:
+            self._start(self._stack[-1])
+
+    def phases(self):
+        """Returns a copy of the measurements, keyed by phase name."""
+        return {name: dict(stats) for name, stats in self._phases.items()}
+
+    def write_profiles(self):
+        for name, cprofile in self._cprofiles.items():
+            cprofile.dump_stats(os.path.join(
+                self._profile_dir,
+                "{}{}.pstats".format(name, self._profile_suffix)))
+
+
+_profiler = None
+
+
+def profiling_requested(config):
+    """Whether the run's options ask for phase measurements."""
+    return bool(config.dump_perf or config.perf_json or config.profile)
+
+
+def set_profiler(profiler):
+    """Makes profiler the one measuring phase(); None turns measuring off."""
+    global _profiler
+    _profiler = profiler
+
+
+def phase(name):
+    """Returns a context manager that measures its block as the named phase
+    of the current Profiler, if any."""
+    if _profiler is None:
+        return _NULL_PHASE
+    return _profiler.phase(name)
+
+
+def timed_iter(name, iterable):
+    """Yields the items of iterable, measuring the time spent getting each one
+    as the named phase."""
+    iterator = iter(iterable)
+    try:
+        while True:
+            with phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+
+
+def merge_phases(*all_phases):
+    merged = {}
+    for phases in all_phases:
+        for name, stats in phases.items():
+            if name not in merged:
+                merged[name] = dict(stats)
+                continue
+            total = merged[name]
+            for key in ["calls", "wall_seconds", "cpu_seconds", "api_requests"]:
+                total[key] += stats[key]
+            if stats["peak_rss_growth_bytes"] is not None:
+                total["peak_rss_growth_bytes"] = (
+                        (total["peak_rss_growth_bytes"] or 0) +
+                        stats["peak_rss_growth_bytes"])
+    return merged
+
+
+def _ordered_phase_names(phases):
+    return ([name for name in PHASE_NAMES if name in phases] +
+            sorted(name for name in phases if name not in PHASE_NAMES))
+
+
+def counters(asana_client, db_wrapper, projects):
+    """Collects the counters of one run into a plain, picklable dict."""
+    return {
+        "api_requests": asana_client.num_requests,
+        "api_retries": asana_client.num_retries,
+        "api_throttled_seconds": asana_client.throttled_seconds,
+        "tasks_skipped": sum(project.num_skipped for project in projects),
+        "db_reads": db_wrapper.num_reads,
+        "db_writes": db_wrapper.num_writes,
+        "db_executed": db_wrapper.num_executed,
+        "statement_timings": db_wrapper.statement_timings,
+        "phases": _profiler.phases() if _profiler else {},
+        }
+
+
+def merge_counters(*all_counters):
+    """Sums counters collected by several workers."""
+    merged = {name: sum(c.get(name, 0) for c in all_counters)
+              for name in COUNTER_NAMES}
+    merged["statement_timings"] = StatementTimings()
+    for c in all_counters:
+        if "statement_timings" in c:
+            merged["statement_timings"].merge(c["statement_timings"])
+    merged["phases"] = merge_phases(*[c.get("phases", {}) for c in all_counters])
+    return merged
+
+
+def report(counters):
+    """Converts counters into a JSON-serializable dict."""
+    result = {name: counters[name] for name in COUNTER_NAMES}
+    result["statements"] = counters["statement_timings"].summary()
+    result["phases"] = counters["phases"]
+    return result
+
+
+def write_json(counters, path):
+    with open(path, "w") as f:
+        json.dump(report(counters), f, indent=2, sort_keys=True)
+
+
+def print_counters(counters):
+    print("API Requests: {}".format(counters["api_requests"]))
+    print("API Retries: {}, time throttled: {:.2f} s".format(
+        counters["api_retries"], counters["api_throttled_seconds"]))
+    print("Tasks skipped as unchanged: {}".format(counters["tasks_skipped"]))
+    print("DB Commands: reads = {}, writes = {}, executed = {}".format(
+        counters["db_reads"], counters["db_writes"], counters["db_executed"]))
+
+    phases = counters["phases"]
+    if phases:
+        print("Phases: calls, wall s, CPU s, API requests, "
+              "peak RSS growth MB, phase")
+    for name in _ordered_phase_names(phases):
+        stats = phases[name]
+        growth = stats["peak_rss_growth_bytes"]
+        print("  {:>7} {:>8.2f} {:>8.2f} {:>7} {:>8}  {}".format(
+            stats["calls"],
+            stats["wall_seconds"],
+            stats["cpu_seconds"],
+            stats["api_requests"],
+            "-" if growth is None else "{:.1f}".format(growth / float(1 << 20)),
+            name))
+
+    statements = counters["statement_timings"].summary()
+    if statements:
+        print("DB Statement Latency (ms): "
+              "count, total, p50, p95, max, statement")
+    for statement in statements:
+        template = statement["statement"]
+        if len(template) > MAX_PRINTED_TEMPLATE_LENGTH:
+            template = template[:MAX_PRINTED_TEMPLATE_LENGTH - 3] + "..."
+        print("  {:>7} {:>10.1f} {:>8.2f} {:>8.2f} {:>8.2f}  {}".format(
+            statement["count"],
+            statement["total_seconds"] * 1000,
+            statement["p50_seconds"] * 1000,
+            statement["p95_seconds"] * 1000,
+            statement["max_seconds"] * 1000,
+            template))
@@ -0,0 +1,190 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from asana2sql import perf
+
+
+class PerfTestCase(unittest.TestCase):
+    def test_counters(self):
+        client = mock.Mock(num_requests=1, num_retries=7,
+                           throttled_seconds=1.5)
+        timings = perf.StatementTimings()
+        db_wrapper = mock.Mock(num_reads=2, num_writes=3, num_executed=4,
+                               statement_timings=timings)
+        projects = [mock.Mock(num_skipped=5), mock.Mock(num_skipped=6)]
+
+        self.assertEqual(perf.counters(client, db_wrapper, projects), {
+            "api_requests": 1,
+            "api_retries": 7,
+            "api_throttled_seconds": 1.5,
+            "tasks_skipped": 11,
+            "db_reads": 2,
+            "db_writes": 3,
+            "db_executed": 4,
+            "statement_timings": timings,
+            "phases": {},
+            })
+
+    def test_merge_counters(self):
+        timings1 = perf.StatementTimings()
+        timings1.record("SELECT 1;", 0.001)
+        timings2 = perf.StatementTimings()
+        timings2.record("SELECT 1;", 0.003)
+
+        merged = perf.merge_counters(
+                {"api_requests": 1, "db_reads": 2,
+                 "statement_timings": timings1},
+                {"api_requests": 3, "db_writes": 4,
+                 "statement_timings": timings2})
+
+        self.assertEqual(merged["statement_timings"].histograms["SELECT 1;"].count, 2)
+        del merged["statement_timings"]
+        self.assertEqual(merged.pop("phases"), {})
+        self.assertEqual(merged,
+                {"api_requests": 4,
+                 "api_retries": 0,
+                 "api_throttled_seconds": 0,
+                 "tasks_skipped": 0,
+                 "db_reads": 2,
+                 "db_writes": 4,
+                 "db_executed": 0})
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+                perf.normalize_sql('INSERT INTO "t" ("a","b")\n  VALUES (?,?),(?,?),(?,?);'),
+                'INSERT INTO "t" ("a","b") VALUES (?,?),...;')
+        self.assertEqual(
+                perf.normalize_sql('INSERT INTO "t" ("a") VALUES (?);'),
+                'INSERT INTO "t" ("a") VALUES (?);')
+
+    def test_histogram_percentiles(self):
+        histogram = perf.LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.add(ms / 1000.0)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.total_seconds, 5.05)
+        self.assertEqual(histogram.max_seconds, 0.1)
+        self.assertTrue(0.050 <= histogram.percentile(0.5) <= 0.050 * perf.BUCKET_GROWTH)
+        self.assertTrue(0.095 <= histogram.percentile(0.95) <= 0.095 * perf.BUCKET_GROWTH)
+        self.assertEqual(histogram.percentile(1), 0.1)
+
+    def test_statement_timings_summary(self):
+        timings = perf.StatementTimings()
+        timings.record('INSERT INTO "t" VALUES (?),(?);', 0.001)
+        timings.record('INSERT INTO "t" VALUES (?),(?),(?);', 0.002)
+        timings.record("SELECT 1;", 0.010)
+
+        summary = timings.summary()
+
+        self.assertEqual([s["statement"] for s in summary],
+                         ["SELECT 1;", 'INSERT INTO "t" VALUES (?),...;'])
+        self.assertEqual(summary[1]["count"], 2)
+        self.assertAlmostEqual(summary[1]["total_seconds"], 0.003)
+        self.assertEqual(summary[1]["max_seconds"], 0.002)
+
+    def test_write_json(self):
+        timings = perf.StatementTimings()
+        timings.record("SELECT 1;", 0.001)
+        counters = perf.merge_counters(
+                {"api_requests": 1, "statement_timings": timings})
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "perf.json")
+            perf.write_json(counters, path)
+            with open(path) as f:
+                result = json.load(f)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(result["api_requests"], 1)
+        self.assertEqual(result["statements"][0]["statement"], "SELECT 1;")
+        self.assertEqual(result["statements"][0]["count"], 1)
+
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def tearDown(self):
+        perf.set_profiler(None)
+
+    def test_nested_phases(self):
+        api_requests = [0]
+        profiler = perf.Profiler(lambda: api_requests[0])
+        perf.set_profiler(profiler)
+
+        with perf.phase("outer"):
+            api_requests[0] += 1
+            with perf.phase("inner"):
+                api_requests[0] += 2
+            with perf.phase("inner"):
+                pass
+            api_requests[0] += 4
+
+        phases = profiler.phases()
+        self.assertEqual(phases["outer"]["calls"], 1)
+        self.assertEqual(phases["outer"]["api_requests"], 5)
+        self.assertEqual(phases["inner"]["calls"], 2)
+        self.assertEqual(phases["inner"]["api_requests"], 2)
+        self.assertTrue(phases["outer"]["wall_seconds"] >= 0)
+        self.assertTrue(phases["inner"]["cpu_seconds"] >= 0)
+
+    def test_peak_rss_growth(self):
+        profiler = perf.Profiler()
+        perf.set_profiler(profiler)
+
+        with mock.patch.object(perf, "peak_rss_bytes",
+                               side_effect=[100, 300, 300, 350]):
+            with perf.phase("fetch"):
+                pass
+            with perf.phase("fetch"):
+                pass
+
+        self.assertEqual(
+                profiler.phases()["fetch"]["peak_rss_growth_bytes"], 250)
+
+    def test_phase_without_profiler(self):
+        with perf.phase("ignored"):
+            pass
+
+    def test_timed_iter(self):
+        profiler = perf.Profiler()
+        perf.set_profiler(profiler)
+
+        self.assertEqual(list(perf.timed_iter("fetch", [1, 2, 3])), [1, 2, 3])
+
+        self.assertEqual(profiler.phases()["fetch"]["calls"], 4)
+
+    def test_write_profiles(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            profiler = perf.Profiler(profile_dir=tmp_dir, profile_suffix=".1")
+            perf.set_profiler(profiler)
+            with perf.phase("writes"):
+                sum(range(10))
+            profiler.write_profiles()
+
+            self.assertEqual(os.listdir(tmp_dir), ["writes.1.pstats"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_merge_phases(self):
+        merged = perf.merge_phases(
+                {"writes": {"calls": 1, "wall_seconds": 1.0, "cpu_seconds": 0.5,
+                            "api_requests": 0, "peak_rss_growth_bytes": 100}},
+                {"writes": {"calls": 2, "wall_seconds": 2.0, "cpu_seconds": 1.0,
+                            "api_requests": 3, "peak_rss_growth_bytes": 50},
+                 "commit": {"calls": 1, "wall_seconds": 0.1, "cpu_seconds": 0.0,
+                            "api_requests": 0, "peak_rss_growth_bytes": None}})
+
+        self.assertEqual(merged["writes"], {
+            "calls": 3, "wall_seconds": 3.0, "cpu_seconds": 1.5,
+            "api_requests": 3, "peak_rss_growth_bytes": 150})
+        self.assertEqual(merged["commit"]["calls"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# How often a blocked producer checks whether the consumer has gone away.
+POLL_INTERVAL_SECONDS = 0.1
+
+
+class _Done(object):
+    """Marks the end of the items, carrying the producer's exception if any."""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+class PrefetchingIterator(object):
+    """Iterates over an iterable in a background thread.
+
+    Up to max_items items are fetched ahead of the consumer and held in a
+    bounded queue, so a slow source such as paged API requests overlaps with
+    whatever the consumer does with each item.  Exceptions raised by the source
+    are re-raised to the consumer.  Call close() if the iteration is abandoned
+    early so the background thread stops fetching.
+    """
+
+    def __init__(self, iterable, max_items):
+        self._iterable = iterable
+        self._queue = queue.Queue(maxsize=max(1, max_items))
+        self._closed = threading.Event()
+        self._done = False
+
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=POLL_INTERVAL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            for item in self._iterable:
+                if not self._put(item):
+                    return
+        except Exception as e:
+            self._put(_Done(e))
+        else:
+            self._put(_Done())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        item = self._queue.get()
+        if isinstance(item, _Done):
+            self._done = True
+            if item.error:
+                raise item.error
+            raise StopIteration
+        return item
+
+    def next(self):
+        """Alias for __next__"""
+        return self.__next__()
+
+    def close(self):
+        """Stops the background thread and discards any prefetched items."""
+        self._done = True
+        self._closed.set()
+        self._thread.join()
+
+
+def prefetch(iterable, max_items):
+    """Yields the items of iterable, fetching up to max_items ahead in a
+    background thread.  The thread is stopped when the generator is closed."""
+    iterator = PrefetchingIterator(iterable, max_items)
+    try:
+        for item in iterator:
+            yield item
+    finally:
+        iterator.close()
@@ -0,0 +1,56 @@
+import threading
+import unittest
+
+from asana2sql import pipeline
+
+
+class PrefetchTestCase(unittest.TestCase):
+    def test_yields_all_items_in_order(self):
+        self.assertEqual(list(pipeline.prefetch(range(100), 3)), list(range(100)))
+
+    def test_empty(self):
+        self.assertEqual(list(pipeline.prefetch([], 3)), [])
+
+    def test_reraises_source_error(self):
+        def source():
+            yield 1
+            raise ValueError("boom")
+
+        iterator = pipeline.prefetch(source(), 3)
+
+        self.assertEqual(next(iterator), 1)
+        self.assertRaises(ValueError, next, iterator)
+
+    def test_fetches_ahead_of_consumer(self):
+        fetched = []
+        two_fetched = threading.Event()
+
+        def source():
+            for i in range(3):
+                fetched.append(i)
+                if len(fetched) == 2:
+                    two_fetched.set()
+                yield i
+
+        iterator = pipeline.PrefetchingIterator(source(), 5)
+
+        self.assertTrue(two_fetched.wait(5))
+        self.assertEqual(list(iterator), [0, 1, 2])
+
+    def test_close_stops_producer(self):
+        def source():
+            i = 0
+            while True:
+                yield i
+                i += 1
+
+        iterator = pipeline.PrefetchingIterator(source(), 2)
+
+        self.assertEqual(next(iterator), 0)
+        iterator.close()
+
+        self.assertRaises(StopIteration, next, iterator)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import datetime
 import unittest
 import mock
 
@@ -5,8 +6,17 @@ from asana2sql.project import Project
 from asana2sql.field import Field, SimpleField, SqlType
 from asana2sql import test_fixtures as fixtures
 from asana2sql import db_wrapper
+from asana2sql import fields
 from asana2sql import workspace
 
+INSERT_ID_SQL = (
+        'INSERT INTO "test_table" ("id") VALUES (?) ON CONFLICT ("id") DO NOTHING;')
+INSERT_ID_AND_NAME_SQL = (
+        'INSERT INTO "test_table" ("id","name") VALUES (?,?) '
+        'ON CONFLICT ("id") DO UPDATE SET "name"=excluded."name";')
+INSERT_ID_AND_MODIFIED_AT_SQL = (
+        'INSERT INTO "test_table" ("id","modified_at") VALUES (?,?) '
+        'ON CONFLICT ("id") DO UPDATE SET "modified_at"=excluded."modified_at";')
 
 class ProjectTestCase(unittest.TestCase):
     def setUp(self):
@@ -15,16 +25,21 @@ class ProjectTestCase(unittest.TestCase):
         self.config = mock.Mock()
         self.config.project_id = 1234
         self.config.table_name = "test_table"
+        self.config.skip_unchanged = False
+        self.config.prefetch_tasks = 0
+        self.config.commit_every = 0
+        self.config.dialect = "sqlite"
         self.workspace = mock.Mock(workspace.Workspace)
 
     def test_derived_table_name(self):
         proj = fixtures.project(id=1234, name="Test Table")
-        self.asana_client.projects.find_by_id.return_value = proj
+        self.workspace.get_project.return_value = proj
         self.config.table_name = None
 
         project = Project(self.asana_client, self.db_client, self.workspace, self.config, [])
 
         self.assertEquals(project.table_name(), "Test_Table")
+        self.workspace.get_project.assert_called_once_with(1234)
 
     def test_create_empty_table(self):
         project = Project(self.asana_client, self.db_client, self.workspace, self.config, [])
@@ -50,6 +65,14 @@ class ProjectTestCase(unittest.TestCase):
                 '''"Complex field name." VARCHAR(1024),'''
                 '''"a_different_field_name" FLOAT);''')
 
+    def test_user_references(self):
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER, primary_key=True),
+                           fields.AssigneeField(self.workspace)])
+
+        self.assertEqual(project.user_references(),
+                         [("test_table", "assignee_id")])
+
     def test_export(self):
         self.asana_client.tasks.find_by_project.return_value = [
                 fixtures.task(id=1), fixtures.task(id=2), fixtures.task(id=3)]
@@ -62,14 +85,116 @@ class ProjectTestCase(unittest.TestCase):
                 1234, fields="id")
         self.db_client.read.assert_not_called()
         self.db_client.write.assert_has_calls([
-                mock.call('INSERT OR REPLACE INTO "test_table" (id) VALUES (?);', 1),
-                mock.call('INSERT OR REPLACE INTO "test_table" (id) VALUES (?);', 2),
-                mock.call('INSERT OR REPLACE INTO "test_table" (id) VALUES (?);', 3)])
+                mock.call(INSERT_ID_SQL, 1),
+                mock.call(INSERT_ID_SQL, 2),
+                mock.call(INSERT_ID_SQL, 3)])
+        self.workspace.prefetch_project.assert_called_once_with(1234)
+        self.workspace.clear_prefetch.assert_called_once_with()
 
-    def test_synchronize(self):
-        existing_rows = [fixtures.row(id=1), fixtures.row(id=2), fixtures.row(id=3)]
-        self.db_client.read.return_value = existing_rows
+    def test_insert_compiles_row_plan_once(self):
+        field = SimpleField("id", SqlType.INTEGER)
+        other_field = mock.Mock(Field)
+        other_field.sql_name = "name"
+        other_field.extractor.return_value = lambda task: task.get("name")
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [field, other_field])
+        project.insert_or_replace(fixtures.task(id=1, name="one"))
+        project.insert_or_replace(fixtures.task(id=2, name="two"))
+
+        other_field.extractor.assert_called_once_with()
+        self.db_client.write.assert_has_calls([
+                mock.call(INSERT_ID_AND_NAME_SQL,
+                          1, "one"),
+                mock.call(INSERT_ID_AND_NAME_SQL,
+                          2, "two")])
+
+    def test_incremental_export(self):
+        self.workspace.last_sync_time.return_value = "2017-01-01T00:10:00.000000Z"
+        self.asana_client.tasks.find_all.return_value = [fixtures.task(id=1)]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.export(incremental=True)
+
+        self.asana_client.tasks.find_all.assert_called_with(
+                {"project": 1234, "modified_since": "2017-01-01T00:05:00.000000Z"},
+                fields="id")
+        self.asana_client.tasks.find_by_project.assert_not_called()
+        self.db_client.write.assert_called_once_with(
+                INSERT_ID_SQL, 1)
+        self.workspace.set_last_sync_time.assert_called_once_with(
+                1234, mock.ANY)
+        self.workspace.prefetch_project.assert_not_called()
+
+    def test_incremental_export_never_synced(self):
+        self.workspace.last_sync_time.return_value = None
+        self.asana_client.tasks.find_by_project.return_value = [fixtures.task(id=1)]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.export(incremental=True)
+
+        self.asana_client.tasks.find_by_project.assert_called_with(
+                1234, fields="id")
+        self.asana_client.tasks.find_all.assert_not_called()
+
+    def test_explicit_project_id(self):
+        self.asana_client.tasks.find_by_project.return_value = []
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)], project_id=5678)
+        project.export()
+
+        self.asana_client.tasks.find_by_project.assert_called_with(
+                5678, fields="id")
 
+    def test_indirect_fields_synced_once_per_task(self):
+        self.workspace.first_sync_of_task.side_effect = [True, False]
+        indirect_field = mock.Mock(Field)
+        indirect_field.sql_name = None
+        indirect_field.required_fields.return_value = ["id"]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER), indirect_field])
+        project.insert_or_replace(fixtures.task(id=1))
+        project.insert_or_replace(fixtures.task(id=1))
+
+        self.assertEqual(self.db_client.write.call_count, 2)
+        indirect_field.get_data_from_task.assert_called_once_with(
+                fixtures.task(id=1))
+        self.workspace.first_sync_of_task.assert_called_with(1, 1234)
+
+    def test_export_streams_tasks(self):
+        def tasks():
+            yield fixtures.task(id=1)
+            self.db_client.write.assert_called_once_with(
+                    INSERT_ID_SQL, 1)
+            yield fixtures.task(id=2)
+
+        self.asana_client.tasks.find_by_project.return_value = tasks()
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.export()
+
+        self.assertEqual(self.db_client.write.call_count, 2)
+
+    def test_export_with_prefetch(self):
+        self.config.prefetch_tasks = 2
+        self.asana_client.tasks.find_by_project.return_value = iter([
+                fixtures.task(id=1), fixtures.task(id=2), fixtures.task(id=3)])
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.export()
+
+        self.assertEqual(self.db_client.write.call_args_list, [
+                mock.call(INSERT_ID_SQL, 1),
+                mock.call(INSERT_ID_SQL, 2),
+                mock.call(INSERT_ID_SQL, 3)])
+
+    def test_synchronize(self):
         self.asana_client.tasks.find_by_project.return_value = [
                 fixtures.task(id=2), fixtures.task(id=3), fixtures.task(id=4)]
 
@@ -79,13 +204,213 @@ class ProjectTestCase(unittest.TestCase):
 
         self.asana_client.tasks.find_by_project.assert_called_with(
                 1234, fields="id")
-        self.db_client.read.assert_called_with('SELECT id FROM "test_table";')
-        self.db_client.write.assert_called_with(
-                'DELETE FROM "test_table" WHERE id = ?;', 1)
-        self.db_client.write.assert_has_calls([
-                mock.call('INSERT OR REPLACE INTO "test_table" (id) VALUES (?);', 2),
-                mock.call('INSERT OR REPLACE INTO "test_table" (id) VALUES (?);', 3),
-                mock.call('INSERT OR REPLACE INTO "test_table" (id) VALUES (?);', 4)])
+        self.db_client.read.assert_not_called()
+        self.assertEqual(self.db_client.mock_calls, [
+                mock.call.write(
+                    'CREATE TEMPORARY TABLE IF NOT EXISTS "asana2sql_live_task_ids" '
+                    '(id INTEGER NOT NULL PRIMARY KEY);'),
+                mock.call.write('DELETE FROM "asana2sql_live_task_ids";'),
+                mock.call.write(INSERT_ID_SQL, 2),
+                mock.call.write(INSERT_ID_SQL, 3),
+                mock.call.write(INSERT_ID_SQL, 4),
+                mock.call.write(
+                    'INSERT INTO "asana2sql_live_task_ids" ("id") VALUES (?),(?),(?);',
+                    2, 3, 4),
+                mock.call.write(
+                    'DELETE FROM "test_table" WHERE id NOT IN (\n'
+                    '        SELECT id FROM "asana2sql_live_task_ids");'),
+                mock.call.write('DROP TABLE "asana2sql_live_task_ids";'),
+                ])
+        self.workspace.remove_tasks_from_project.assert_called_once_with(
+                1234,
+                'SELECT id FROM "test_table" WHERE id NOT IN (\n'
+                '        SELECT id FROM "asana2sql_live_task_ids")')
+
+    def test_synchronize_mssql_temp_table(self):
+        self.config.dialect = "mssql"
+        self.asana_client.tasks.find_by_project.return_value = [
+                fixtures.task(id=2)]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.synchronize()
+
+        writes = [c[1][0] for c in self.db_client.mock_calls]
+        self.assertEqual(writes[0],
+                "IF OBJECT_ID('tempdb..#asana2sql_live_task_ids') IS NULL "
+                'CREATE TABLE "#asana2sql_live_task_ids" '
+                '(id INTEGER NOT NULL PRIMARY KEY);')
+        self.assertEqual(writes[-1], 'DROP TABLE "#asana2sql_live_task_ids";')
+        self.assertIn('INSERT INTO "#asana2sql_live_task_ids" ("id") VALUES (?);',
+                      writes)
+
+    def test_synchronize_repeated_task(self):
+        self.asana_client.tasks.find_by_project.return_value = [
+                fixtures.task(id=2), fixtures.task(id=3), fixtures.task(id=2)]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.synchronize()
+
+        self.assertIn(
+                mock.call.write(
+                    'INSERT INTO "asana2sql_live_task_ids" ("id") VALUES (?),(?);',
+                    2, 3),
+                self.db_client.mock_calls)
+
+    def test_export_skips_unchanged_tasks(self):
+        self.config.skip_unchanged = True
+        self.db_client.read.return_value = [
+                (1, "2017-01-01T00:00:00.000Z"),
+                (2, datetime.datetime(2017, 1, 1)),
+                (3, "2017-01-01T00:00:00.000Z")]
+        indirect_field = mock.Mock(Field)
+        indirect_field.sql_name = None
+        indirect_field.required_fields.return_value = ["id"]
+
+        self.asana_client.tasks.find_by_project.return_value = [
+                {"id": 1, "modified_at": "2017-01-01T00:00:00.000Z"},
+                {"id": 2, "modified_at": "2017-01-01T00:00:00.000Z"},
+                {"id": 3, "modified_at": "2017-02-01T00:00:00.000Z"},
+                {"id": 4, "modified_at": "2017-01-01T00:00:00.000Z"}]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER),
+                           SimpleField("modified_at", SqlType.DATETIME),
+                           indirect_field])
+        project.export()
+
+        self.db_client.read.assert_called_once_with(
+                'SELECT id,modified_at FROM "test_table";')
+        self.assertEqual(self.db_client.write.call_args_list, [
+                mock.call(INSERT_ID_AND_MODIFIED_AT_SQL,
+                          3, "2017-02-01T00:00:00.000Z"),
+                mock.call(INSERT_ID_AND_MODIFIED_AT_SQL,
+                          4, "2017-01-01T00:00:00.000Z")])
+        self.assertEqual(indirect_field.get_data_from_task.call_count, 2)
+        self.assertEqual(project.num_skipped, 2)
+
+    def test_skip_unchanged_requires_modified_at(self):
+        self.config.skip_unchanged = True
+        self.asana_client.tasks.find_by_project.return_value = [fixtures.task(id=1)]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.export()
+
+        self.db_client.read.assert_not_called()
+        self.assertEqual(self.db_client.write.call_count, 1)
+
+    def test_synchronize_skips_unchanged_tasks(self):
+        self.config.skip_unchanged = True
+        self.db_client.read.return_value = [
+                (1, "2017-01-01T00:00:00.000Z"),
+                (2, "2017-01-01T00:00:00.000Z")]
+
+        self.asana_client.tasks.find_by_project.return_value = [
+                {"id": 2, "modified_at": "2017-01-01T00:00:00.000Z"}]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER),
+                           SimpleField("modified_at", SqlType.DATETIME)])
+        project.synchronize()
+
+        self.db_client.read.assert_called_once_with(
+                'SELECT id,modified_at FROM "test_table";')
+        self.assertNotIn(
+                mock.call(INSERT_ID_AND_MODIFIED_AT_SQL,
+                          2, "2017-01-01T00:00:00.000Z"),
+                self.db_client.write.call_args_list)
+        self.db_client.write.assert_any_call(
+                'INSERT INTO "asana2sql_live_task_ids" ("id") VALUES (?);', 2)
+
+    def checkpoint_page(self, ids, next_offset=None):
+        return {"data": [fixtures.task(id=i) for i in ids],
+                "next_page": next_offset and {"offset": next_offset}}
+
+    def test_export_with_checkpoints(self):
+        self.config.commit_every = 2
+        self.asana_client.tasks.find_by_project.side_effect = [
+                self.checkpoint_page([1, 2, 3], "page2"),
+                self.checkpoint_page([4])]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.export()
+
+        self.asana_client.tasks.find_by_project.assert_has_calls([
+                mock.call(1234, fields="id", iterator_type=None,
+                          full_payload=True, limit=100),
+                mock.call(1234, fields="id", iterator_type=None,
+                          full_payload=True, limit=100, offset="page2")])
+        self.assertEqual(self.workspace.save_checkpoint.call_args_list, [
+                mock.call(1234, "export", mock.ANY, None, 2),
+                mock.call(1234, "export", mock.ANY, "page2", 4)])
+        self.assertEqual(self.db_client.commit.call_count, 2)
+        self.assertEqual(self.db_client.write.call_count, 4)
+        self.workspace.clear_checkpoint.assert_called_once_with(1234)
+
+    def test_export_resume(self):
+        self.config.commit_every = 10
+        checkpoint = mock.Mock(command="export", started_at="2017-01-01T00:00:00.000000Z",
+                               page_offset="page2", last_task_id=4)
+        self.workspace.checkpoint.return_value = checkpoint
+        self.asana_client.tasks.find_by_project.side_effect = [
+                self.checkpoint_page([3, 4, 5])]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.export(resume=True)
+
+        self.asana_client.tasks.find_by_project.assert_called_once_with(
+                1234, fields="id", iterator_type=None,
+                full_payload=True, limit=100, offset="page2")
+        self.db_client.write.assert_called_once_with(
+                INSERT_ID_SQL, 5)
+        self.workspace.set_last_sync_time.assert_called_once_with(
+                1234, "2017-01-01T00:00:00.000000Z")
+
+    def test_resume_ignores_other_command_checkpoint(self):
+        self.config.commit_every = 10
+        self.workspace.checkpoint.return_value = mock.Mock(
+                command="synchronize", page_offset="page2", last_task_id=4)
+        self.asana_client.tasks.find_by_project.side_effect = [
+                self.checkpoint_page([1])]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.export(resume=True)
+
+        self.asana_client.tasks.find_by_project.assert_called_once_with(
+                1234, fields="id", iterator_type=None,
+                full_payload=True, limit=100)
+
+    def test_synchronize_resume(self):
+        self.config.commit_every = 10
+        self.workspace.checkpoint.return_value = mock.Mock(
+                command="synchronize", started_at="2017-01-01T00:00:00.000000Z",
+                page_offset="page2", last_task_id=2)
+        self.asana_client.tasks.find_by_project.side_effect = [
+                self.checkpoint_page([1, 2, 3], "ids2"),
+                self.checkpoint_page([2, 3])]
+
+        project = Project(self.asana_client, self.db_client, self.workspace, self.config,
+                          [SimpleField("id", SqlType.INTEGER)])
+        project.synchronize(resume=True)
+
+        self.asana_client.tasks.find_by_project.assert_has_calls([
+                mock.call(1234, fields="id", iterator_type=None,
+                          full_payload=True, limit=100),
+                mock.call(1234, fields="id", iterator_type=None,
+                          full_payload=True, limit=100, offset="page2")])
+        self.db_client.write.assert_any_call(
+                'INSERT INTO "asana2sql_live_task_ids" ("id") VALUES (?),(?),(?);',
+                1, 2, 3)
+        self.db_client.write.assert_any_call(
+                INSERT_ID_SQL, 3)
+        self.assertNotIn(
+                mock.call(INSERT_ID_SQL, 2),
+                self.db_client.write.call_args_list)
 
 
 if __name__ == '__main__':
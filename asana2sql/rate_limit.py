@@ -0,0 +1,227 @@
+"""Client-side rate limiting and retries for Asana API requests.
+
+Asana limits the requests per minute of each access token and answers
+requests over the limit with HTTP 429 and a Retry-After header.  A
+RateLimiter paces requests with a token bucket, caps the number in flight
+with a limit that shrinks on 429s and slow responses and slowly grows back,
+and retries requests that fail with a retryable error.
+"""
+
+import random
+import threading
+import time
+import timeit
+
+import asana.error
+
+from asana2sql import perf
+
+# Asana's documented limit for premium workspaces; free workspaces allow 150.
+DEFAULT_REQUESTS_PER_MINUTE = 1500
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+DEFAULT_MAX_RETRIES = 5
+
+# Responses slower than this shrink the concurrency limit.
+DEFAULT_LATENCY_TARGET_SECONDS = 5.0
+
+# Backoff after server errors is drawn uniformly from zero up to
+# BACKOFF_BASE_SECONDS * 2 ** retry, capped at MAX_BACKOFF_SECONDS.  Waits
+# for Retry-After get up to RETRY_AFTER_JITTER of it added, so that threads
+# told to wait the same time do not all retry at once.
+BACKOFF_BASE_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+RETRY_AFTER_JITTER = 0.1
+
+# Multiplicative decrease of the concurrency limit after a 429, and after a
+# response slower than the latency target.
+THROTTLED_DECREASE = 0.5
+SLOW_DECREASE = 0.9
+
+
+def throttled_sleep(seconds):
+    """Sleeps, measured as the throttled phase of the run."""
+    with perf.phase("throttled"):
+        time.sleep(seconds)
+
+
+class TokenBucket(object):
+    """Allows rate requests per second on average, in bursts of up to burst.
+
+    pause() stops all requests for a time, as after a 429.
+    """
+
+    def __init__(self, rate, burst, clock=timeit.default_timer,
+                 sleep=throttled_sleep):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        self._tokens = self._burst
+        self._updated = clock()
+        self._paused_until = None
+
+    def pause(self, seconds):
+        with self._lock:
+            until = self._clock() + seconds
+            if self._paused_until is None or until > self._paused_until:
+                self._paused_until = until
+
+    def acquire(self):
+        """Takes a token, waiting for one if needed, and returns the seconds
+        spent waiting."""
+        waited = 0.0
+        # Waiting with the lock held queues the other callers behind this one.
+        with self._lock:
+            while True:
+                now = self._clock()
+                self._tokens = min(self._burst, self._tokens +
+                                   (now - self._updated) * self._rate)
+                self._updated = now
+
+                wait = 0.0
+                if self._paused_until is not None:
+                    wait = self._paused_until - now
+                if self._tokens < 1:
+                    wait = max(wait, (1 - self._tokens) / self._rate)
+                if wait <= 0:
+                    self._tokens -= 1
+                    return waited
+
+                self._sleep(wait)
+                waited += wait
+
+
+class ConcurrencyLimit(object):
+    """Limits the requests in flight, adapting the limit to the responses.
+
+    The limit halves after a 429 and shrinks a little after a response slower
+    than latency_target, down to minimum, and otherwise grows by one every
+    limit responses, up to maximum.
+    """
+
+    def __init__(self, maximum, minimum=1, latency_target=None,
+                 clock=timeit.default_timer):
+        self.maximum = maximum
+        self.minimum = minimum
+        self._latency_target = latency_target
+        self._clock = clock
+        self._condition = threading.Condition()
+
+        self._limit = float(maximum)
+        self._in_flight = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        """Waits for a free slot and returns the seconds spent waiting."""
+        waited = 0.0
+        with self._condition:
+            if self._in_flight >= int(self._limit):
+                start = self._clock()
+                while self._in_flight >= int(self._limit):
+                    self._condition.wait()
+                waited = self._clock() - start
+            self._in_flight += 1
+        return waited
+
+    def release(self, latency, throttled=False):
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self._limit *= THROTTLED_DECREASE
+            elif (self._latency_target is not None and
+                    latency > self._latency_target):
+                self._limit *= SLOW_DECREASE
+            else:
+                self._limit += 1.0 / self._limit
+            self._limit = min(max(self._limit, self.minimum), self.maximum)
+            self._condition.notify_all()
+
+
+class RateLimiter(object):
+    """Paces and retries API requests, accounting for the time spent
+    throttled: waiting for the token bucket, for a free concurrency slot, or
+    to retry."""
+
+    def __init__(self, requests_per_second, max_concurrent_requests,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 latency_target=DEFAULT_LATENCY_TARGET_SECONDS,
+                 clock=timeit.default_timer, sleep=throttled_sleep,
+                 random_fn=random.uniform):
+        self._bucket = TokenBucket(
+                requests_per_second, max(1.0, requests_per_second),
+                clock=clock, sleep=sleep)
+        self._concurrency = ConcurrencyLimit(
+                max_concurrent_requests, latency_target=latency_target,
+                clock=clock)
+        self._max_retries = max_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random_fn
+        self._lock = threading.Lock()
+
+        self._throttled_seconds = 0.0
+        self._num_retries = 0
+
+    @property
+    def throttled_seconds(self):
+        return self._throttled_seconds
+
+    @property
+    def num_retries(self):
+        return self._num_retries
+
+    @property
+    def concurrency_limit(self):
+        return self._concurrency.limit
+
+    def backoff_seconds(self, error, retry):
+        """Seconds to wait before the given retry of a request that failed
+        with error."""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            return retry_after + self._random(0, retry_after * RETRY_AFTER_JITTER)
+        return self._random(0, min(MAX_BACKOFF_SECONDS,
+                                   BACKOFF_BASE_SECONDS * 2 ** retry))
+
+    def call(self, request_fn):
+        """Returns the result of request_fn(), retrying it on retryable Asana
+        errors up to max_retries times."""
+        retry = 0
+        while True:
+            waited = self._bucket.acquire() + self._concurrency.acquire()
+            start = self._clock()
+            try:
+                result = request_fn()
+            except asana.error.RetryableAsanaError as e:
+                throttled = isinstance(e, asana.error.RateLimitEnforcedError)
+                self._concurrency.release(self._clock() - start, throttled)
+                if retry >= self._max_retries:
+                    self._add_throttled(waited, 0)
+                    raise
+                backoff = self.backoff_seconds(e, retry)
+                if throttled:
+                    # Hold back every request, not just this one; the wait
+                    # is counted when the retry acquires a token.
+                    self._bucket.pause(backoff)
+                else:
+                    self._sleep(backoff)
+                    waited += backoff
+                self._add_throttled(waited, 1)
+                retry += 1
+                continue
+            except Exception:
+                self._concurrency.release(self._clock() - start)
+                raise
+            self._concurrency.release(self._clock() - start)
+            self._add_throttled(waited, 0)
+            return result
+
+    def _add_throttled(self, seconds, retries):
+        with self._lock:
+            self._throttled_seconds += seconds
+            self._num_retries += retries
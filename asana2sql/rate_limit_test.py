@@ -0,0 +1,137 @@
+import threading
+import unittest
+import mock
+
+import asana.error
+
+from asana2sql import rate_limit
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def rate_limited_error(retry_after):
+    response = mock.Mock(headers={"Retry-After": str(retry_after)})
+    return asana.error.RateLimitEnforcedError(response)
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = rate_limit.TokenBucket(
+                2, 2, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_then_rate(self):
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.acquire(), 0.5)
+        self.clock.now += 10
+        self.assertEqual(self.bucket.acquire(), 0)
+
+    def test_pause(self):
+        self.bucket.pause(3)
+        self.assertEqual(self.bucket.acquire(), 3)
+        self.assertEqual(self.bucket.acquire(), 0)
+
+
+class ConcurrencyLimitTestCase(unittest.TestCase):
+    def test_adapts(self):
+        limit = rate_limit.ConcurrencyLimit(8, latency_target=1.0)
+
+        limit.acquire()
+        limit.release(0.1, throttled=True)
+        self.assertEqual(limit.limit, 4)
+
+        limit.acquire()
+        limit.release(2.0)
+        self.assertEqual(limit.limit, 3)
+
+        for _ in range(10):
+            limit.acquire()
+            limit.release(0.1)
+        self.assertEqual(limit.limit, 5)
+
+        for _ in range(10):
+            limit.acquire()
+            limit.release(0.1, throttled=True)
+        self.assertEqual(limit.limit, 1)
+
+    def test_blocks_at_limit(self):
+        limit = rate_limit.ConcurrencyLimit(1)
+        limit.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limit.acquire()
+            acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.05))
+        limit.release(0.1)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = rate_limit.RateLimiter(
+                100, 4, max_retries=2, clock=self.clock, sleep=self.clock.sleep,
+                random_fn=lambda low, high: high)
+
+    def test_success(self):
+        self.assertEqual(self.limiter.call(lambda: "response"), "response")
+        self.assertEqual(self.limiter.num_retries, 0)
+        self.assertEqual(self.limiter.throttled_seconds, 0)
+
+    def test_honors_retry_after(self):
+        request = mock.Mock(side_effect=[rate_limited_error(10), "response"])
+
+        self.assertEqual(self.limiter.call(request), "response")
+
+        self.assertEqual(self.clock.sleeps, [11.0])
+        self.assertEqual(self.limiter.num_retries, 1)
+        self.assertEqual(self.limiter.throttled_seconds, 11.0)
+        self.assertEqual(self.limiter.concurrency_limit, 2)
+
+    def test_backs_off_on_server_errors(self):
+        request = mock.Mock(side_effect=[asana.error.ServerError(),
+                                         asana.error.ServerError(),
+                                         "response"])
+
+        self.assertEqual(self.limiter.call(request), "response")
+
+        self.assertEqual(self.clock.sleeps, [0.5, 1.0])
+        self.assertEqual(self.limiter.num_retries, 2)
+
+    def test_gives_up(self):
+        request = mock.Mock(side_effect=asana.error.ServerError())
+
+        with self.assertRaises(asana.error.ServerError):
+            self.limiter.call(request)
+
+        self.assertEqual(request.call_count, 3)
+
+    def test_does_not_retry_other_errors(self):
+        request = mock.Mock(side_effect=asana.error.NotFoundError())
+
+        with self.assertRaises(asana.error.NotFoundError):
+            self.limiter.call(request)
+
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(self.limiter.concurrency_limit, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import contextlib
+import sqlite3
+
+from asana2sql.db_wrapper import DatabaseWrapper
+
+# Settings used while bulk loading: write-ahead logging, fsync only at
+# checkpoints, a 256 MiB page cache, and temporary tables in memory.
+BULK_LOAD_PRAGMAS = [
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("cache_size", -256 * 1024),
+        ("temp_store", "MEMORY"),
+        ]
+
+# Seconds to wait for another connection, such as a worker process, to commit
+# before a write fails with "database is locked".
+LOCK_TIMEOUT_SECONDS = 600
+
+
+class SqliteRow(tuple):
+    """A result row that behaves like a pyodbc Row.
+
+    Values can be read by index or as attributes named by their column, and
+    the cursor's description is available as cursor_description.
+    """
+
+    def __new__(cls, cursor_description, column_index, values):
+        row = tuple.__new__(cls, values)
+        row.cursor_description = cursor_description
+        row._column_index = column_index
+        return row
+
+    def __getattr__(self, name):
+        try:
+            return self[self.__dict__["_column_index"][name]]
+        except KeyError:
+            raise AttributeError(name)
+
+
+# The description of the last statement read and its column index, reused by
+# every row the statement returns.
+_last_column_index = (None, None)
+
+
+def _row_factory(cursor, values):
+    global _last_column_index
+    description = cursor.description
+    (last_description, column_index) = _last_column_index
+    if description is not last_description:
+        column_index = {column[0]: i for i, column in enumerate(description)}
+        _last_column_index = (description, column_index)
+    return SqliteRow(description, column_index, values)
+
+
+class SqliteDatabaseWrapper(DatabaseWrapper):
+    """A DatabaseWrapper over the standard library sqlite3 module.
+
+    sqlite3 takes statement parameters as a single sequence rather than as
+    separate arguments, and returns rows that are adapted to look like pyodbc
+    rows so the rest of asana2sql can use them unchanged.
+    """
+
+    def __init__(self, path, **options):
+        db_conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT_SECONDS)
+        db_conn.row_factory = _row_factory
+        super(SqliteDatabaseWrapper, self).__init__(db_conn, **options)
+
+    def _execute_sql(self, sql, *params, **options):
+        cursor = options.get("cursor") or self._get_cursor()
+        self._num_executed += 1
+        cursor.execute(sql, self._params_row(params))
+
+    def _pragma(self, name, value=None):
+        cursor = self._db_conn.cursor()
+        if value is None:
+            cursor.execute("PRAGMA {};".format(name))
+        else:
+            cursor.execute("PRAGMA {} = {};".format(name, value))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    @contextlib.contextmanager
+    def bulk_load(self):
+        """Applies BULK_LOAD_PRAGMAS for the duration of the block.
+
+        Writes in the block form one transaction, committed when it exits, unless
+        the caller commits along the way.  If the block raises, uncommitted
+        writes are rolled back.  The connection's previous settings are
+        restored afterwards.
+        """
+        saved = [(name, self._pragma(name)) for name, _ in BULK_LOAD_PRAGMAS]
+        for name, value in BULK_LOAD_PRAGMAS:
+            self._pragma(name, value)
+        try:
+            yield self
+            self.commit()
+        except Exception:
+            self._db_conn.rollback()
+            raise
+        finally:
+            for name, value in saved:
+                self._pragma(name, value)
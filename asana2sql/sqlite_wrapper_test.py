@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from asana2sql.cache import Cache
+from asana2sql.sqlite_wrapper import SqliteDatabaseWrapper
+
+
+class SqliteDatabaseWrapperTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "test.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_users(self, db_wrapper):
+        db_wrapper.write(
+                'CREATE TABLE "users" (id INTEGER PRIMARY KEY, name TEXT);')
+
+    def test_write_and_read(self):
+        db_wrapper = SqliteDatabaseWrapper(self.path)
+        self.create_users(db_wrapper)
+
+        db_wrapper.write('INSERT INTO "users" VALUES (?, ?);', 1, "one")
+        db_wrapper.write_many('INSERT INTO "users" VALUES (?, ?);',
+                              [(2, "two"), (3, "three")])
+
+        rows = db_wrapper.read(
+                'SELECT id, name FROM "users" WHERE id > ? ORDER BY id;', 1)
+
+        self.assertEqual(rows, [(2, "two"), (3, "three")])
+        self.assertEqual(rows[0].id, 2)
+        self.assertEqual(rows[0].name, "two")
+        self.assertEqual([column[0] for column in rows[0].cursor_description],
+                         ["id", "name"])
+        with self.assertRaises(AttributeError):
+            rows[0].missing
+
+    def test_buffered_writes(self):
+        db_wrapper = SqliteDatabaseWrapper(self.path, buffered=True)
+        self.create_users(db_wrapper)
+
+        db_wrapper.write('INSERT INTO "users" VALUES (?, ?);', 1, "one")
+        db_wrapper.write('INSERT INTO "users" VALUES (?, ?);', [2, "two"])
+        db_wrapper.commit()
+
+        self.assertEqual(db_wrapper.read('SELECT id FROM "users";'), [(1,), (2,)])
+        self.assertEqual(db_wrapper.num_executed, 3)
+
+    def test_rows_seed_cache(self):
+        db_wrapper = SqliteDatabaseWrapper(self.path)
+        self.create_users(db_wrapper)
+        db_wrapper.write('INSERT INTO "users" VALUES (?, ?);', 1, "one")
+
+        cache = Cache(lambda: db_wrapper.read_batches('SELECT * FROM "users";'),
+                      lambda user: None)
+
+        self.assertEqual(cache.get(1), {"id": 1, "name": "one"})
+
+    def test_bulk_load(self):
+        db_wrapper = SqliteDatabaseWrapper(self.path)
+        self.create_users(db_wrapper)
+        db_wrapper.commit()
+
+        with db_wrapper.bulk_load():
+            self.assertEqual(db_wrapper._pragma("journal_mode"), "wal")
+            self.assertEqual(db_wrapper._pragma("synchronous"), 1)
+            db_wrapper.write('INSERT INTO "users" VALUES (?, ?);', 1, "one")
+
+        self.assertEqual(db_wrapper._pragma("journal_mode"), "delete")
+        self.assertEqual(db_wrapper._pragma("synchronous"), 2)
+
+        other = SqliteDatabaseWrapper(self.path)
+        self.assertEqual(other.read('SELECT id FROM "users";'), [(1,)])
+
+    def test_bulk_load_rolls_back_on_error(self):
+        db_wrapper = SqliteDatabaseWrapper(self.path)
+        self.create_users(db_wrapper)
+        db_wrapper.commit()
+
+        with self.assertRaises(ValueError):
+            with db_wrapper.bulk_load():
+                db_wrapper.write('INSERT INTO "users" VALUES (?, ?);', 1, "one")
+                raise ValueError()
+
+        self.assertEqual(db_wrapper._pragma("journal_mode"), "delete")
+        self.assertEqual(db_wrapper.read('SELECT id FROM "users";'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
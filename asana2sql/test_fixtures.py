@@ -43,7 +43,8 @@ def task(id=2,
 def row(**kwargs):
     row = mock.MagicMock()
     column_definitions = []
-    row.__getitem__.side_effect = lambda i: kwargs.values()[i]
+    row.__getitem__.side_effect = lambda i: list(kwargs.values())[i]
+    row.__iter__.side_effect = lambda: iter(list(kwargs.values()))
     for k, v in kwargs.items():
         column_definitions.append((k, None, None, None, None, None, None))
         setattr(row, k, v)
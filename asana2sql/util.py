@@ -1,5 +1,12 @@
 import re
 
+ASANA_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
 
 def sql_safe_name(name):
     return re.sub("\W", "", re.sub("\s", "_", name))
+
+
+def asana_timestamp(dt):
+    """Formats a naive UTC datetime the way the Asana API does."""
+    return dt.strftime(ASANA_TIMESTAMP_FORMAT)
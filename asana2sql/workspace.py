@@ -1,4 +1,13 @@
-from asana2sql.cache import Cache
+import collections
+
+from asana2sql import dialect
+from asana2sql.cache import Cache, ExpiringCache
+from asana2sql.dialect import Upsert
+from asana2sql.metadata_cache import MetadataCache
+
+SELECT_ROWS_WHERE_IN = (
+        """SELECT * FROM "{table_name}" WHERE "{column}" IN ({placeholders});""")
+COUNT_ROWS = """SELECT COUNT(*) FROM "{table_name}";"""
 
 PROJECTS_TABLE_NAME = "projects"
 CREATE_PROJECTS_TABLE = (
@@ -7,8 +16,8 @@ CREATE_PROJECTS_TABLE = (
         name VARCHAR(1024));
         """)
 SELECT_PROJECTS = """SELECT * FROM "{table_name}";"""
-INSERT_PROJECT = (
-        """INSERT OR REPLACE INTO "{table_name}" VALUES (?, ?);""")
+INSERT_PROJECT = Upsert(
+        ("id", "name"), ("id",))
 
 PROJECT_MEMBERSHIPS_TABLE_NAME = "project_memberships"
 CREATE_PROJECT_MEMBERSHIPS_TABLE = (
@@ -19,10 +28,16 @@ CREATE_PROJECT_MEMBERSHIPS_TABLE = (
         """)
 SELECT_PROJECT_MEMBERSHIPS = (
         """SELECT project_id FROM "{table_name}" WHERE task_id = ?;""")
-INSERT_PROJECT_MEMBERSHIP = (
-        """INSERT OR REPLACE INTO "{table_name}" VALUES (?, ?);""")
+SELECT_PROJECT_MEMBERSHIPS_FOR_PROJECT = (
+        """SELECT task_id, project_id FROM "{table_name}" WHERE task_id IN (
+        SELECT task_id FROM "{table_name}" WHERE project_id = ?);""")
+INSERT_PROJECT_MEMBERSHIP = Upsert(
+        ("task_id", "project_id"), ("task_id", "project_id"))
 DELETE_PROJECT_MEMBERSHIP = (
         """DELETE FROM "{table_name}" WHERE task_id = ? and project_id = ?;""")
+DELETE_PROJECT_MEMBERSHIPS_FOR_TASKS = (
+        """DELETE FROM "{table_name}" WHERE project_id = ? AND task_id IN (
+        {task_ids_query});""")
 
 USERS_TABLE_NAME = "users"
 CREATE_USERS_TABLE = (
@@ -31,8 +46,8 @@ CREATE_USERS_TABLE = (
         name VARCHAR(1024));
         """)
 SELECT_USERS = 'SELECT * FROM "{table_name}";';
-INSERT_USER = (
-        """INSERT OR REPLACE INTO "{table_name}" VALUES (?, ?);""")
+INSERT_USER = Upsert(
+        ("id", "name"), ("id",))
 
 FOLLOWERS_TABLE_NAME = "followers"
 CREATE_FOLLOWERS_TABLE = (
@@ -41,11 +56,17 @@ CREATE_FOLLOWERS_TABLE = (
         user_id INTEGER NOT NULL,
         PRIMARY KEY (task_id, user_id));
         """)
-SELECT_FOLLOWERS = 'SELECT * from "{table_name}" WHERE task_id = ?;';
-INSERT_FOLLOWER = (
-        """INSERT OR REPLACE INTO "{table_name}" VALUES (?, ?);""")
+SELECT_FOLLOWERS = 'SELECT user_id from "{table_name}" WHERE task_id = ?;';
+SELECT_FOLLOWERS_FOR_PROJECT = (
+        """SELECT task_id, user_id FROM "{table_name}" WHERE task_id IN (
+        SELECT task_id FROM "{memberships_table_name}" WHERE project_id = ?);""")
+INSERT_FOLLOWER = Upsert(
+        ("task_id", "user_id"), ("task_id", "user_id"))
 DELETE_FOLLOWER = (
         """DELETE FROM "{table_name}" WHERE user_id = ? AND task_id = ?;""")
+DELETE_ORPHANED_FOLLOWERS = (
+        """DELETE FROM "{table_name}" WHERE task_id IN ({task_ids_query})
+        AND task_id NOT IN (SELECT task_id FROM "{memberships_table_name}");""")
 
 CUSTOM_FIELDS_TABLE_NAME = "custom_fields"
 CREATE_CUSTOM_FIELDS_TABLE = (
@@ -54,8 +75,8 @@ CREATE_CUSTOM_FIELDS_TABLE = (
         name VARCHAR(1024),
         type INTEGER NOT NULL);
         """)
-INSERT_CUSTOM_FIELD = (
-        """INSERT OR REPLACE INTO "{table_name}" VALUES (?, ?, ?);""")
+INSERT_CUSTOM_FIELD = Upsert(
+        ("id", "name", "type"), ("id",))
 
 CUSTOM_FIELD_ENUM_VALUES_TABLE_NAME = "custom_field_enum_values"
 CREATE_CUSTOM_FIELD_ENUM_VALUES_TABLE = (
@@ -70,11 +91,26 @@ CREATE_CUSTOM_FIELD_ENUM_VALUES_TABLE = (
 SELECT_CUSTOM_FIELD_ENUM_VALUES = """SELECT * FROM {table_name};"""
 SELECT_CUSTOM_FIELD_ENUM_VALUES_FOR_CUSTOM_FIELD = (
         """SELECT * FROM {table_name} WHERE custom_field_id = ?;""")
-INSERT_CUSTOM_FIELD_ENUM_VALUE = (
-        """INSERT OR REPLACE INTO "{table_name}" VALUES (?, ?, ?, ?, ?);""")
+INSERT_CUSTOM_FIELD_ENUM_VALUE = Upsert(
+        ("custom_field_id", "id", "name", "enabled", "color"),
+        ("custom_field_id", "id"))
 DELETE_CUSTOM_FIELD_ENUM_VALUE = (
         """DELETE FROM "{table_name}" WHERE id = ?;""")
 
+# Custom field definitions rarely change, so within a run they are only
+# fetched again after this long.
+DEFAULT_CUSTOM_FIELD_TTL_SECONDS = 3600
+
+CUSTOM_FIELD_PATH = "/custom_fields/{custom_field_id}"
+CUSTOM_FIELD_SETTINGS_PATH = "/projects/{project_id}/custom_field_settings"
+CUSTOM_FIELD_SETTINGS_FIELDS = [
+        "custom_field.name",
+        "custom_field.type",
+        "custom_field.enum_options.name",
+        "custom_field.enum_options.enabled",
+        "custom_field.enum_options.color",
+        ]
+
 CUSTOM_FIELD_VALUES_TABLE_NAME = "custom_field_values"
 CREATE_CUSTOM_FIELD_VALUES_TABLE = (
         """CREATE TABLE IF NOT EXISTS "{table_name}" (
@@ -87,10 +123,60 @@ CREATE_CUSTOM_FIELD_VALUES_TABLE = (
         """)
 SELECT_CUSTOM_FIELD_VALUES_FOR_TASK = (
         "SELECT * FROM {table_name} WHERE task_id = ?;")
-INSERT_CUSTOM_FIELD_VALUE = (
-        "INSERT OR REPLACE INTO {table_name} VALUES (?, ?, ?, ?, ?);")
+SELECT_CUSTOM_FIELD_VALUES_FOR_PROJECT = (
+        """SELECT * FROM {table_name} WHERE task_id IN (
+        SELECT task_id FROM "{memberships_table_name}" WHERE project_id = ?);""")
+INSERT_CUSTOM_FIELD_VALUE = Upsert(
+        ("task_id", "custom_field_id", "text_value", "number_value",
+         "enum_value"),
+        ("task_id", "custom_field_id"))
 DELETE_CUSTOM_FIELD_VALUE = (
         "DELETE FROM {table_name} WHERE task_id = ? AND custom_field_id = ?;")
+DELETE_ORPHANED_CUSTOM_FIELD_VALUES = (
+        """DELETE FROM {table_name} WHERE task_id IN ({task_ids_query})
+        AND task_id NOT IN (SELECT task_id FROM "{memberships_table_name}");""")
+
+SYNC_STATE_TABLE_NAME = "sync_state"
+CREATE_SYNC_STATE_TABLE = (
+        """CREATE TABLE IF NOT EXISTS "{table_name}" (
+        project_id INTEGER NOT NULL PRIMARY KEY,
+        last_sync_at VARCHAR(64) NOT NULL);
+        """)
+SELECT_SYNC_STATE = (
+        """SELECT last_sync_at FROM "{table_name}" WHERE project_id = ?;""")
+INSERT_SYNC_STATE = Upsert(
+        ("project_id", "last_sync_at"), ("project_id",))
+
+CHECKPOINTS_TABLE_NAME = "checkpoints"
+CREATE_CHECKPOINTS_TABLE = (
+        """CREATE TABLE IF NOT EXISTS "{table_name}" (
+        project_id INTEGER NOT NULL PRIMARY KEY,
+        command VARCHAR(64) NOT NULL,
+        started_at VARCHAR(64) NOT NULL,
+        page_offset VARCHAR(1024),
+        last_task_id INTEGER NOT NULL);
+        """)
+SELECT_CHECKPOINT = (
+        """SELECT * FROM "{table_name}" WHERE project_id = ?;""")
+INSERT_CHECKPOINT = Upsert(
+        ("project_id", "command", "started_at", "page_offset",
+         "last_task_id"),
+        ("project_id",))
+DELETE_CHECKPOINT = (
+        """DELETE FROM "{table_name}" WHERE project_id = ?;""")
+
+# Temporary table holding the keys of the rows of one table touched in a run,
+# while its unreferenced rows are collected.
+TOUCHED_IDS_TABLE_NAME = "asana2sql_touched_ids"
+TOUCHED_IDS_COLUMNS = "id INTEGER NOT NULL PRIMARY KEY"
+CLEAR_TOUCHED_IDS = """DELETE FROM "{table_name}";"""
+DROP_TOUCHED_IDS_TABLE = """DROP TABLE "{table_name}";"""
+DELETE_UNREFERENCED_ROWS = (
+        """DELETE FROM "{table_name}" WHERE id NOT IN (
+        SELECT id FROM "{touched_table_name}"){references};""")
+NOT_REFERENCED_BY = (
+        """ AND "{local_column}" NOT IN (
+        SELECT "{column}" FROM "{table_name}" WHERE "{column}" IS NOT NULL)""")
 
 class Workspace(object):
     """Abstraction around all the supporting values for a project that are
@@ -103,23 +189,59 @@ class Workspace(object):
         self._asana_client = asana_client
         self._db_client = db_client
         self._config = config
+        self._dialect = dialect.from_config(config)
+        self._upsert_sql_cache = {}
         self._cache = {}
         self._custom_fields_written = set()
+        # Custom field definitions by id, and the projects whose custom field
+        # settings they can be loaded from in bulk.
+        self._custom_field_definitions = ExpiringCache(config.custom_field_ttl)
+        self._custom_field_projects = []
+        self._custom_field_settings_loaded = ExpiringCache(
+                config.custom_field_ttl)
+        # Project data and custom field definitions kept between runs, and
+        # the modified_at of projects as listed by Asana to validate them.
+        self._metadata_cache = None
+        if config.metadata_cache:
+            self._metadata_cache = MetadataCache(
+                    config.metadata_cache, config.metadata_cache_ttl)
+        self._project_modified_at = {}
+        self._sync_state_table_created = False
+        self._checkpoints_table_created = False
+        # Task id -> id of the project that synced the task's join tables.
+        self._task_sync_projects = {}
+
+        # Join-table rows loaded by prefetch_project, keyed by task id.  A task
+        # present in an index has all of its rows for that table loaded.
+        self._prefetched_memberships = {}
+        self._prefetched_followers = {}
+        self._prefetched_custom_field_values = {}
 
         self.projects = Cache(
                 self._fetch_all_fn(SELECT_PROJECTS, self.projects_table_name()),
-                self._insert_fn(INSERT_PROJECT, self.projects_table_name(),
-                    ["id", "name"]))
+                self._insert_fn(INSERT_PROJECT, self.projects_table_name()),
+                column_names=INSERT_PROJECT.columns,
+                **self._cache_options(INSERT_PROJECT,
+                    self.projects_table_name()))
         self.users = Cache(
                 self._fetch_all_fn(SELECT_USERS, self.users_table_name()),
-                self._insert_fn(INSERT_USER, self.users_table_name(),
-                    ["id", "name"]))
+                self._insert_fn(INSERT_USER, self.users_table_name()),
+                column_names=INSERT_USER.columns,
+                **self._cache_options(INSERT_USER, self.users_table_name()))
         self.custom_field_enum_values = Cache(
                 self._fetch_all_fn(SELECT_CUSTOM_FIELD_ENUM_VALUES,
                     self.custom_field_enum_values_table_name()),
                 self._insert_fn(INSERT_CUSTOM_FIELD_ENUM_VALUE,
-                    self.custom_field_enum_values_table_name(),
-                    ["custom_field_id", "id", "name", "enabled", "color"]))
+                    self.custom_field_enum_values_table_name()),
+                index_names=["custom_field_id"],
+                delete_fn=self._delete_fn(DELETE_CUSTOM_FIELD_ENUM_VALUE,
+                    self.custom_field_enum_values_table_name()),
+                column_names=INSERT_CUSTOM_FIELD_ENUM_VALUE.columns,
+                **self._cache_options(INSERT_CUSTOM_FIELD_ENUM_VALUE,
+                    self.custom_field_enum_values_table_name()))
+
+        if config.write_back_cache:
+            db_client.add_commit_hook(self.flush)
 
     def projects_table_name(self):
         return self._config.projects_table_name or PROJECTS_TABLE_NAME
@@ -142,6 +264,12 @@ class Workspace(object):
     def custom_field_values_table_name(self):
         return self._config.custom_field_values_table_name or CUSTOM_FIELD_VALUES_TABLE_NAME
 
+    def sync_state_table_name(self):
+        return self._config.sync_state_table_name or SYNC_STATE_TABLE_NAME
+
+    def checkpoints_table_name(self):
+        return self._config.checkpoints_table_name or CHECKPOINTS_TABLE_NAME
+
     def create_tables(self):
         self._db_client.write(
                 CREATE_PROJECTS_TABLE.format(
@@ -164,42 +292,285 @@ class Workspace(object):
         self._db_client.write(
                 CREATE_CUSTOM_FIELD_VALUES_TABLE.format(
                     table_name=self.custom_field_values_table_name()))
+        self._db_client.write(
+                CREATE_SYNC_STATE_TABLE.format(
+                    table_name=self.sync_state_table_name()))
+        self._db_client.write(
+                CREATE_CHECKPOINTS_TABLE.format(
+                    table_name=self.checkpoints_table_name()))
 
     def _fetch_all_fn(self, SQL, table_name):
-        return lambda: self._db_client.read(SQL.format(table_name=table_name))
-
-    def _insert_fn(self, SQL, table_name, column_keys):
+        return lambda: self._db_client.read_batches(
+                SQL.format(table_name=table_name))
+
+    def _cache_options(self, upsert, table_name):
+        """Cache options for the write_back_cache option and bounding it to the
+        cache_max_rows option, if set."""
+        options = {}
+        if self._config.write_back_cache:
+            options.update(
+                    insert_many_fn=self._insert_many_fn(upsert, table_name),
+                    write_back=True)
+        if self._config.cache_max_rows:
+            options.update(
+                    lookup_fn=self._lookup_fn(table_name),
+                    count_fn=self._count_fn(table_name),
+                    max_rows=self._config.cache_max_rows)
+        return options
+
+    def _lookup_fn(self, table_name):
+        def lookup(column, values):
+            for batch in self._dialect.batches([(value,) for value in values], 1):
+                sql = SELECT_ROWS_WHERE_IN.format(
+                        table_name=table_name,
+                        column=column,
+                        placeholders=",".join("?" * len(batch)))
+                for rows in self._db_client.read_batches(
+                        sql, *[value for (value,) in batch]):
+                    yield rows
+        return lookup
+
+    def _count_fn(self, table_name):
+        return lambda: self._db_client.read(
+                COUNT_ROWS.format(table_name=table_name))[0][0]
+
+    def _insert_fn(self, upsert, table_name):
         return lambda obj: self._db_client.write(
-                SQL.format(table_name=table_name),
-                *[obj[key] for key in column_keys])
+                self._upsert_sql(upsert, table_name),
+                *[obj[column] for column in upsert.columns])
+
+    def _insert_many_fn(self, upsert, table_name):
+        def insert_many(objs):
+            rows = [[obj[column] for column in upsert.columns] for obj in objs]
+            for batch in self._dialect.batches(rows, len(upsert.columns)):
+                self._db_client.write(
+                        self._upsert_sql(upsert, table_name, len(batch)),
+                        *[value for row in batch for value in row])
+        return insert_many
+
+    def _delete_fn(self, SQL, table_name):
+        return lambda key: self._db_client.write(
+                SQL.format(table_name=table_name), key)
+
+    def _upsert_sql(self, upsert, table_name, num_rows=1):
+        key = (upsert, table_name, num_rows)
+        if key not in self._upsert_sql_cache:
+            self._upsert_sql_cache[key] = self._dialect.upsert(
+                    table_name, upsert.columns, upsert.key_columns, num_rows)
+        return self._upsert_sql_cache[key]
+
+    def flush(self):
+        """Writes the users, projects and enum options held back by the
+        write_back_cache option.  Called before every commit."""
+        self.projects.flush()
+        self.users.flush()
+        self.custom_field_enum_values.flush()
 
     def add_user(self, user):
         self.users.add(user)
 
+    def add_users(self, users):
+        self.users.add_many(users)
+
     def add_project(self, project):
         self.projects.add(project)
 
+    def add_projects(self, projects):
+        self.projects.add_many(projects)
+
+    # Garbage collection
+    def collect_garbage(self, user_references=()):
+        """Deletes the users, projects, custom fields and enum options that
+        were not touched in this run and that no task refers to, with one
+        statement per table.
+
+        Tasks refer to them through the join tables, and to users through the
+        (table name, column) pairs of user_references, such as the assignee
+        columns of task tables.  Enum options are kept while their custom
+        field is.  Returns the number of rows deleted by table name.
+        """
+        self.flush()
+        # Each reference is a column of the table and the column of another
+        # table whose values keep the rows they match.
+        tables = [
+                (self.users_table_name(), self.users.touched_keys,
+                 [("id", self.followers_table_name(), "user_id")] +
+                 [("id", table_name, column)
+                  for table_name, column in user_references]),
+                (self.projects_table_name(), self.projects.touched_keys,
+                 [("id", self.project_memberships_table_name(), "project_id")]),
+                (self.custom_fields_table_name(), self._custom_fields_written,
+                 [("id", self.custom_field_values_table_name(),
+                   "custom_field_id")]),
+                (self.custom_field_enum_values_table_name(),
+                 self.custom_field_enum_values.touched_keys,
+                 [("id", self.custom_field_values_table_name(), "enum_value"),
+                  ("custom_field_id", self.custom_fields_table_name(), "id")]),
+                ]
+
+        touched_table_name = self._dialect.temp_table_name(
+                TOUCHED_IDS_TABLE_NAME)
+        self._db_client.write(self._dialect.create_temp_table(
+            TOUCHED_IDS_TABLE_NAME, TOUCHED_IDS_COLUMNS))
+        num_deleted = collections.OrderedDict()
+        for table_name, touched_keys, references in tables:
+            self._db_client.write(CLEAR_TOUCHED_IDS.format(
+                table_name=touched_table_name))
+            for batch in self._dialect.batches(
+                    [(key,) for key in touched_keys], 1):
+                self._db_client.write(
+                        self._dialect.insert(
+                            touched_table_name, ["id"], len(batch)),
+                        *[key for (key,) in batch])
+            num_deleted[table_name] = self._db_client.write_counted(
+                    DELETE_UNREFERENCED_ROWS.format(
+                        table_name=table_name,
+                        touched_table_name=touched_table_name,
+                        references="".join(
+                            NOT_REFERENCED_BY.format(
+                                local_column=local_column,
+                                table_name=reference_table,
+                                column=column)
+                            for local_column, reference_table, column
+                            in references)))
+        self._db_client.write(DROP_TOUCHED_IDS_TABLE.format(
+            table_name=touched_table_name))
+
+        self.projects.reset()
+        self.users.reset()
+        self.custom_field_enum_values.reset()
+        return num_deleted
+
+    # Metadata
+    def set_project_modified_at(self, modified_at_by_project_id):
+        """Records the modified_at of projects as listed by Asana, so that
+        metadata cached for a project modified since is fetched again."""
+        self._project_modified_at.update(modified_at_by_project_id)
+
+    def get_project(self, project_id):
+        """Returns the project's data, from the metadata cache if it has a
+        fresh copy."""
+        modified_at = self._project_modified_at.get(project_id)
+        project = self._cached_metadata("project", project_id, modified_at)
+        if project is None:
+            project = self._asana_client.projects.find_by_id(project_id)
+            self._store_metadata("project", project_id, project, modified_at)
+        return project
+
+    def _cached_metadata(self, kind, id, modified_at=None):
+        if self._metadata_cache is None:
+            return None
+        return self._metadata_cache.get(kind, id, modified_at)
+
+    def _store_metadata(self, kind, id, data, modified_at=None):
+        if self._metadata_cache is not None:
+            self._metadata_cache.put(kind, id, data, modified_at)
+
+    # Prefetching
+    def prefetch_project(self, project_id):
+        """Loads the project memberships, followers and custom field values of
+        every task currently in the project with one query per table.
+
+        Until clear_prefetch is called, lookups for those tasks are served from
+        memory instead of issuing a query per task.  Writing to a task's rows
+        drops that task from the affected index.
+        """
+        memberships_table_name = self.project_memberships_table_name()
+
+        memberships = collections.defaultdict(list)
+        for row in self._db_client.read(
+                SELECT_PROJECT_MEMBERSHIPS_FOR_PROJECT.format(
+                    table_name=memberships_table_name),
+                project_id):
+            memberships[row[0]].append(row[1])
+
+        followers = {task_id: set() for task_id in memberships}
+        for row in self._db_client.read(
+                SELECT_FOLLOWERS_FOR_PROJECT.format(
+                    table_name=self.followers_table_name(),
+                    memberships_table_name=memberships_table_name),
+                project_id):
+            followers[row[0]].add(row[1])
+
+        custom_field_values = {task_id: [] for task_id in memberships}
+        for row in self._db_client.read(
+                SELECT_CUSTOM_FIELD_VALUES_FOR_PROJECT.format(
+                    table_name=self.custom_field_values_table_name(),
+                    memberships_table_name=memberships_table_name),
+                project_id):
+            custom_field_values[row.task_id].append(row)
+
+        self._prefetched_memberships = dict(memberships)
+        self._prefetched_followers = followers
+        self._prefetched_custom_field_values = custom_field_values
+
+    def clear_prefetch(self):
+        self._prefetched_memberships = {}
+        self._prefetched_followers = {}
+        self._prefetched_custom_field_values = {}
+
+    def first_sync_of_task(self, task_id, project_id):
+        """Records that the task's join-table rows are being synced as part of
+        the project.
+
+        Returns False if they were already synced by another project sharing
+        this Workspace, in which case they need not be diffed again.
+        """
+        return self._task_sync_projects.setdefault(
+                task_id, project_id) == project_id
+
+    # Removed tasks
+    def remove_tasks_from_project(self, project_id, task_ids_query):
+        """Deletes the join-table rows of tasks removed from a project.
+
+        task_ids_query is a parameterless SELECT of the removed task ids.  Their
+        memberships in the project are deleted, then the followers and custom
+        field values of those that are no longer in any other project.
+        """
+        memberships_table_name = self.project_memberships_table_name()
+        self._db_client.write(
+                DELETE_PROJECT_MEMBERSHIPS_FOR_TASKS.format(
+                    table_name=memberships_table_name,
+                    task_ids_query=task_ids_query),
+                project_id)
+        self._db_client.write(
+                DELETE_ORPHANED_FOLLOWERS.format(
+                    table_name=self.followers_table_name(),
+                    memberships_table_name=memberships_table_name,
+                    task_ids_query=task_ids_query))
+        self._db_client.write(
+                DELETE_ORPHANED_CUSTOM_FIELD_VALUES.format(
+                    table_name=self.custom_field_values_table_name(),
+                    memberships_table_name=memberships_table_name,
+                    task_ids_query=task_ids_query))
+
     # Followers
     def get_followers(self, task_id):
+        if task_id in self._prefetched_followers:
+            return set(self._prefetched_followers[task_id])
         return {row[0] for row in self._db_client.read(
                 SELECT_FOLLOWERS.format(table_name=self.followers_table_name()), task_id)}
 
 
     def add_follower(self, task_id, user):
         self.add_user(user)
+        self._prefetched_followers.pop(task_id, None)
         self._db_client.write(
-                INSERT_FOLLOWER.format(
-                    table_name=self.followers_table_name()),
+                self._upsert_sql(
+                    INSERT_FOLLOWER, self.followers_table_name()),
                 (task_id, user["id"]))
 
     def remove_follower(self, task_id, user_id):
+        self._prefetched_followers.pop(task_id, None)
         self._db_client.write(
                 DELETE_FOLLOWER.format(
                     table_name=self.followers_table_name()),
-                (task_id, user_id))
+                (user_id, task_id))
 
     # Task Membership
     def task_memberships(self, task_id):
+        if task_id in self._prefetched_memberships:
+            return list(self._prefetched_memberships[task_id])
         return [row[0] for row in self._db_client.read(
                 SELECT_PROJECT_MEMBERSHIPS.format(
                     table_name=self.project_memberships_table_name()),
@@ -207,12 +578,15 @@ class Workspace(object):
 
     def add_task_to_project(self, task_id, project):
         self.add_project(project)
+        self._prefetched_memberships.pop(task_id, None)
         self._db_client.write(
-                INSERT_PROJECT_MEMBERSHIP.format(
-                    table_name=self.project_memberships_table_name()),
+                self._upsert_sql(
+                    INSERT_PROJECT_MEMBERSHIP,
+                    self.project_memberships_table_name()),
                 (task_id, project["id"]))
 
     def remove_task_from_project(self, task_id, project_id):
+        self._prefetched_memberships.pop(task_id, None)
         self._db_client.write(
                 DELETE_PROJECT_MEMBERSHIP.format(
                     table_name=self.project_memberships_table_name()),
@@ -230,8 +604,8 @@ class Workspace(object):
             return
 
         self._db_client.write(
-                INSERT_CUSTOM_FIELD.format(
-                    table_name=self.custom_fields_table_name()),
+                self._upsert_sql(
+                    INSERT_CUSTOM_FIELD, self.custom_fields_table_name()),
                 custom_field_value["id"],
                 custom_field_value["name"],
                 custom_field_value["type"]);
@@ -241,45 +615,88 @@ class Workspace(object):
 
         self._custom_fields_written.add(custom_field_value["id"])
 
+    def prefetch_custom_fields(self, project_id):
+        """Lets custom field definitions be loaded from the project's custom
+        field settings, one paginated request for all of its fields, the first
+        time a definition is needed."""
+        if project_id not in self._custom_field_projects:
+            self._custom_field_projects.append(project_id)
+
     def get_custom_field(self, custom_field_id):
-        # NB: The python client doesn't support custom fields yet, so we have
-        # to fetch manually.
-        return self._asana_client.get("/custom_fields/{}".format(custom_field_id), "")
+        """Returns the definition of a custom field, including its enum
+        options.
+
+        Definitions are kept for the custom_field_ttl option's number of
+        seconds.  A definition not in the settings of any prefetched project is
+        fetched on its own.  Both are looked up in the metadata cache before
+        Asana.
+        """
+        definition = self._custom_field_definitions.get(custom_field_id)
+        if definition is None:
+            self._load_custom_field_settings()
+            definition = self._custom_field_definitions.get(custom_field_id)
+        if definition is None:
+            definition = self._cached_metadata("custom_field", custom_field_id)
+            if definition is None:
+                # NB: The python client doesn't support custom fields yet, so
+                # we have to fetch manually.
+                definition = self._asana_client.get(
+                        CUSTOM_FIELD_PATH.format(
+                            custom_field_id=custom_field_id),
+                        "")
+                self._store_metadata(
+                        "custom_field", custom_field_id, definition)
+            self._custom_field_definitions.put(custom_field_id, definition)
+        return definition
+
+    def _load_custom_field_settings(self):
+        for project_id in self._custom_field_projects:
+            if self._custom_field_settings_loaded.get(project_id):
+                continue
+            # Settings change with the project, so they are validated against
+            # its modified_at.
+            modified_at = self._project_modified_at.get(project_id)
+            settings = self._cached_metadata(
+                    "custom_field_settings", project_id, modified_at)
+            if settings is None:
+                settings = list(self._asana_client.get_collection(
+                        CUSTOM_FIELD_SETTINGS_PATH.format(project_id=project_id),
+                        {}, fields=CUSTOM_FIELD_SETTINGS_FIELDS))
+                self._store_metadata("custom_field_settings", project_id,
+                                     settings, modified_at)
+            for setting in settings:
+                custom_field = setting["custom_field"]
+                self._custom_field_definitions.put(
+                        custom_field["id"], custom_field)
+            self._custom_field_settings_loaded.put(project_id, True)
 
     # Custom field enum values
     def add_custom_field_enum_values(self, custom_field_id):
+        """Writes the enum options of a custom field that changed since they
+        were stored and deletes those it no longer has."""
         custom_field_def = self.get_custom_field(custom_field_id)
-        new_enum_options = custom_field_def.get("enum_options", [])
-
-        old_enum_options = {row.id: row
-                for row in self.custom_field_enum_values.get(custom_field_id) or []}
-
-        for enum_option in new_enum_options:
-            if enum_option["id"] in old_enum_options:
-                old_option = old_enum_options[enum_option["id"]]
-                del(old_enum_options[enum_option["id"]])
-                if (old_option.name == enum_option["name"] and
-                    old_option.enabled == enum_option["enabled"] and
-                    old_option.color == enum_option["color"]):
-                        continue;
-
-            self._db_client.write(
-                    INSERT_CUSTOM_FIELD_ENUM_VALUE.format(
-                        table_name=self.custom_field_enum_values_table_name()),
-                    custom_field_id,
-                    enum_option["id"],
-                    enum_option["name"],
-                    enum_option["enabled"],
-                    enum_option["color"])
-
-        for id in old_enum_options.keys():
-            self._db_client.write(
-                    DELETE_CUSTOM_FIELD_ENUM_VALUE.format(
-                        table_name=self.custom_field_enum_values_table_name()),
-                    id)
+
+        old_option_ids = {option["id"] for option in
+                self.custom_field_enum_values.get_by(
+                    "custom_field_id", custom_field_id)}
+
+        for enum_option in custom_field_def.get("enum_options", []):
+            old_option_ids.discard(enum_option["id"])
+            self.custom_field_enum_values.add({
+                    "custom_field_id": custom_field_id,
+                    "id": enum_option["id"],
+                    "name": enum_option["name"],
+                    "enabled": enum_option["enabled"],
+                    "color": enum_option["color"],
+                    })
+
+        for id in old_option_ids:
+            self.custom_field_enum_values.remove(id)
 
     # Custom field values
     def task_custom_field_values(self, task_id):
+        if task_id in self._prefetched_custom_field_values:
+            return list(self._prefetched_custom_field_values[task_id])
         return self._db_client.read(
                     SELECT_CUSTOM_FIELD_VALUES_FOR_TASK.format(
                         table_name=self.custom_field_values_table_name()),
@@ -287,9 +704,11 @@ class Workspace(object):
 
     def add_custom_field_value(self, task_id, custom_field):
         self.add_custom_field(custom_field)
+        self._prefetched_custom_field_values.pop(task_id, None)
         self._db_client.write(
-                INSERT_CUSTOM_FIELD_VALUE.format(
-                    table_name=self.custom_field_values_table_name()),
+                self._upsert_sql(
+                    INSERT_CUSTOM_FIELD_VALUE,
+                    self.custom_field_values_table_name()),
                 task_id,
                 custom_field["id"],
                 custom_field.get("text_value"),
@@ -299,9 +718,79 @@ class Workspace(object):
 
 
     def remove_custom_field_value(self, task_id, custom_field_id):
+        self._prefetched_custom_field_values.pop(task_id, None)
         self._db_client.write(
                 DELETE_CUSTOM_FIELD_VALUE.format(
                     table_name=self.custom_field_values_table_name()),
                 task_id,
                 custom_field_id)
 
+
+    # Sync state
+    def _ensure_sync_state_table(self):
+        """Creates the sync state table if missing, as in databases created
+        before it was added, once per Workspace."""
+        if self._sync_state_table_created:
+            return
+        self._db_client.write(
+                CREATE_SYNC_STATE_TABLE.format(
+                    table_name=self.sync_state_table_name()))
+        self._sync_state_table_created = True
+
+    def last_sync_time(self, project_id):
+        """Returns the high-water mark of the last successful sync of the
+        project, or None if it has never been synced."""
+        self._ensure_sync_state_table()
+        rows = self._db_client.read(
+                SELECT_SYNC_STATE.format(
+                    table_name=self.sync_state_table_name()),
+                project_id)
+        return rows[0][0] if rows else None
+
+    def set_last_sync_time(self, project_id, timestamp):
+        self._ensure_sync_state_table()
+        self._db_client.write(
+                self._upsert_sql(
+                    INSERT_SYNC_STATE, self.sync_state_table_name()),
+                project_id,
+                timestamp)
+
+    # Checkpoints
+    def _ensure_checkpoints_table(self):
+        """Creates the checkpoints table if missing, as in databases created
+        before it was added, once per Workspace."""
+        if self._checkpoints_table_created:
+            return
+        self._db_client.write(
+                CREATE_CHECKPOINTS_TABLE.format(
+                    table_name=self.checkpoints_table_name()))
+        self._checkpoints_table_created = True
+
+    def checkpoint(self, project_id):
+        """Returns the checkpoint row of an interrupted run over the project, or
+        None."""
+        self._ensure_checkpoints_table()
+        rows = self._db_client.read(
+                SELECT_CHECKPOINT.format(
+                    table_name=self.checkpoints_table_name()),
+                project_id)
+        return rows[0] if rows else None
+
+    def save_checkpoint(self, project_id, command, started_at, page_offset,
+                        last_task_id):
+        self._ensure_checkpoints_table()
+        self._db_client.write(
+                self._upsert_sql(
+                    INSERT_CHECKPOINT, self.checkpoints_table_name()),
+                project_id,
+                command,
+                started_at,
+                page_offset,
+                last_task_id)
+
+    def clear_checkpoint(self, project_id):
+        self._ensure_checkpoints_table()
+        self._db_client.write(
+                DELETE_CHECKPOINT.format(
+                    table_name=self.checkpoints_table_name()),
+                project_id)
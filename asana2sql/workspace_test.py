@@ -1,17 +1,42 @@
+import os
+import shutil
+import tempfile
 import unittest
 import mock
 
 from asana2sql.workspace import Workspace
 from asana2sql import workspace
 from asana2sql import db_wrapper
+from asana2sql.sqlite_wrapper import SqliteDatabaseWrapper
 from asana2sql import test_fixtures as fixtures
 
+INSERT_USER_SQL = (
+        'INSERT INTO "users" ("id","name") VALUES (?,?) '
+        'ON CONFLICT ("id") DO UPDATE SET "name"=excluded."name";')
+INSERT_PROJECT_SQL = (
+        'INSERT INTO "projects" ("id","name") VALUES (?,?) '
+        'ON CONFLICT ("id") DO UPDATE SET "name"=excluded."name";')
+INSERT_FOLLOWER_SQL = (
+        'INSERT INTO "followers" ("task_id","user_id") VALUES (?,?) '
+        'ON CONFLICT ("task_id","user_id") DO NOTHING;')
+INSERT_SYNC_STATE_SQL = (
+        'INSERT INTO "sync_state" ("project_id","last_sync_at") VALUES (?,?) '
+        'ON CONFLICT ("project_id") DO UPDATE SET '
+        '"last_sync_at"=excluded."last_sync_at";')
+INSERT_CHECKPOINT_SQL = (
+        'INSERT INTO "checkpoints" ("project_id","command","started_at",'
+        '"page_offset","last_task_id") VALUES (?,?,?,?,?) '
+        'ON CONFLICT ("project_id") DO UPDATE SET '
+        '"command"=excluded."command","started_at"=excluded."started_at",'
+        '"page_offset"=excluded."page_offset",'
+        '"last_task_id"=excluded."last_task_id";')
 
 class WorkspaceTestCase(unittest.TestCase):
     def setUp(self):
         self.client = mock.Mock()
         self.db_client = mock.Mock(spec=db_wrapper.DatabaseWrapper)
         self.config = mock.Mock()
+        self.config.dialect = "sqlite"
 
         self.config.projects_table_name = None
         self.config.project_memberships_table_name = None
@@ -20,6 +45,12 @@ class WorkspaceTestCase(unittest.TestCase):
         self.config.custom_fields_table_name = None
         self.config.custom_field_enum_values_table_name = None
         self.config.custom_field_values_table_name = None
+        self.config.sync_state_table_name = None
+        self.config.checkpoints_table_name = None
+        self.config.custom_field_ttl = None
+        self.config.cache_max_rows = None
+        self.config.write_back_cache = False
+        self.config.metadata_cache = None
 
     def test_default_table_names(self):
         ws = Workspace(self.client, self.db_client, self.config)
@@ -37,6 +68,10 @@ class WorkspaceTestCase(unittest.TestCase):
                 workspace.CUSTOM_FIELD_ENUM_VALUES_TABLE_NAME)
         self.assertEqual(ws.custom_field_values_table_name(),
                 workspace.CUSTOM_FIELD_VALUES_TABLE_NAME)
+        self.assertEqual(ws.sync_state_table_name(),
+                workspace.SYNC_STATE_TABLE_NAME)
+        self.assertEqual(ws.checkpoints_table_name(),
+                workspace.CHECKPOINTS_TABLE_NAME)
 
     def test_custom_table_name(self):
         self.config.projects_table_name = "custom projects"
@@ -46,6 +81,8 @@ class WorkspaceTestCase(unittest.TestCase):
         self.config.custom_fields_table_name = "custom custom_fields"
         self.config.custom_field_enum_values_table_name = "custom custom_field_enum_values"
         self.config.custom_field_values_table_name = "custom custom_field_values"
+        self.config.sync_state_table_name = "custom sync_state"
+        self.config.checkpoints_table_name = "custom checkpoints"
         ws = Workspace(self.client, self.db_client, self.config)
 
         self.assertEqual(ws.projects_table_name(), "custom projects")
@@ -55,6 +92,8 @@ class WorkspaceTestCase(unittest.TestCase):
         self.assertEqual(ws.custom_fields_table_name(), "custom custom_fields")
         self.assertEqual(ws.custom_field_enum_values_table_name(), "custom custom_field_enum_values")
         self.assertEqual(ws.custom_field_values_table_name(), "custom custom_field_values")
+        self.assertEqual(ws.sync_state_table_name(), "custom sync_state")
+        self.assertEqual(ws.checkpoints_table_name(), "custom checkpoints")
 
     def test_create_tables(self):
         ws = Workspace(self.client, self.db_client, self.config)
@@ -83,22 +122,27 @@ class WorkspaceTestCase(unittest.TestCase):
             mock.call.write(
                 workspace.CREATE_CUSTOM_FIELD_VALUES_TABLE.format(
                     table_name=workspace.CUSTOM_FIELD_VALUES_TABLE_NAME)),
+            mock.call.write(
+                workspace.CREATE_SYNC_STATE_TABLE.format(
+                    table_name=workspace.SYNC_STATE_TABLE_NAME)),
+            mock.call.write(
+                workspace.CREATE_CHECKPOINTS_TABLE.format(
+                    table_name=workspace.CHECKPOINTS_TABLE_NAME)),
         ], any_order=True)
 
     def test_add_new_user(self):
-        self.db_client.read.return_value = [fixtures.row(id=1, name="foo")]
+        self.db_client.read_batches.return_value = [[fixtures.row(id=1, name="foo")]]
 
         ws = Workspace(self.client, self.db_client, self.config)
 
         ws.add_user(fixtures.user(id=2, name="bar"))
 
         self.db_client.write.assert_called_once_with(
-                workspace.INSERT_USER.format(
-                    table_name=workspace.USERS_TABLE_NAME),
+                INSERT_USER_SQL,
                 2, "bar")
 
     def test_add_same_user(self):
-        self.db_client.read.return_value = [fixtures.row(id=1, name="foo")]
+        self.db_client.read_batches.return_value = [[fixtures.row(id=1, name="foo")]]
 
         ws = Workspace(self.client, self.db_client, self.config)
 
@@ -107,31 +151,50 @@ class WorkspaceTestCase(unittest.TestCase):
         self.db_client.write.assert_not_called()
 
     def test_add_existing_user(self):
-        self.db_client.read.return_value = [fixtures.row(id=1, name="foo")]
+        self.db_client.read_batches.return_value = [[fixtures.row(id=1, name="foo")]]
 
         ws = Workspace(self.client, self.db_client, self.config)
 
         ws.add_user(fixtures.user(id=1, name="bar"))
 
         self.db_client.write.assert_called_once_with(
-                workspace.INSERT_USER.format(
-                    table_name=workspace.USERS_TABLE_NAME),
+                INSERT_USER_SQL,
                 1, "bar")
 
+    def test_write_back_cache(self):
+        self.config.write_back_cache = True
+        self.db_client.read_batches.return_value = [[fixtures.row(id=1, name="foo")]]
+
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        ws.add_user(fixtures.user(id=1, name="bar"))
+        ws.add_user(fixtures.user(id=2, name="baz"))
+        ws.add_user(fixtures.user(id=1, name="foo"))
+
+        self.db_client.write.assert_not_called()
+        self.db_client.add_commit_hook.assert_called_once_with(ws.flush)
+
+        ws.flush()
+        ws.flush()
+
+        self.db_client.write.assert_called_once_with(
+                'INSERT INTO "users" ("id","name") VALUES (?,?),(?,?) '
+                'ON CONFLICT ("id") DO UPDATE SET "name"=excluded."name";',
+                2, "baz", 1, "foo")
+
     def test_add_new_project(self):
-        self.db_client.read.return_value = [fixtures.row(id=1, name="foo")]
+        self.db_client.read_batches.return_value = [[fixtures.row(id=1, name="foo")]]
 
         ws = Workspace(self.client, self.db_client, self.config)
 
         ws.add_project(fixtures.project(id=2, name="bar"))
 
         self.db_client.write.assert_called_once_with(
-                workspace.INSERT_PROJECT.format(
-                    table_name=workspace.PROJECTS_TABLE_NAME),
+                INSERT_PROJECT_SQL,
                 2, "bar")
 
     def test_add_same_project(self):
-        self.db_client.read.return_value = [fixtures.row(id=1, name="foo")]
+        self.db_client.read_batches.return_value = [[fixtures.row(id=1, name="foo")]]
 
         ws = Workspace(self.client, self.db_client, self.config)
 
@@ -140,29 +203,399 @@ class WorkspaceTestCase(unittest.TestCase):
         self.db_client.write.assert_not_called()
 
     def test_add_existing_project(self):
-        self.db_client.read.return_value = [fixtures.row(id=1, name="foo")]
+        self.db_client.read_batches.return_value = [[fixtures.row(id=1, name="foo")]]
 
         ws = Workspace(self.client, self.db_client, self.config)
 
         ws.add_project(fixtures.project(id=1, name="bar"))
 
         self.db_client.write.assert_called_once_with(
-                workspace.INSERT_PROJECT.format(
-                    table_name=workspace.PROJECTS_TABLE_NAME),
+                INSERT_PROJECT_SQL,
                 1, "bar")
 
     def test_add_follower(self):
-        self.db_client.read.return_value = [fixtures.row(id=2, name="foo")]
+        self.db_client.read_batches.return_value = [[fixtures.row(id=2, name="foo")]]
 
         ws = Workspace(self.client, self.db_client, self.config)
 
         ws.add_follower(1, fixtures.user(id=2, name="foo"))
 
         self.db_client.write.assert_called_once_with(
-                        workspace.INSERT_FOLLOWER.format(
-                            table_name=workspace.FOLLOWERS_TABLE_NAME),
+                        INSERT_FOLLOWER_SQL,
                         (1, 2))
 
+    def test_first_sync_of_task(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        self.assertTrue(ws.first_sync_of_task(1, 10))
+        self.assertTrue(ws.first_sync_of_task(2, 10))
+        self.assertFalse(ws.first_sync_of_task(1, 11))
+        self.assertTrue(ws.first_sync_of_task(1, 10))
+
+    def test_remove_tasks_from_project(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        ws.remove_tasks_from_project(10, "SELECT 1")
+
+        self.assertEqual(self.db_client.mock_calls, [
+            mock.call.write(
+                workspace.DELETE_PROJECT_MEMBERSHIPS_FOR_TASKS.format(
+                    table_name=workspace.PROJECT_MEMBERSHIPS_TABLE_NAME,
+                    task_ids_query="SELECT 1"),
+                10),
+            mock.call.write(
+                workspace.DELETE_ORPHANED_FOLLOWERS.format(
+                    table_name=workspace.FOLLOWERS_TABLE_NAME,
+                    memberships_table_name=workspace.PROJECT_MEMBERSHIPS_TABLE_NAME,
+                    task_ids_query="SELECT 1")),
+            mock.call.write(
+                workspace.DELETE_ORPHANED_CUSTOM_FIELD_VALUES.format(
+                    table_name=workspace.CUSTOM_FIELD_VALUES_TABLE_NAME,
+                    memberships_table_name=workspace.PROJECT_MEMBERSHIPS_TABLE_NAME,
+                    task_ids_query="SELECT 1")),
+            ])
+
+    def test_collect_garbage(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        db_client = SqliteDatabaseWrapper(os.path.join(tmp_dir, "gc.sqlite"))
+        Workspace(self.client, db_client, self.config).create_tables()
+        db_client.write('CREATE TABLE "tasks" (id INTEGER, assignee_id INTEGER);')
+        for sql, rows in [
+                ('INSERT INTO "users" VALUES (?,?);',
+                 [(1, "follower"), (2, "assignee"), (3, "touched"),
+                  (4, "orphan")]),
+                ('INSERT INTO "projects" VALUES (?,?);',
+                 [(10, "member"), (11, "orphan")]),
+                ('INSERT INTO "custom_fields" VALUES (?,?,?);',
+                 [(100, "used", "enum"), (101, "orphan", "enum")]),
+                ('INSERT INTO "custom_field_enum_values" VALUES (?,?,?,?,?);',
+                 [(100, 501, "set", True, "red"),
+                  (100, 502, "unset", True, "red"),
+                  (101, 503, "orphan", True, "red")]),
+                ('INSERT INTO "followers" VALUES (?,?);', [(1000, 1)]),
+                ('INSERT INTO "project_memberships" VALUES (?,?);',
+                 [(1000, 10)]),
+                ('INSERT INTO "custom_field_values" VALUES (?,?,?,?,?);',
+                 [(1000, 100, None, None, 501)]),
+                ('INSERT INTO "tasks" VALUES (?,?);', [(1000, 2), (1001, None)]),
+                ]:
+            db_client.write_many(sql, rows)
+
+        ws = Workspace(self.client, db_client, self.config)
+        ws.users.get(3)
+
+        self.assertEqual(
+                list(ws.collect_garbage([("tasks", "assignee_id")]).items()),
+                [(workspace.USERS_TABLE_NAME, 1),
+                 (workspace.PROJECTS_TABLE_NAME, 1),
+                 (workspace.CUSTOM_FIELDS_TABLE_NAME, 1),
+                 (workspace.CUSTOM_FIELD_ENUM_VALUES_TABLE_NAME, 1)])
+
+        def ids(table_name, column="id"):
+            return sorted(row[0] for row in db_client.read(
+                'SELECT "{}" FROM "{}";'.format(column, table_name)))
+
+        self.assertEqual(ids("users"), [1, 2, 3])
+        self.assertEqual(ids("projects"), [10])
+        self.assertEqual(ids("custom_fields"), [100])
+        self.assertEqual(ids("custom_field_enum_values"), [501, 502])
+        # The caches are loaded again.
+        self.assertIsNone(ws.users.get(4))
+
+    def test_collect_garbage_mssql_temp_table(self):
+        self.config.dialect = "mssql"
+        self.db_client.read_batches.return_value = []
+        self.db_client.write_counted.return_value = 0
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        ws.collect_garbage()
+
+        self.assertEqual(self.db_client.mock_calls[0], mock.call.write(
+            "IF OBJECT_ID('tempdb..#asana2sql_touched_ids') IS NULL "
+            'CREATE TABLE "#asana2sql_touched_ids" '
+            '(id INTEGER NOT NULL PRIMARY KEY);'))
+        self.assertEqual(self.db_client.mock_calls[-1], mock.call.write(
+            'DROP TABLE "#asana2sql_touched_ids";'))
+
+    def test_get_followers(self):
+        self.db_client.read.return_value = [(2,), (3,)]
+
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        self.assertEqual(ws.get_followers(1), {2, 3})
+        self.db_client.read.assert_called_once_with(
+                workspace.SELECT_FOLLOWERS.format(
+                    table_name=workspace.FOLLOWERS_TABLE_NAME),
+                1)
+
+    def test_remove_follower(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        ws.remove_follower(1, 2)
+
+        self.db_client.write.assert_called_once_with(
+                        workspace.DELETE_FOLLOWER.format(
+                            table_name=workspace.FOLLOWERS_TABLE_NAME),
+                        (2, 1))
+
+    def test_get_custom_field_from_project_settings(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+        custom_field = {"id": 5, "name": "Priority", "type": "enum",
+                        "enum_options": []}
+        self.client.get_collection.return_value = [
+                {"custom_field": custom_field}]
+        self.client.get.return_value = {"id": 6}
+
+        ws.prefetch_custom_fields(10)
+        ws.prefetch_custom_fields(10)
+
+        self.assertEqual(ws.get_custom_field(5), custom_field)
+        self.assertEqual(ws.get_custom_field(6), {"id": 6})
+        self.assertEqual(ws.get_custom_field(5), custom_field)
+        self.assertEqual(ws.get_custom_field(6), {"id": 6})
+
+        self.client.get_collection.assert_called_once_with(
+                "/projects/10/custom_field_settings", {},
+                fields=workspace.CUSTOM_FIELD_SETTINGS_FIELDS)
+        self.client.get.assert_called_once_with("/custom_fields/6", "")
+
+    def test_add_custom_field_enum_values(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+        self.db_client.read_batches.return_value = [[
+                fixtures.row(custom_field_id=5, id=1, name="Low", enabled=1,
+                             color="green"),
+                fixtures.row(custom_field_id=5, id=2, name="High", enabled=1,
+                             color="red"),
+                fixtures.row(custom_field_id=5, id=3, name="Old", enabled=1,
+                             color="blue"),
+                fixtures.row(custom_field_id=6, id=4, name="Other", enabled=1,
+                             color="blue")]]
+        self.client.get.return_value = {
+                "id": 5, "name": "Priority", "type": "enum",
+                "enum_options": [
+                    {"id": 1, "name": "Low", "enabled": True, "color": "green"},
+                    {"id": 2, "name": "Highest", "enabled": True, "color": "red"},
+                    {"id": 7, "name": "New", "enabled": False, "color": "none"}]}
+
+        ws.add_custom_field_enum_values(5)
+
+        insert_sql = ws._upsert_sql(workspace.INSERT_CUSTOM_FIELD_ENUM_VALUE,
+                                    workspace.CUSTOM_FIELD_ENUM_VALUES_TABLE_NAME)
+        self.db_client.write.assert_has_calls([
+            mock.call(insert_sql, 5, 2, "Highest", True, "red"),
+            mock.call(insert_sql, 5, 7, "New", False, "none"),
+            mock.call(workspace.DELETE_CUSTOM_FIELD_ENUM_VALUE.format(
+                table_name=workspace.CUSTOM_FIELD_ENUM_VALUES_TABLE_NAME), 3),
+            ])
+        self.assertEqual(self.db_client.write.call_count, 3)
+        self.db_client.read_batches.assert_called_once()
+
+    def test_custom_field_ttl(self):
+        self.config.custom_field_ttl = 0
+        ws = Workspace(self.client, self.db_client, self.config)
+        self.client.get.return_value = {"id": 6}
+
+        ws.get_custom_field(6)
+        ws.get_custom_field(6)
+
+        self.assertEqual(self.client.get.call_count, 2)
+
+    def test_metadata_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.config.metadata_cache = os.path.join(tmp_dir, "metadata.sqlite")
+        self.config.metadata_cache_ttl = None
+        self.client.projects.find_by_id.return_value = fixtures.project(
+                id=10, name="foo")
+        self.client.get_collection.return_value = iter([
+                {"custom_field": {"id": 5, "name": "Five", "type": "text"}}])
+        self.client.get.return_value = {"id": 6, "name": "Six", "type": "text"}
+
+        for _ in range(2):
+            ws = Workspace(self.client, self.db_client, self.config)
+            ws.set_project_modified_at({10: "2017-01-01"})
+            ws.prefetch_custom_fields(10)
+
+            self.assertEqual(ws.get_project(10)["name"], "foo")
+            self.assertEqual(ws.get_custom_field(5)["name"], "Five")
+            self.assertEqual(ws.get_custom_field(6)["name"], "Six")
+
+        self.assertEqual(self.client.projects.find_by_id.call_count, 1)
+        self.assertEqual(self.client.get_collection.call_count, 1)
+        self.assertEqual(self.client.get.call_count, 1)
+
+        self.client.get_collection.return_value = iter([
+                {"custom_field": {"id": 5, "name": "New Five", "type": "text"}}])
+        ws = Workspace(self.client, self.db_client, self.config)
+        ws.set_project_modified_at({10: "2017-01-02"})
+        ws.prefetch_custom_fields(10)
+
+        self.assertEqual(ws.get_custom_field(5)["name"], "New Five")
+        ws.get_project(10)
+        self.assertEqual(self.client.projects.find_by_id.call_count, 2)
+
+    def prefetch(self, ws):
+        value_row = fixtures.row(task_id=1, custom_field_id=5, text_value="foo",
+                number_value=None, enum_value=None)
+        self.db_client.read.side_effect = [
+                [(1, 10), (1, 11), (2, 10)],
+                [(1, 3)],
+                [value_row]]
+
+        ws.prefetch_project(10)
+
+        self.db_client.read.assert_has_calls([
+            mock.call(workspace.SELECT_PROJECT_MEMBERSHIPS_FOR_PROJECT.format(
+                table_name=workspace.PROJECT_MEMBERSHIPS_TABLE_NAME), 10),
+            mock.call(workspace.SELECT_FOLLOWERS_FOR_PROJECT.format(
+                table_name=workspace.FOLLOWERS_TABLE_NAME,
+                memberships_table_name=workspace.PROJECT_MEMBERSHIPS_TABLE_NAME), 10),
+            mock.call(workspace.SELECT_CUSTOM_FIELD_VALUES_FOR_PROJECT.format(
+                table_name=workspace.CUSTOM_FIELD_VALUES_TABLE_NAME,
+                memberships_table_name=workspace.PROJECT_MEMBERSHIPS_TABLE_NAME), 10),
+            ])
+        self.db_client.reset_mock()
+        return value_row
+
+    def test_prefetch_project(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+        value_row = self.prefetch(ws)
+
+        self.assertEqual(ws.task_memberships(1), [10, 11])
+        self.assertEqual(ws.task_memberships(2), [10])
+        self.assertEqual(ws.get_followers(1), {3})
+        self.assertEqual(ws.get_followers(2), set())
+        self.assertEqual(ws.task_custom_field_values(1), [value_row])
+        self.assertEqual(ws.task_custom_field_values(2), [])
+
+        self.db_client.read.assert_not_called()
+
+    def test_prefetch_misses_and_writes_read_through(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+        self.prefetch(ws)
+        self.db_client.read.side_effect = None
+        self.db_client.read.return_value = []
+
+        ws.remove_follower(1, 3)
+        ws.get_followers(1)
+        ws.task_memberships(3)
+
+        self.assertEqual(self.db_client.read.call_count, 2)
+
+    def test_prefetch_task_from_another_project_reads_through(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        db_client = SqliteDatabaseWrapper(os.path.join(tmp_dir, "moved.sqlite"))
+        ws = Workspace(self.client, db_client, self.config)
+        ws.create_tables()
+        db_client.write(
+                'INSERT INTO "project_memberships" VALUES (?,?);', (10, 1))
+        for user_id in [100, 200]:
+            db_client.write('INSERT INTO "followers" VALUES (?,?);',
+                            (10, user_id))
+
+        ws.prefetch_project(2)
+
+        self.assertEqual(ws.task_memberships(10), [1])
+        self.assertEqual(ws.get_followers(10), {100, 200})
+
+    def test_clear_prefetch(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+        self.prefetch(ws)
+        self.db_client.read.side_effect = None
+        self.db_client.read.return_value = []
+
+        ws.clear_prefetch()
+        ws.task_memberships(1)
+
+        self.db_client.read.assert_called_once_with(
+                workspace.SELECT_PROJECT_MEMBERSHIPS.format(
+                    table_name=workspace.PROJECT_MEMBERSHIPS_TABLE_NAME),
+                1)
+
+    def test_last_sync_time(self):
+        self.db_client.read.return_value = [("2017-01-01T00:00:00.000000Z",)]
+
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        self.assertEqual(ws.last_sync_time(1), "2017-01-01T00:00:00.000000Z")
+        self.db_client.read.assert_called_once_with(
+                workspace.SELECT_SYNC_STATE.format(
+                    table_name=workspace.SYNC_STATE_TABLE_NAME),
+                1)
+
+    def test_never_synced(self):
+        self.db_client.read.return_value = []
+
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        self.assertIsNone(ws.last_sync_time(1))
+
+    def test_set_last_sync_time(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        ws.set_last_sync_time(1, "2017-01-01T00:00:00.000000Z")
+        ws.set_last_sync_time(2, "2017-01-01T00:00:00.000000Z")
+
+        self.assertEqual(self.db_client.write.call_args_list, [
+                mock.call(workspace.CREATE_SYNC_STATE_TABLE.format(
+                    table_name=workspace.SYNC_STATE_TABLE_NAME)),
+                mock.call(INSERT_SYNC_STATE_SQL,
+                          1, "2017-01-01T00:00:00.000000Z"),
+                mock.call(INSERT_SYNC_STATE_SQL,
+                          2, "2017-01-01T00:00:00.000000Z"),
+                ])
+
+    def test_sync_state_table_created_on_old_database(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        db_client = SqliteDatabaseWrapper(os.path.join(tmp_dir, "old.sqlite"))
+        ws = Workspace(self.client, db_client, self.config)
+
+        self.assertIsNone(ws.last_sync_time(1))
+        ws.set_last_sync_time(1, "2017-01-01T00:00:00.000000Z")
+        self.assertEqual(ws.last_sync_time(1), "2017-01-01T00:00:00.000000Z")
+
+    def test_checkpoint(self):
+        checkpoint = fixtures.row(project_id=1, command="export")
+        self.db_client.read.return_value = [checkpoint]
+
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        self.assertEqual(ws.checkpoint(1), checkpoint)
+        self.db_client.read.assert_called_once_with(
+                workspace.SELECT_CHECKPOINT.format(
+                    table_name=workspace.CHECKPOINTS_TABLE_NAME),
+                1)
+
+    def test_save_and_clear_checkpoint(self):
+        ws = Workspace(self.client, self.db_client, self.config)
+
+        ws.save_checkpoint(1, "export", "2017-01-01T00:00:00.000000Z", "offset", 2)
+        ws.clear_checkpoint(1)
+
+        self.assertEqual(self.db_client.write.call_args_list, [
+            mock.call(workspace.CREATE_CHECKPOINTS_TABLE.format(
+                          table_name=workspace.CHECKPOINTS_TABLE_NAME)),
+            mock.call(INSERT_CHECKPOINT_SQL,
+                      1, "export", "2017-01-01T00:00:00.000000Z", "offset", 2),
+            mock.call(workspace.DELETE_CHECKPOINT.format(
+                          table_name=workspace.CHECKPOINTS_TABLE_NAME),
+                      1)])
+
+    def test_checkpoints_table_created_on_old_database(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        db_client = SqliteDatabaseWrapper(os.path.join(tmp_dir, "old.sqlite"))
+        ws = Workspace(self.client, db_client, self.config)
+
+        self.assertIsNone(ws.checkpoint(1))
+        ws.save_checkpoint(1, "export", "2017-01-01T00:00:00.000000Z", "offset", 2)
+        self.assertEqual(ws.checkpoint(1).last_task_id, 2)
+        ws.clear_checkpoint(1)
+        self.assertIsNone(ws.checkpoint(1))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Measures the per-row CPU cost of building task INSERT statements.
+
+Compares the per-row path Project.insert_or_replace used to take for the
+direct fields, which formatted the statement and looped over the fields for
+every task, with the compiled row plan.  Writes go to a dry DatabaseWrapper, so only the Python
+overhead is measured.
+"""
+
+import argparse
+import time
+
+from asana2sql import test_fixtures as fixtures
+from asana2sql import util
+from asana2sql.db_wrapper import DatabaseWrapper
+from asana2sql.fields import default_fields
+from asana2sql.project import Project
+
+
+INSERT_OR_REPLACE_TEMPLATE = (
+        """INSERT OR REPLACE INTO "{table_name}" ({columns}) VALUES ({values});""")
+
+
+class NullWorkspace(object):
+    def add_user(self, user):
+        pass
+
+
+class Config(object):
+    project_id = 1
+    table_name = "benchmark_tasks"
+    skip_unchanged = False
+    prefetch_tasks = 0
+    commit_every = 0
+    dialect = "sqlite_replace"
+
+
+def per_row_insert(proj, db_client, task):
+    fields = proj._direct_fields
+    columns = ",".join(field.sql_name for field in fields)
+    values = ",".join("?" for field in fields)
+    params = [field.get_data_from_task(task) for field in fields]
+    db_client.write(
+            INSERT_OR_REPLACE_TEMPLATE.format(
+                table_name=util.sql_safe_name(proj._table_name),
+                columns=columns,
+                values=values),
+            *params)
+
+
+def compiled_insert(proj, db_client, task):
+    row_plan = proj._row_plan()
+    db_client.write(row_plan.sql, *row_plan.params(task))
+
+
+def time_per_row(insert, proj, db_client, tasks, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        for task in tasks:
+            insert(proj, db_client, task)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db_client = DatabaseWrapper(None, dry=True)
+    proj = Project(None, db_client, None, Config(),
+                   default_fields(NullWorkspace()))
+    tasks = [fixtures.task(id=i, name="Task {}".format(i), completed=i % 2)
+             for i in range(args.tasks)]
+
+    before = time_per_row(per_row_insert, proj, db_client, tasks, args.repeat)
+    after = time_per_row(compiled_insert, proj, db_client, tasks, args.repeat)
+
+    print("per-row path:  {:.2f} us/row".format(before * 1e6))
+    print("compiled plan: {:.2f} us/row".format(after * 1e6))
+    print("speedup:       {:.2f}x".format(before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Synthetic Asana workspaces served by an in-process stand-in for the client.
+
+Tasks are generated on demand from their ids, so large workspaces cost little
+memory in the benchmark process itself and runs are reproducible for a seed.
+"""
+
+import datetime
+import random
+
+import asana.error
+
+from asana2sql import util
+
+CUSTOM_FIELD_TYPES = ["text", "number", "enum"]
+ASSIGNEE_STATUSES = ["inbox", "today", "upcoming", "later"]
+ENUM_COLORS = ["red", "orange", "yellow", "green", "blue", "purple"]
+
+# Project and custom field ids are offset from task and user ids so that no
+# two objects share an id.
+PROJECT_ID_BASE = 10 ** 9
+USER_ID_BASE = 2 * 10 ** 9
+CUSTOM_FIELD_ID_BASE = 3 * 10 ** 9
+ENUM_OPTION_ID_BASE = 4 * 10 ** 9
+
+PAGE_SIZE = 100
+
+EPOCH = datetime.datetime(2017, 1, 1)
+
+
+class SyntheticWorkspace(object):
+    """A workspace of projects, users, custom fields and tasks.
+
+    Each project has tasks_per_project tasks of its own, and multi_homed_fraction
+    of them are also in the next project.  Every task has followers_per_task
+    followers and a value for each custom field.
+
+    Calling revise() produces the next revision of the workspace: a
+    changed_fraction of the tasks are modified and a removed_fraction are
+    deleted, as seen by the next sync.
+    """
+
+    def __init__(self, num_projects=1, tasks_per_project=1000, num_users=100,
+                 num_custom_fields=5, enum_options_per_field=5,
+                 followers_per_task=2, multi_homed_fraction=0.1,
+                 changed_fraction=0.1, removed_fraction=0.01, seed=0):
+        self.num_projects = num_projects
+        self.tasks_per_project = tasks_per_project
+        self.num_users = num_users
+        self.num_custom_fields = num_custom_fields
+        self.enum_options_per_field = enum_options_per_field
+        self.followers_per_task = min(followers_per_task, num_users)
+        self.multi_homed_fraction = multi_homed_fraction
+        self.changed_fraction = changed_fraction
+        self.removed_fraction = removed_fraction
+        self.seed = seed
+        self.revision = 0
+
+    def revise(self):
+        self.revision += 1
+
+    # Ids
+    def project_ids(self):
+        return [PROJECT_ID_BASE + i for i in range(self.num_projects)]
+
+    def _project_index(self, project_id):
+        index = project_id - PROJECT_ID_BASE
+        if not 0 <= index < self.num_projects:
+            raise asana.error.NotFoundError()
+        return index
+
+    def _home_project_index(self, task_id):
+        return (task_id - 1) // self.tasks_per_project
+
+    def _fraction(self, task_id, salt):
+        """A number in [0, 1) fixed for the task, seed and salt."""
+        return random.Random(
+                "{}:{}:{}".format(self.seed, salt, task_id)).random()
+
+    def _is_multi_homed(self, task_id):
+        return (self.num_projects > 1 and
+                self._fraction(task_id, "multi_homed") < self.multi_homed_fraction)
+
+    def _is_removed(self, task_id):
+        return (self.revision > 0 and
+                self._fraction(task_id, "removed") < self.removed_fraction)
+
+    def _task_revision(self, task_id):
+        """The last revision in which the task changed."""
+        for revision in range(self.revision, 0, -1):
+            if (self._fraction(task_id, "changed{}".format(revision)) <
+                    self.changed_fraction):
+                return revision
+        return 0
+
+    def task_ids(self, project_id):
+        index = self._project_index(project_id)
+        own = range(index * self.tasks_per_project + 1,
+                    (index + 1) * self.tasks_per_project + 1)
+        previous = (index - 1) % self.num_projects
+        homed = (task_id for task_id in range(
+                     previous * self.tasks_per_project + 1,
+                     (previous + 1) * self.tasks_per_project + 1)
+                 if self._is_multi_homed(task_id))
+        task_ids = list(own) + (list(homed) if previous != index else [])
+        return [task_id for task_id in task_ids if not self._is_removed(task_id)]
+
+    def num_tasks(self):
+        return sum(len(self.task_ids(project_id))
+                   for project_id in self.project_ids())
+
+    # Objects
+    def project(self, project_id):
+        index = self._project_index(project_id)
+        return {"id": project_id, "name": "Project {}".format(index)}
+
+    def user(self, index):
+        return {"id": USER_ID_BASE + index, "name": "User {}".format(index)}
+
+    def custom_field(self, index):
+        custom_field = {
+                "id": CUSTOM_FIELD_ID_BASE + index,
+                "name": "Custom Field {}".format(index),
+                "type": CUSTOM_FIELD_TYPES[index % len(CUSTOM_FIELD_TYPES)],
+                }
+        if custom_field["type"] == "enum":
+            custom_field["enum_options"] = [
+                    self.enum_option(index, option)
+                    for option in range(self.enum_options_per_field)]
+        return custom_field
+
+    def custom_field_by_id(self, custom_field_id):
+        index = custom_field_id - CUSTOM_FIELD_ID_BASE
+        if not 0 <= index < self.num_custom_fields:
+            raise asana.error.NotFoundError()
+        return self.custom_field(index)
+
+    def enum_option(self, field_index, option):
+        return {"id": (ENUM_OPTION_ID_BASE +
+                       field_index * self.enum_options_per_field + option),
+                "name": "Option {}".format(option),
+                "enabled": True,
+                "color": ENUM_COLORS[option % len(ENUM_COLORS)]}
+
+    def task(self, task_id):
+        revision = self._task_revision(task_id)
+        rng = random.Random("{}:task:{}:{}".format(self.seed, task_id, revision))
+
+        home = self._home_project_index(task_id)
+        project_indices = [home]
+        if self._is_multi_homed(task_id):
+            project_indices.append((home + 1) % self.num_projects)
+
+        created_at = EPOCH + datetime.timedelta(minutes=task_id)
+        modified_at = created_at + datetime.timedelta(days=revision)
+
+        custom_fields = []
+        for index in range(self.num_custom_fields):
+            custom_field = self.custom_field(index)
+            custom_field.pop("enum_options", None)
+            if custom_field["type"] == "text":
+                custom_field["text_value"] = "Value {}".format(rng.randint(0, 99))
+            elif custom_field["type"] == "number":
+                custom_field["number_value"] = rng.randint(0, 1000)
+            elif self.enum_options_per_field:
+                custom_field["enum_value"] = self.enum_option(
+                        index, rng.randrange(self.enum_options_per_field))
+            custom_fields.append(custom_field)
+
+        return {
+                "id": task_id,
+                "name": "Task {} revision {}".format(task_id, revision),
+                "notes": "Notes for task {}.".format(task_id),
+                "completed": rng.random() < 0.5,
+                "created_at": util.asana_timestamp(created_at),
+                "modified_at": util.asana_timestamp(modified_at),
+                "completed_at": None,
+                "due_on": None,
+                "due_at": None,
+                "num_hearts": rng.randint(0, 3),
+                "parent": None,
+                "assignee": self.user(rng.randrange(self.num_users)),
+                "assignee_status": rng.choice(ASSIGNEE_STATUSES),
+                "projects": [self.project(PROJECT_ID_BASE + index)
+                             for index in project_indices],
+                "followers": [self.user(index) for index in rng.sample(
+                    range(self.num_users), self.followers_per_task)],
+                "custom_fields": custom_fields,
+                }
+
+
+class _Projects(object):
+    def __init__(self, client):
+        self._client = client
+
+    def find_by_id(self, project_id, params={}, **options):
+        self._client._count_request()
+        return self._client.workspace.project(project_id)
+
+    def _all(self, params={}, **options):
+        workspace = self._client.workspace
+        for i in range(0, workspace.num_projects, PAGE_SIZE):
+            self._client._count_request()
+            for project_id in workspace.project_ids()[i:i + PAGE_SIZE]:
+                yield workspace.project(project_id)
+
+    def find_by_team(self, team_id, params={}, **options):
+        return self._all(params, **options)
+
+    def find_by_workspace(self, workspace_id, params={}, **options):
+        return self._all(params, **options)
+
+
+class _Tasks(object):
+    def __init__(self, client):
+        self._client = client
+
+    def _items(self, task_ids):
+        for i in range(0, len(task_ids), PAGE_SIZE):
+            self._client._count_request()
+            for task_id in task_ids[i:i + PAGE_SIZE]:
+                yield self._client.workspace.task(task_id)
+
+    def find_by_project(self, project_id, params={}, **options):
+        task_ids = self._client.workspace.task_ids(project_id)
+        if options.get("iterator_type", "items") is not None:
+            return self._items(task_ids)
+
+        # A single page, as returned with iterator_type=None and
+        # full_payload=True.
+        self._client._count_request()
+        start = int(options.get("offset") or 0)
+        limit = options.get("limit", PAGE_SIZE)
+        page = {"data": [self._client.workspace.task(task_id)
+                         for task_id in task_ids[start:start + limit]]}
+        if start + limit < len(task_ids):
+            page["next_page"] = {"offset": str(start + limit)}
+        return page
+
+    def find_all(self, params={}, **options):
+        workspace = self._client.workspace
+        modified_since = params.get("modified_since")
+        task_ids = [task_id for task_id in workspace.task_ids(params["project"])
+                    if not modified_since or
+                    workspace.task(task_id)["modified_at"] >= modified_since]
+        return self._items(task_ids)
+
+
+class FakeAsanaClient(object):
+    """Serves a SyntheticWorkspace through the parts of asana.Client used by
+    asana2sql, counting one request per page like the real client."""
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.projects = _Projects(self)
+        self.tasks = _Tasks(self)
+        self._num_requests = 0
+
+    @property
+    def num_requests(self):
+        return self._num_requests
+
+    def _count_request(self):
+        self._num_requests += 1
+
+    def get(self, path, query, **options):
+        self._count_request()
+        prefix = "/custom_fields/"
+        if path.startswith(prefix):
+            return self.workspace.custom_field_by_id(int(path[len(prefix):]))
+        raise asana.error.NotFoundError()
+
+    def get_collection(self, path, query, **options):
+        # Every project has every custom field.
+        (_, resource, project_id, collection) = path.split("/")
+        if resource != "projects" or collection != "custom_field_settings":
+            raise asana.error.NotFoundError()
+        self.workspace.project(int(project_id))
+        settings = [{"custom_field": self.workspace.custom_field(index)}
+                    for index in range(self.workspace.num_custom_fields)]
+        for i in range(0, max(len(settings), 1), PAGE_SIZE):
+            self._count_request()
+            for setting in settings[i:i + PAGE_SIZE]:
+                yield setting
@@ -0,0 +1,114 @@
+import unittest
+
+import asana.error
+
+from benchmarks import synthetic
+from benchmarks import workspace_benchmark
+
+
+class SyntheticWorkspaceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workspace = synthetic.SyntheticWorkspace(
+                num_projects=2, tasks_per_project=50, num_users=10,
+                num_custom_fields=3, enum_options_per_field=2,
+                followers_per_task=3, multi_homed_fraction=0.2,
+                changed_fraction=0.5, removed_fraction=0.1)
+        self.project_ids = self.workspace.project_ids()
+
+    def test_tasks(self):
+        task_ids = self.workspace.task_ids(self.project_ids[0])
+        task = self.workspace.task(task_ids[0])
+
+        self.assertEqual(task, self.workspace.task(task_ids[0]))
+        self.assertEqual(len(task["followers"]), 3)
+        self.assertEqual([field["type"] for field in task["custom_fields"]],
+                         ["text", "number", "enum"])
+        self.assertIn(self.project_ids[0],
+                      [project["id"] for project in task["projects"]])
+
+    def test_multi_homed_tasks(self):
+        multi_homed = (set(self.workspace.task_ids(self.project_ids[0])) &
+                       set(self.workspace.task_ids(self.project_ids[1])))
+
+        self.assertTrue(multi_homed)
+        for task_id in multi_homed:
+            self.assertEqual(
+                    sorted(project["id"] for project in
+                           self.workspace.task(task_id)["projects"]),
+                    self.project_ids)
+
+    def test_revise(self):
+        task_ids = self.workspace.task_ids(self.project_ids[0])
+        tasks = [self.workspace.task(task_id) for task_id in task_ids]
+
+        self.workspace.revise()
+
+        revised_ids = self.workspace.task_ids(self.project_ids[0])
+        self.assertTrue(set(revised_ids) < set(task_ids))
+        changed = [task for task in tasks if task["id"] in revised_ids and
+                   self.workspace.task(task["id"]) != task]
+        self.assertTrue(changed)
+        for task in changed:
+            self.assertTrue(self.workspace.task(task["id"])["modified_at"] >
+                            task["modified_at"])
+
+
+class FakeAsanaClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workspace = synthetic.SyntheticWorkspace(
+                num_projects=1, tasks_per_project=250)
+        self.client = synthetic.FakeAsanaClient(self.workspace)
+        self.project_id = self.workspace.project_ids()[0]
+
+    def test_find_by_project(self):
+        tasks = list(self.client.tasks.find_by_project(
+            self.project_id, fields="id"))
+
+        self.assertEqual([task["id"] for task in tasks],
+                         self.workspace.task_ids(self.project_id))
+        self.assertEqual(self.client.num_requests, 3)
+
+    def test_find_by_project_pages(self):
+        page = self.client.tasks.find_by_project(
+                self.project_id, iterator_type=None, full_payload=True,
+                limit=100, offset="200")
+
+        self.assertEqual(len(page["data"]), 50)
+        self.assertNotIn("next_page", page)
+
+    def test_find_all_modified_since(self):
+        self.workspace.revise()
+
+        tasks = list(self.client.tasks.find_all(
+            {"project": self.project_id,
+             "modified_since": "2017-01-01T12:00:00.000000Z"}))
+
+        self.assertTrue(0 < len(tasks) < 250)
+
+    def test_custom_fields(self):
+        custom_field = self.client.get(
+                "/custom_fields/{}".format(synthetic.CUSTOM_FIELD_ID_BASE + 2), "")
+
+        self.assertEqual(custom_field["type"], "enum")
+        self.assertEqual(len(custom_field["enum_options"]), 5)
+        settings = list(self.client.get_collection(
+            "/projects/{}/custom_field_settings".format(self.project_id), {}))
+        self.assertEqual([setting["custom_field"]["id"] for setting in settings],
+                         [synthetic.CUSTOM_FIELD_ID_BASE + i for i in range(5)])
+        with self.assertRaises(asana.error.NotFoundError):
+            self.client.projects.find_by_id(1)
+
+
+class WorkspaceBenchmarkTestCase(unittest.TestCase):
+    def test_run(self):
+        args = ["--projects", "2", "--tasks_per_project", "20",
+                "--buffered_writes"]
+
+        self.assertEqual(workspace_benchmark.main(args), 0)
+        self.assertEqual(
+                workspace_benchmark.main(args + ["--max_statements_per_task", "0"]),
+                1)
+
+
+if __name__ == '__main__':
+    unittest.main()
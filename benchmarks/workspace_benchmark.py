@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""Measures asana2sql throughput on a synthetic workspace, without the network.
+
+Runs create, a full export into an empty SQLite database, and a synchronize
+after a revision of the workspace has changed and removed some tasks.  Reports
+tasks per second, SQL statements per task and API requests per command, and
+the process's peak RSS.  Exits with status 1 if a regression threshold is
+missed.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from asana2sql import perf
+from asana2sql.fields import default_fields
+from asana2sql.project import Project
+from asana2sql.sqlite_wrapper import SqliteDatabaseWrapper
+from asana2sql.workspace import Workspace
+from benchmarks.synthetic import FakeAsanaClient, SyntheticWorkspace
+
+TABLE_NAME_OPTIONS = [
+        "projects_table_name",
+        "project_memberships_table_name",
+        "users_table_name",
+        "followers_table_name",
+        "custom_fields_table_name",
+        "custom_field_enum_values_table_name",
+        "custom_field_values_table_name",
+        "sync_state_table_name",
+        "checkpoints_table_name",
+        ]
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    workspace_args = parser.add_argument_group("Synthetic Workspace")
+    workspace_args.add_argument("--projects", type=int, default=2)
+    workspace_args.add_argument("--tasks_per_project", type=int, default=2000)
+    workspace_args.add_argument("--users", type=int, default=200)
+    workspace_args.add_argument("--custom_fields", type=int, default=6)
+    workspace_args.add_argument("--enum_options", type=int, default=5)
+    workspace_args.add_argument("--followers_per_task", type=int, default=2)
+    workspace_args.add_argument("--multi_homed_fraction", type=float, default=0.1)
+    workspace_args.add_argument("--changed_fraction", type=float, default=0.1)
+    workspace_args.add_argument("--removed_fraction", type=float, default=0.01)
+    workspace_args.add_argument("--seed", type=int, default=0)
+
+    run_args = parser.add_argument_group("Run Options")
+    run_args.add_argument("--dialect", default="sqlite")
+    run_args.add_argument("--buffered_writes", action="store_true", default=False)
+    run_args.add_argument("--bulk_load", action="store_true", default=False)
+    run_args.add_argument("--skip_unchanged", action="store_true", default=False)
+    run_args.add_argument("--prefetch_tasks", type=int, default=0)
+    run_args.add_argument("--commit_every", type=int, default=0)
+    run_args.add_argument("--cache_max_rows", type=int)
+    run_args.add_argument("--write_back_cache", action="store_true",
+                          default=False)
+    run_args.add_argument(
+            "--sqlite_path",
+            help="Database file to use.  Defaults to a temporary file.")
+    run_args.add_argument("--json", help="Write the results to this file.")
+
+    threshold_args = parser.add_argument_group("Regression Thresholds")
+    threshold_args.add_argument("--min_tasks_per_second", type=float)
+    threshold_args.add_argument("--max_statements_per_task", type=float)
+    threshold_args.add_argument("--max_peak_rss_mb", type=float)
+
+    return parser
+
+
+def build_config(args, project_id):
+    config = argparse.Namespace(
+            project_id=project_id,
+            table_name=None,
+            dialect=args.dialect,
+            skip_unchanged=args.skip_unchanged,
+            prefetch_tasks=args.prefetch_tasks,
+            commit_every=args.commit_every,
+            custom_field_ttl=None,
+            cache_max_rows=args.cache_max_rows,
+            write_back_cache=args.write_back_cache,
+            metadata_cache=None)
+    for option in TABLE_NAME_OPTIONS:
+        setattr(config, option, None)
+    return config
+
+
+def run_command(command, client, db_wrapper, workspace, projects):
+    """Runs the command over the projects and returns its measurements."""
+    api_requests = client.num_requests
+    statements = db_wrapper.num_executed
+    num_tasks = client.workspace.num_tasks() if command != "create" else 0
+
+    start = timeit.default_timer()
+    if command == "create":
+        for project in projects:
+            project.create_table()
+        workspace.create_tables()
+    else:
+        for project in projects:
+            getattr(project, command)()
+    db_wrapper.commit()
+    seconds = timeit.default_timer() - start
+
+    statements = db_wrapper.num_executed - statements
+    return {
+            "command": command,
+            "tasks": num_tasks,
+            "seconds": seconds,
+            "tasks_per_second": num_tasks / seconds if num_tasks else None,
+            "statements": statements,
+            "statements_per_task": (float(statements) / num_tasks
+                                    if num_tasks else None),
+            "api_requests": client.num_requests - api_requests,
+            }
+
+
+def run(args, db_path):
+    synthetic = SyntheticWorkspace(
+            num_projects=args.projects,
+            tasks_per_project=args.tasks_per_project,
+            num_users=args.users,
+            num_custom_fields=args.custom_fields,
+            enum_options_per_field=args.enum_options,
+            followers_per_task=args.followers_per_task,
+            multi_homed_fraction=args.multi_homed_fraction,
+            changed_fraction=args.changed_fraction,
+            removed_fraction=args.removed_fraction,
+            seed=args.seed)
+    client = FakeAsanaClient(synthetic)
+    db_wrapper = SqliteDatabaseWrapper(db_path, buffered=args.buffered_writes)
+
+    def build_projects():
+        # Fresh objects per command, as in separate runs of asana2sql.
+        configs = [build_config(args, project_id)
+                   for project_id in synthetic.project_ids()]
+        workspace = Workspace(client, db_wrapper, configs[0])
+        return workspace, [
+                Project(client, db_wrapper, workspace, config,
+                        default_fields(workspace))
+                for config in configs]
+
+    results = []
+    for command in ["create", "export", "synchronize"]:
+        if command == "synchronize":
+            synthetic.revise()
+        workspace, projects = build_projects()
+        if args.bulk_load:
+            with db_wrapper.bulk_load():
+                results.append(run_command(
+                    command, client, db_wrapper, workspace, projects))
+        else:
+            results.append(run_command(
+                command, client, db_wrapper, workspace, projects))
+    return results
+
+
+def check_thresholds(args, results, peak_rss_bytes):
+    """Returns a message for each missed threshold."""
+    failures = []
+    for result in results:
+        if not result["tasks"]:
+            continue
+        if (args.min_tasks_per_second is not None and
+                result["tasks_per_second"] < args.min_tasks_per_second):
+            failures.append("{}: {:.0f} tasks/s is below {:.0f}".format(
+                result["command"], result["tasks_per_second"],
+                args.min_tasks_per_second))
+        if (args.max_statements_per_task is not None and
+                result["statements_per_task"] > args.max_statements_per_task):
+            failures.append("{}: {:.2f} statements/task is above {:.2f}".format(
+                result["command"], result["statements_per_task"],
+                args.max_statements_per_task))
+    if (args.max_peak_rss_mb is not None and peak_rss_bytes is not None and
+            peak_rss_bytes > args.max_peak_rss_mb * (1 << 20)):
+        failures.append("peak RSS {:.1f} MB is above {:.1f} MB".format(
+            peak_rss_bytes / float(1 << 20), args.max_peak_rss_mb))
+    return failures
+
+
+def print_results(results, peak_rss_bytes):
+    print("{:<12} {:>8} {:>9} {:>10} {:>12} {:>9}".format(
+        "command", "tasks", "seconds", "tasks/s", "stmts/task", "requests"))
+    for result in results:
+        print("{:<12} {:>8} {:>9.2f} {:>10} {:>12} {:>9}".format(
+            result["command"],
+            result["tasks"],
+            result["seconds"],
+            "-" if result["tasks_per_second"] is None
+                else "{:.0f}".format(result["tasks_per_second"]),
+            "-" if result["statements_per_task"] is None
+                else "{:.2f}".format(result["statements_per_task"]),
+            result["api_requests"]))
+    if peak_rss_bytes is not None:
+        print("Peak RSS: {:.1f} MB".format(peak_rss_bytes / float(1 << 20)))
+
+
+def main(argv=None):
+    args = arg_parser().parse_args(argv)
+
+    tmp_dir = None
+    db_path = args.sqlite_path
+    if not db_path:
+        tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(tmp_dir, "benchmark.sqlite")
+    try:
+        results = run(args, db_path)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    peak_rss_bytes = perf.peak_rss_bytes()
+    failures = check_thresholds(args, results, peak_rss_bytes)
+
+    print_results(results, peak_rss_bytes)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results,
+                       "peak_rss_bytes": peak_rss_bytes,
+                       "failures": failures},
+                      f, indent=2, sort_keys=True)
+    for failure in failures:
+        print("REGRESSION: " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,4 +7,5 @@ setup(name='asana2sql',
       author='Asana, Inc.',
       license='MIT',
       packages=find_packages(exclude="test"),
-      install_requires=[])
+      install_requires=[],
+      tests_require=['mock'])